@@ -2,4 +2,4 @@ from electroncash.i18n import _
 
 fullname = "Donate Spare Change"
 description = _("Automatically donate change outputs to charities (or any address) of our choice, to protect your privacy and also go good!")
-available_for = ['qt']
+available_for = ['qt', 'cmdline']
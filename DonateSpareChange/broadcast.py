@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import heapq, itertools, threading, time
+from collections import OrderedDict
+
+from electroncash.util import PrintError
+
+from .metrics import Metrics
+
+
+class BroadcastQueue(PrintError):
+    ''' Broadcasts transactions from background threads, so that no server round trip ever blocks the GUI thread.
+
+        - At most max_in_flight broadcasts are outstanding at any time.
+        - A failed broadcast is retried with exponential backoff (base_delay, 2*base_delay, ... capped at max_delay), up to
+          max_attempts times, unless the server's error says that retrying can't possibly help.
+        - Submissions are de-duplicated by txid: a tx that is queued, in flight, or was recently accepted (one of the last
+          max_accepted) is not queued again. Past that, the engine knows the coins it spends are in flight anyway.
+        - on_result(txid, ok, msg, context) is called from a worker thread exactly once per accepted submission, with the
+          final outcome. 'context' is whatever the caller passed to submit().
+
+        Worker threads are started as txs are submitted, and exit once there is nothing left to broadcast.
+
+        The only thing required of 'network' is a broadcast_transaction(tx) (or, on older Electron Cash, broadcast(tx))
+        method returning a (status, msg) tuple, which makes it easy to drive this class with a stub network object. '''
+
+    # Server errors meaning the tx is already known, i.e.: it was accepted
+    ALREADY_KNOWN = ('txn-already-known', 'txn-already-in-mempool', 'transaction already in block chain')
+    # Server errors meaning retrying is pointless
+    PERMANENT = ('missing inputs', 'missingorspent', 'txn-mempool-conflict', 'bad-txns-inputs-spent', 'non-final', 'dust')
+
+    def __init__(self, network, on_result, max_in_flight = 2, max_attempts = 5, base_delay = 2.0, max_delay = 60.0, max_accepted = 1000,
+                 metrics = None):
+        self.network = network
+        self.on_result = on_result
+        self.metrics = metrics or Metrics()
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.heap = list() # (due_time, seq, txid) -- work that is ready at due_time
+        self.items = dict() # txid -> [tx, context, attempts]. covers both queued and in-flight txs.
+        self.accepted = OrderedDict() # txid -> None, for the last max_accepted txids the network accepted, oldest first
+        self.max_accepted = max(1, max_accepted)
+        self.seq = itertools.count()
+        self.threads = list() # the running workers
+        self.closed = False
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    def _bcast_func(self):
+        network = self.network
+        if hasattr(network, 'broadcast_transaction'):
+            return network.broadcast_transaction
+        elif hasattr(network, 'broadcast'):
+            return network.broadcast
+        return None
+
+    def submit(self, tx, context = None):
+        ''' Queues tx for broadcast. Returns False if the tx is a duplicate (or we are closed), True otherwise. '''
+        txid = tx.txid()
+        with self.cond:
+            if self.closed or txid in self.items or txid in self.accepted:
+                return False
+            self.items[txid] = [tx, context, 0]
+            heapq.heappush(self.heap, (time.monotonic(), next(self.seq), txid))
+            if len(self.threads) < self.max_in_flight:
+                t = threading.Thread(target = self._worker, name = "DonateSpareChange broadcast", daemon = True)
+                self.threads.append(t)
+                t.start()
+            self.cond.notify()
+        return True
+
+    def pending(self):
+        ''' Number of txs queued or in flight. '''
+        with self.cond:
+            return len(self.items)
+
+    def close(self):
+        ''' Stops the workers. Queued txs are dropped (without on_result being called); in-flight ones finish. '''
+        with self.cond:
+            self.closed = True
+            self.heap = list()
+            self.items.clear()
+            self.cond.notify_all()
+
+    def _next(self):
+        ''' Blocks until a queued tx is due, and returns its txid. Returns None when closed or when the queue is empty, upon
+        which the calling worker must exit (it is no longer in self.threads). A tx in flight elsewhere is its worker's
+        business: that worker re-queues it if it needs a retry. '''
+        with self.cond:
+            while not self.closed and self.heap:
+                now = time.monotonic()
+                if self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                self.cond.wait(self.heap[0][0] - now)
+            if threading.current_thread() in self.threads:
+                self.threads.remove(threading.current_thread())
+            return None
+
+    def _worker(self):
+        while True:
+            txid = self._next()
+            if txid is None:
+                return
+            with self.cond:
+                item = self.items.get(txid)
+            if item is None:
+                continue # dropped by close()
+            tx, context, attempts = item
+            try:
+                bcast = self._bcast_func()
+                if not bcast:
+                    raise RuntimeError("Don't know how to broadcast a transaction")
+                with self.metrics.time('broadcast'):
+                    status, msg = bcast(tx)
+            except Exception as e:
+                status, msg = False, repr(e)
+            msg_l = str(msg).lower()
+            if not status and any(m in msg_l for m in self.ALREADY_KNOWN):
+                status, msg = True, txid
+            attempts += 1
+            with self.cond:
+                if self.closed:
+                    return
+                if status:
+                    del self.items[txid]
+                    self.accepted[txid] = None
+                    if len(self.accepted) > self.max_accepted:
+                        self.accepted.popitem(last = False)
+                    done = True
+                    self.metrics.add('broadcast_ok')
+                elif attempts < self.max_attempts and not any(m in msg_l for m in self.PERMANENT):
+                    delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+                    item[2] = attempts
+                    heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), txid))
+                    self.cond.notify()
+                    done = False
+                    self.metrics.add('broadcast_retries')
+                    self.print_error("Broadcast of", txid, "failed (attempt {}), retrying in {:.1f}s:".format(attempts, delay), msg)
+                else:
+                    del self.items[txid] # may be resubmitted later
+                    done = True
+                    self.metrics.add('broadcast_failed')
+            if done:
+                try:
+                    self.on_result(txid, bool(status), msg, context)
+                except Exception as e:
+                    self.print_error("on_result callback raised:", repr(e))
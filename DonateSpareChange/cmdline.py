@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import os, time, math
+
+from electroncash.i18n import _
+from electroncash.plugins import BasePlugin, hook
+from electroncash.util import PrintError, format_satoshis
+
+from .coin_index import CoinIndex, CoinScanner
+from .metrics import Metrics
+from .exporter import TextfileExporter
+from .core import (Loop, LoopTimer, DataModel, Engine, NetworkDispatcher, CheckScheduler, check_version,
+                   is_wallet_incompatible, note_network_event)
+
+
+class Plugin(BasePlugin):
+    ''' The headless plugin, for wallets run by the Electron Cash daemon (or any other GUI-less Electron Cash).
+
+    It donates exactly like the qt plugin does, using the settings stored in each wallet (set them up once with the GUI),
+    but without any widgets or Qt event loop: the donation engine runs on a single Loop thread and is driven by the
+    network callbacks alone. Auto-donation works as usual (it needs a wallet without a password). There being no one to
+    prompt, manual-mode notifications just go to the log. '''
+
+    stopped_wallet_interval = 1000 # ms between 2 looks at which of its wallets the daemon has stopped
+
+    def __init__(self, parent, config, name):
+        super().__init__(parent, config, name)
+        self.instances = list() # list of 'Instance' objects. only touched on self.loop's thread
+        self.config = config
+        self.is_new_network_callback_api = False
+        self.is_slp = False
+        self.is_shufbeta = False
+        check_version(self)  # will set is_new_network_callback_api & is_slp
+        self.loop = None # the Loop all our instances run on, created when the first wallet is loaded
+        self.dispatcher = None # NetworkDispatcher shared by all instances, created when the first wallet is loaded
+        self.scheduler = None # CheckScheduler shared by all instances, created when the first wallet is loaded
+        self.daemons = dict() # wallet -> the Daemon that loaded it, for the wallets whose closing we have to detect
+        self.stopped_wallet_timer = None # polls the daemons for wallets they stopped. see _on_stopped_wallet_timer
+
+    def shortName(self):
+        return _("Donate Change")
+
+    def description(self):
+        return _("Automatically donate change outputs to charities (or any address) of our choice, to protect your privacy and also go good!")
+
+    def thread_jobs(self):
+        return list()
+
+    def on_close(self):
+        """
+        BasePlugin callback called when the plugin is disabled or Electron Cash exits.
+        """
+        if not self.loop:
+            return
+        ct = self.loop.call_and_wait(self._close_all)
+        self.loop.close()
+        self.loop, self.dispatcher, self.scheduler, self.stopped_wallet_timer = None, None, None, None
+        self.print_error("on_close: closed %d extant instances" % (ct or 0))
+
+    @hook
+    def daemon_wallet_loaded(self, daemon, wallet):
+        """
+        Hook called by the daemon (from its JSON-RPC thread) after it loaded and started a wallet.
+
+        The daemon doesn't fire any hook when it stops the wallet again (Daemon.stop_wallet just drops it from
+        daemon.wallets and stops its threads), so we notice that by polling daemon.wallets.
+        """
+        self._load_wallet(wallet, daemon)
+
+    @hook
+    def load_wallet(self, wallet, window):
+        """
+        Hook called when a wallet is loaded by a GUI-less Electron Cash other than the daemon (window is None). Those
+        do fire close_wallet.
+        """
+        self._load_wallet(wallet, None)
+
+    @hook
+    def close_wallet(self, wallet):
+        if self.loop:
+            self.loop.call_and_wait(self._remove_instance, wallet) # wait, so our data is written before the wallet goes away
+
+    def _load_wallet(self, wallet, daemon):
+        if not self.loop:
+            self.loop = Loop()
+            self.dispatcher = NetworkDispatcher(self, self.loop.call_soon)
+            self.scheduler = CheckScheduler(lambda callback: LoopTimer(self.loop, callback))
+            self.stopped_wallet_timer = LoopTimer(self.loop, self._on_stopped_wallet_timer)
+        self.loop.call_soon(self._add_instance, wallet, daemon)
+
+    @hook
+    def set_label(self, wallet, name, text):
+        if self.loop:
+            self.loop.call_soon(self._on_set_label, wallet, name, text)
+
+    def _add_instance(self, wallet, daemon):
+        if daemon is not None:
+            self.daemons[wallet] = daemon
+            if not self.stopped_wallet_timer.isActive():
+                self.stopped_wallet_timer.start(self.stopped_wallet_interval)
+        if any(instance.wallet is wallet for instance in self.instances):
+            return
+        self.instances.append(Instance(self, wallet))
+
+    def _on_stopped_wallet_timer(self):
+        for wallet, daemon in list(self.daemons.items()):
+            if not any(w is wallet for w in list(getattr(daemon, 'wallets', {}).values())):
+                self.print_error("daemon stopped wallet:", os.path.basename(wallet.storage.path))
+                self._remove_instance(wallet)
+        if self.daemons:
+            self.stopped_wallet_timer.start(self.stopped_wallet_interval)
+
+    def _remove_instance(self, wallet):
+        self.daemons.pop(wallet, None)
+        for instance in self.instances:
+            if instance.wallet is wallet:
+                iname = instance.diagnostic_name()
+                instance.close()
+                self.instances.remove(instance)
+                self.print_error("removed instance:", iname)
+                return
+
+    def _close_all(self):
+        ct = 0
+        for instance in self.instances:
+            instance.close()
+            ct += 1
+        self.instances = list()
+        self.daemons.clear()
+        self.stopped_wallet_timer.stop()
+        self.scheduler.stop()
+        return ct
+
+    def _on_set_label(self, wallet, name, text):
+        for instance in self.instances:
+            if instance.wallet is wallet:
+                instance.engine.on_set_label(name, text)
+
+
+class Instance(PrintError):
+    ''' Headless counterpart of qt.Instance: 1 wallet's coin index, scanner and donation engine. Lives on the plugin's
+    Loop, and is the host the (Qt-free) Engine talks to; see core.Engine. '''
+
+    # config key. minimum time in ms between 2 refreshes caused by network events (default: min_refresh_interval)
+    CONFIG_MIN_REFRESH_INTERVAL = 'donate_spare_change_min_refresh_interval'
+    min_refresh_interval = 250 # ms
+
+    def __init__(self, plugin, wallet):
+        self.plugin = plugin
+        self.wallet = wallet
+        self.config = plugin.config
+        self.loop = plugin.loop
+        self.wallet_name = os.path.split(wallet.storage.path)[1]
+        self.metrics = Metrics() # timings & counters of our hot paths, see get_diagnostics()
+        self.data = DataModel(plugin.name, wallet.storage, self.config, make_timer = lambda callback: LoopTimer(self.loop, callback),
+                              metrics = self.metrics)
+        self.incompatible, self.is_slp = is_wallet_incompatible(wallet, self.print_error)
+        self.disabled = False
+        self.did_register_callback = False
+        self.is_schnorr_enabled = getattr(wallet, 'is_schnorr_enabled', None)
+        # Same network event coalescing as qt.Instance: any number of events -> 1 engine check per refresh interval
+        self.network_dirty = False
+        self.last_network_refresh = 0.0
+        self.network_refresh_timer = LoopTimer(self.loop, self.on_network_refresh_timer)
+        self.coin_index = CoinIndex(wallet, self.data.get_changedef, self.metrics)
+        self.scanner = CoinScanner(self.coin_index, on_snapshot = lambda snap: self.call_soon(self.on_snapshot, snap))
+        self.snapshot = None # the newest Snapshot we received
+        self.engine = Engine(self, plugin.scheduler)
+        self.exporter = TextfileExporter.for_host(self, lambda callback: LoopTimer(self.loop, callback)) # None unless configured
+
+        if self.incompatible:
+            self.disabled = True
+            self.print_error("Wallet is incompatible, disabling for this wallet")
+            return
+        if wallet.network:
+            plugin.dispatcher.add(self) # network events reach us via the plugin's dispatcher, which calls self.on_network
+            self.did_register_callback = True
+        self.engine.start()
+        if self.exporter:
+            self.exporter.start()
+        self.print_error("Started; auto-donate is", "ON" if self.data.get_autodonate() else "OFF")
+
+    def diagnostic_name(self):
+        return self.plugin.name + "@" + str(self.wallet_name)
+
+    def on_network(self, event, *args):
+        # network thread. called by the plugin's NetworkDispatcher for the events concerning our wallet.
+        if note_network_event(self.coin_index, self.wallet, event, *args):
+            self.note_network_updated()
+
+    def note_network_updated(self):
+        # any thread
+        if not self.network_dirty:
+            self.network_dirty = True
+            self.call_soon(self.on_network_dirty)
+
+    def on_network_dirty(self):
+        if self.plugin and not self.network_refresh_timer.isActive():
+            interval = self.config.get(self.CONFIG_MIN_REFRESH_INTERVAL, self.min_refresh_interval) / 1e3
+            wait = self.last_network_refresh + interval - time.monotonic()
+            self.network_refresh_timer.start(max(0, int(math.ceil(wait * 1e3))))
+
+    def on_network_refresh_timer(self):
+        if not self.plugin:
+            return # closed
+        self.network_dirty = False # before acting on it, so that events arriving meanwhile schedule another refresh
+        self.last_network_refresh = time.monotonic()
+        self.engine.on_network_updated()
+
+    def request_scan(self, watch = ()):
+        return self.scanner.request(full = False, watch = watch) # there's no coins list to show all the coins in
+
+    def on_snapshot(self, snap):
+        if not self.plugin or self.scanner.is_stale(snap):
+            return # closed, or newer data arrived while this was being taken and another snapshot is on its way
+        self.snapshot = snap
+        self.engine.on_snapshot(snap)
+
+    def get_diagnostics(self):
+        ''' Returns the timings & counters of this wallet's hot paths, as a dict. See metrics.Metrics.summary(). '''
+        return self.metrics.summary()
+
+    def reset_diagnostics(self):
+        self.metrics.reset()
+
+    # --- The things the Engine needs from us. See core.Engine.
+
+    def call_soon(self, fn, *args):
+        self.loop.call_soon(fn, *args)
+
+    def make_timer(self, callback):
+        return LoopTimer(self.loop, callback)
+
+    def set_wake_height(self, height):
+        if self.did_register_callback and self.plugin and self.plugin.dispatcher:
+            self.plugin.dispatcher.set_wake_height(self, height)
+
+    def short_name(self):
+        return self.plugin.shortName()
+
+    def notify(self, msg):
+        self.print_error(msg)
+
+    def show_error(self, msg):
+        self.print_error("ERROR:", msg)
+
+    def format_amount_and_units(self, sats):
+        return format_satoshis(sats) + " BCH"
+
+    def history_changed(self):
+        pass # no UI to refresh
+
+    def autodonate_turned_off(self):
+        self.print_error("Auto-donate was turned off")
+
+    def make_progress(self, value, maximum):
+        return None
+
+    def show_transaction(self, tx, desc):
+        self.print_error("Manual donations need the GUI; not showing", desc)
+
+    def close(self):
+        self.print_error("Close called on an Instance")
+        self.engine.stop()
+        if self.exporter:
+            self.exporter.stop()
+        self.scanner.close()
+        self.network_refresh_timer.stop()
+        self.data.flush() # write out any pending changes before the wallet goes away
+        if self.did_register_callback and self.plugin.dispatcher:
+            self.plugin.dispatcher.remove(self)
+        self.disabled = True
+        self.plugin, self.data, self.engine, self.exporter, self.coin_index, self.scanner, self.snapshot = (None,) * 7
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import heapq, threading
+from collections import defaultdict, deque, namedtuple
+
+from electroncash.i18n import _
+from electroncash.util import PrintError
+
+from .metrics import Metrics, timed
+
+try:
+    import numpy as np # optional. speeds up evaluating & sorting very large wallets, see CoinIndex.BULK_MIN
+except ImportError:
+    np = None
+
+
+class CoinRecord:
+    ''' A coin, as tracked by the CoinIndex.  Much smaller than the utxo dict it is made from: just the fields we use, in
+        __slots__, with the reasons a coin is ineligible kept as a bit mask of the reason codes below rather than as text.
+        The translated status text is only made, by eligibility_text(), for rows the coins list actually displays.
+
+        Use to_utxo() to get a (fresh) utxo dict suitable as a tx input. '''
+
+    __slots__ = ('name', 'prevout_hash', 'prevout_n', 'address', 'value', 'height', 'coinbase', 'frozen_coin', 'reasons', 'age')
+
+    # reason codes.  reasons == 0 means the coin is eligible.
+    FROZEN = 0x1 # the coin or its address is frozen
+    DUST = 0x2 # the coin is too small to be worth donating
+    AMOUNT = 0x4 # the coin is not below the change definition amount
+    AGE = 0x8 # the coin is not yet old enough (or unconfirmed)
+
+    def __init__(self, utxo, name = None):
+        self.name = name or CoinIndex.get_name(utxo)
+        self.prevout_hash = utxo['prevout_hash']
+        self.prevout_n = utxo['prevout_n']
+        self.address = utxo['address']
+        self.value = utxo['value']
+        self.height = utxo['height']
+        self.coinbase = utxo.get('coinbase', False)
+        self.frozen_coin = bool(utxo.get('is_frozen_coin', False))
+        self.reasons = 0
+        self.age = -1
+
+    def copy(self):
+        c = CoinRecord.__new__(CoinRecord)
+        for k in self.__slots__:
+            setattr(c, k, getattr(self, k))
+        return c
+
+    def to_utxo(self):
+        ''' Returns a new utxo dict for this coin. It's a new dict each time since Electron Cash adds the input info to it. '''
+        return { 'prevout_hash' : self.prevout_hash, 'prevout_n' : self.prevout_n, 'address' : self.address,
+                 'value' : self.value, 'height' : self.height, 'coinbase' : self.coinbase, 'is_frozen_coin' : self.frozen_coin }
+
+    @property
+    def is_frozen(self):
+        return bool(self.reasons & self.FROZEN)
+
+    @property
+    def is_eligible(self):
+        return not self.reasons
+
+    def eligibility_text(self):
+        ''' The (translated) status shown in the coins list. '''
+        r = self.reasons
+        if not r:
+            return _("Eligible for donation")
+        if r & self.FROZEN:
+            reasons = [_("Frozen")]
+        elif r & self.DUST:
+            reasons = [_("Dust")]
+        else:
+            reasons = [ text for code, text in ((self.AMOUNT, _("Amount")), (self.AGE, _("Age"))) if r & code ]
+        return _("Ineligible:") + " " + ', '.join(reasons)
+
+    def __repr__(self):
+        return "<CoinRecord {} value={} height={} reasons={:#x}>".format(self.name, self.value, self.height, self.reasons)
+
+
+class CoinIndex(PrintError):
+    ''' A persistent, in-memory index of the wallet's coins and their donation eligibility.
+
+        The index is kept up-to-date incrementally from wallet deltas, so that asking it for the set of eligible coins
+        costs O(changed coins) rather than O(wallet):
+
+            - 'wallet_updated' marks the index as needing a resync.  A resync diffs the wallet's utxo set against the
+              index by outpoint name, and only the added/removed/changed coins get (re-)evaluated.
+            - 'verified2' carries a (tx_hash, height) pair, which is applied directly to just the coins of that tx.
+            - New blocks only move the local height.  Coins waiting to come of age sit in a min-heap keyed by the height at
+              which they become eligible ("maturity height"), so a new block pops only the coins that actually matured.
+            - Freezing coins or addresses generates no wallet deltas, so every refresh takes a copy of the wallet's frozen
+              address and frozen coin sets (the permanent and the temporary ones, which other plugins such as CashFusion use
+              to reserve the coins they are spending), and re-evaluates just the coins whose frozen state differs from the
+              last copy. The frozen test itself is then a set lookup rather than a wallet.is_frozen() call per coin.
+
+        The note_* methods may be called from any thread (they are called from the network thread).  Everything else
+        should be called with self.lock held, or from the thread that owns the index. '''
+
+    DUST_THRESHOLD = 770 # we hard-code 546 + 224 as the minimal size we consider "dust"
+    BULK_MIN = 5000 # from this many coins on, full re-evaluations and sorts are done on NumPy arrays (if NumPy is installed)
+
+    def __init__(self, wallet, get_changedef, metrics = None):
+        self.wallet = wallet
+        self.get_changedef = get_changedef # callable returning the (amount, age, agetype) change definition
+        self.metrics = metrics or Metrics()
+        self.lock = threading.RLock()
+        self.coins = dict() # outpoint name -> CoinRecord
+        self.by_txid = defaultdict(set) # prevout_hash -> set of outpoint names
+        self.by_address = defaultdict(set) # address -> set of outpoint names
+        self.frozen_addresses = frozenset() # copy of wallet.frozen_addresses as of the last refresh (None = wallet lacks it)
+        self.frozen_coins = frozenset() # copy of wallet.frozen_coins plus wallet.frozen_coins_tmp as of the last refresh (None = wallet lacks it)
+        self.maturity = dict() # outpoint name -> height at which the coin is old enough, or None if it never will be (unconfirmed)
+        self.static_ok = set() # outpoint names passing every test except the age test
+        self.eligible = set() # outpoint names passing all tests
+        self.eligible_value = 0 # total value of the coins in self.eligible, in sats
+        self.maturity_heap = list() # heap of (maturity_height, name) for coins in static_ok that aren't yet old enough
+        self.local_height = 0
+        self.changedef = None
+        self.generation = 0 # incremented every time self.eligible changes
+        self.needs_resync = True
+        self.needs_reevaluate = True
+        self.pending_heights = deque() # (tx_hash, height) tuples from 'verified2'. deque.append is thread-safe.
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    # --- Thread-safe notifications (called from the network thread) ---
+
+    def note_wallet_updated(self):
+        self.needs_resync = True
+
+    def note_verified(self, tx_hash, height):
+        self.pending_heights.append((tx_hash, height))
+
+    def invalidate(self):
+        ''' Force a full re-evaluation of all coins on the next refresh().  Used when we know things may have changed
+            behind our back, such as the user freezing coins or addresses in the Coins tab. '''
+        self.needs_resync = True
+        self.needs_reevaluate = True
+
+    def has_pending(self):
+        ''' True if there are deltas that the next refresh() would need to apply. '''
+        return bool(self.needs_resync or self.needs_reevaluate or self.pending_heights)
+
+    def has_unseen_changes(self):
+        ''' True if the wallet's frozen sets, or the change definition, differ from what the last refresh() saw. Those
+            change without any network event. Costs O(frozen coins & addresses), and doesn't take the lock. '''
+        fa, fc = self._get_frozen_sets()
+        return fa != self.frozen_addresses or fc != self.frozen_coins or tuple(self.get_changedef()[:2]) != self.changedef
+
+    # --- Index maintenance ---
+
+    @staticmethod
+    def get_name(coin):
+        ''' Outpoint name of a CoinRecord or a utxo dict. '''
+        if isinstance(coin, CoinRecord):
+            return coin.name
+        return "{}:{}".format(coin['prevout_hash'], coin['prevout_n'])
+
+    def refresh(self):
+        ''' Bring the index up-to-date with the wallet, applying any deltas that accumulated since the last call.
+            Returns True if the eligible set changed. '''
+        with self.lock:
+            gen = self.generation
+            cd = tuple(self.get_changedef()[:2])
+            lh = self.wallet.get_local_height()
+            # change definition edited, or a reorg took the chain tip backwards -- everything must be re-evaluated
+            reevaluate = self.needs_reevaluate or cd != self.changedef or lh < self.local_height
+            self.needs_reevaluate = False
+            self.changedef = cd
+            if reevaluate:
+                self.local_height = lh
+            for name in self._update_frozen():
+                if not reevaluate: self._evaluate(name)
+            if self.needs_resync:
+                self.needs_resync = False
+                self._resync(evaluate = not reevaluate)
+            while self.pending_heights:
+                self._apply_height(*self.pending_heights.popleft(), evaluate = not reevaluate)
+            if reevaluate:
+                self._reevaluate_all()
+            elif lh != self.local_height:
+                self._advance_height(lh)
+            return gen != self.generation
+
+    @staticmethod
+    def _copy_set(s):
+        ''' Returns a frozenset copy of the wallet's set s, or None if the wallet has no such set. '''
+        if s is None:
+            return None
+        while True:
+            try:
+                return frozenset(s)
+            except RuntimeError:
+                pass # the GUI thread (un)froze something while we were iterating; try again
+
+    def _get_frozen_sets(self):
+        ''' Returns copies of the wallet's frozen address set, and of its frozen coin sets combined. '''
+        fa = self._copy_set(getattr(self.wallet, 'frozen_addresses', None))
+        fc = self._copy_set(getattr(self.wallet, 'frozen_coins', None))
+        fct = self._copy_set(getattr(self.wallet, 'frozen_coins_tmp', None)) # temporary freezes, e.g. coins CashFusion is spending
+        if fc is not None and fct:
+            fc |= fct
+        return fa, fc
+
+    def _update_frozen(self):
+        ''' Takes fresh copies of the wallet's frozen sets. Returns the names of the coins whose frozen state changed. '''
+        fa, fc = self._get_frozen_sets()
+        changed = set()
+        if fa != self.frozen_addresses:
+            if fa is None or self.frozen_addresses is None:
+                changed.update(self.coins)
+            else:
+                for addr in fa ^ self.frozen_addresses:
+                    changed.update(self.by_address.get(addr, ()))
+        if fc != self.frozen_coins:
+            if fc is None or self.frozen_coins is None:
+                changed.update(self.coins)
+            else:
+                changed.update(name for name in fc ^ self.frozen_coins if name in self.coins)
+        self.frozen_addresses, self.frozen_coins = fa, fc
+        return changed
+
+    def _is_frozen(self, c):
+        if self.frozen_coins is None:
+            frozen = c.frozen_coin # from the utxo dict
+        else:
+            frozen = c.frozen_coin = c.name in self.frozen_coins
+        if self.frozen_addresses is None:
+            return frozen or bool(self.wallet.is_frozen(c.address)) # ancient wallet, without the set
+        return frozen or c.address in self.frozen_addresses
+
+    def _resync(self, evaluate = True):
+        utxos = self.wallet.get_utxos(domain = None, exclude_frozen = False, mature = True, confirmed_only = False)
+        new_coins = { self.get_name(c) : c for c in utxos }
+        for name in self.coins.keys() - new_coins.keys():
+            self._remove(name)
+        for name, c in new_coins.items():
+            old = self.coins.get(name)
+            if old is None:
+                self._add(name, CoinRecord(c, name), evaluate)
+            elif old.height != c['height'] or old.frozen_coin != bool(c.get('is_frozen_coin', False)):
+                old.height, old.frozen_coin = c['height'], bool(c.get('is_frozen_coin', False))
+                if evaluate: self._evaluate(name)
+
+    def _apply_height(self, tx_hash, height, evaluate = True):
+        for name in self.by_txid.get(tx_hash, ()):
+            c = self.coins[name]
+            if c.height != height:
+                c.height = height
+                if evaluate: self._evaluate(name)
+
+    def _add(self, name, c, evaluate = True):
+        self.coins[name] = c
+        self.by_txid[c.prevout_hash].add(name)
+        self.by_address[c.address].add(name)
+        if evaluate: self._evaluate(name)
+
+    def _remove(self, name):
+        self._set_eligible(name, False) # stale heap entries for this name are discarded lazily
+        c = self.coins.pop(name)
+        names = self.by_txid.get(c.prevout_hash)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.by_txid[c.prevout_hash]
+        names = self.by_address.get(c.address)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.by_address[c.address]
+        self.maturity.pop(name, None)
+        self.static_ok.discard(name)
+
+    def _reevaluate_all(self):
+        if np is not None and len(self.coins) >= self.BULK_MIN:
+            self._reevaluate_all_bulk()
+            return
+        self.maturity_heap = list()
+        for name in self.coins:
+            self._evaluate(name, push = False)
+        # bulk-heapify is cheaper than pushing one at a time
+        self.maturity_heap = [ (self.maturity[name], name) for name in self.static_ok
+                               if name not in self.eligible and self.maturity.get(name) is not None ]
+        heapq.heapify(self.maturity_heap)
+
+    def _reevaluate_all_bulk(self):
+        ''' Does what _reevaluate_all() does, but runs the tests on columnar NumPy arrays instead of coin by coin. '''
+        names = list(self.coins)
+        recs = [ self.coins[name] for name in names ]
+        n = len(recs)
+        amount, age = self.changedef or (0, 0)
+        if amount is None: amount = 0
+        value = np.fromiter((c.value for c in recs), dtype = np.int64, count = n)
+        height = np.fromiter((c.height or 0 for c in recs), dtype = np.int64, count = n)
+        frozen = np.fromiter((self._is_frozen(c) for c in recs), dtype = bool, count = n)
+        reasons = ( np.where(frozen, CoinRecord.FROZEN, 0) | np.where(value <= self.DUST_THRESHOLD, CoinRecord.DUST, 0)
+                    | np.where(value >= amount, CoinRecord.AMOUNT, 0) )
+        if age <= 0:
+            maturity = np.zeros(n, dtype = np.int64)
+        else:
+            maturity = np.where(height > 0, height + (age - 1), -1) # -1 = unconfirmed (None in self.maturity)
+        static_ok = reasons == 0
+        waiting = static_ok & (maturity > self.local_height)
+        eligible = static_ok & (maturity >= 0) & (maturity <= self.local_height)
+        for c, r in zip(recs, reasons.tolist()):
+            c.reasons = r
+        self.maturity = dict(zip(names, maturity.tolist()))
+        for i in np.flatnonzero(maturity < 0).tolist():
+            self.maturity[names[i]] = None
+        self.static_ok = { names[i] for i in np.flatnonzero(static_ok).tolist() }
+        self.eligible_value = int(value[eligible].sum())
+        eligible = { names[i] for i in np.flatnonzero(eligible).tolist() }
+        if eligible != self.eligible:
+            self.eligible = eligible
+            self.generation += 1
+        idx = np.flatnonzero(waiting)
+        self.maturity_heap = list(zip(maturity[idx].tolist(), [ names[i] for i in idx.tolist() ]))
+        heapq.heapify(self.maturity_heap)
+
+    def _evaluate(self, name, push = True):
+        c = self.coins[name]
+        amount, age = self.changedef or (0, 0)
+        if amount is None: amount = 0
+        reasons = 0
+        if self._is_frozen(c):
+            reasons |= c.FROZEN
+        if c.value <= self.DUST_THRESHOLD:
+            reasons |= c.DUST
+        if not c.value < amount:
+            reasons |= c.AMOUNT
+        c.reasons = reasons # the AGE bit depends on the height, and is filled in by annotate()
+        h = c.height
+        if age <= 0:
+            maturity = 0
+        elif h and h > 0:
+            maturity = h + age - 1 # age = (lh - h) + 1 >= age  <=>  lh >= h + age - 1
+        else:
+            maturity = None # unconfirmed, will never be old enough until it confirms
+        self.maturity[name] = maturity
+        ok = not reasons
+        if ok:
+            self.static_ok.add(name)
+        else:
+            self.static_ok.discard(name)
+        mature = maturity is not None and maturity <= self.local_height
+        self._set_eligible(name, ok and mature)
+        if ok and not mature and maturity is not None and push:
+            heapq.heappush(self.maturity_heap, (maturity, name))
+
+    def _set_eligible(self, name, b):
+        if b and name not in self.eligible:
+            self.eligible.add(name)
+            self.eligible_value += self.coins[name].value
+            self.generation += 1
+        elif not b and name in self.eligible:
+            self.eligible.discard(name)
+            self.eligible_value -= self.coins[name].value
+            self.generation += 1
+
+    def _is_stale(self, entry):
+        height, name = entry
+        return name not in self.static_ok or self.maturity.get(name) != height or name in self.eligible
+
+    def _advance_height(self, lh):
+        self.local_height = lh
+        heap = self.maturity_heap
+        while heap and heap[0][0] <= lh:
+            entry = heapq.heappop(heap)
+            if not self._is_stale(entry):
+                self._set_eligible(entry[1], True)
+
+    # --- Queries ---
+
+    def next_maturity_height(self):
+        ''' Returns the lowest block height at which a currently-ineligible coin becomes eligible, or None. '''
+        with self.lock:
+            heap = self.maturity_heap
+            while heap and self._is_stale(heap[0]):
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def maturing_at(self, height):
+        ''' Returns copies of the coins that will become eligible exactly when the chain reaches the given height. '''
+        with self.lock:
+            names = { name for h, name in self.maturity_heap if h == height and not self._is_stale((h, name)) }
+            return [ self.coins[name].copy() for name in names ]
+
+    def is_eligible(self, coin):
+        return self.get_name(coin) in self.eligible
+
+    def annotate(self, name):
+        ''' Fills in the derived 'age' field of the coin, and the AGE bit of its reasons. Returns the coin. '''
+        c = self.coins[name]
+        lh = self.local_height
+        c.age = (lh - c.height) + 1 if c.height and c.height > 0 else -1
+        maturity = self.maturity.get(name)
+        if maturity is not None and maturity <= lh:
+            c.reasons &= ~c.AGE
+        else:
+            c.reasons |= c.AGE
+        return c
+
+    @timed('scan')
+    def snapshot(self, seq, full = True, watch = ()):
+        ''' Refreshes the index and returns a Snapshot of it. The coins in it are copies, owned by the caller.
+
+        Only a full snapshot has all of the coins, sorted for display, which costs O(wallet). The engine just needs the
+        eligible ones, so it asks for full = False, which costs O(eligible coins) on top of the refresh. watch is a
+        collection of outpoint names to report on in the snapshot's 'gone': the ones that are no longer in the wallet. '''
+        with self.lock:
+            self.refresh()
+            if full:
+                coins = tuple(c.copy() for c in self.get_coins()[0])
+                eligible = tuple(c for c in coins if not c.reasons)
+            else:
+                coins = None
+                eligible = tuple(c.copy() for c in self.get_coins(eligible_only = True)[0])
+            self.metrics.add('coins_scanned', len(coins) if full else len(eligible))
+            return Snapshot(seq = seq, generation = self.generation, local_height = self.local_height, coins = coins,
+                            eligible = eligible, eligible_value = self.eligible_value, num_coins = len(self.coins),
+                            gone = frozenset(name for name in watch if name not in self.coins),
+                            next_maturity = self.next_maturity_height(), maturing = tuple(self.maturing_at(self.local_height + 1)))
+
+    @timed('get_coins')
+    def get_coins(self, eligible_only = False):
+        ''' Returns a (coins, okcount) tuple, sorted the way the Coins list displays them.  Call refresh() first. '''
+        with self.lock:
+            names = self.eligible if eligible_only else self.coins
+            if np is not None and len(names) >= self.BULK_MIN:
+                return self._annotate_sorted_bulk(list(names)), len(self.eligible)
+            coins = [self.annotate(name) for name in names]
+            coins.sort(key=lambda c: (c.reasons & c.FROZEN, bool(c.reasons), c.value, c.height))
+            return coins, len(self.eligible)
+
+    def _annotate_sorted_bulk(self, names):
+        ''' annotate()s the named coins and sorts them like get_coins() does, on NumPy arrays, with a single lexsort. '''
+        recs = [ self.coins[name] for name in names ]
+        n, lh = len(recs), self.local_height
+        value = np.fromiter((c.value for c in recs), dtype = np.int64, count = n)
+        height = np.fromiter((c.height or 0 for c in recs), dtype = np.int64, count = n)
+        reasons = np.fromiter((c.reasons for c in recs), dtype = np.int64, count = n)
+        maturity = np.fromiter((-1 if m is None else m for m in map(self.maturity.get, names)), dtype = np.int64, count = n)
+        mature = (maturity >= 0) & (maturity <= lh)
+        reasons = np.where(mature, reasons & ~CoinRecord.AGE, reasons | CoinRecord.AGE)
+        ages = np.where(height > 0, lh - height + 1, -1)
+        for c, a, r in zip(recs, ages.tolist(), reasons.tolist()):
+            c.age, c.reasons = a, r
+        order = np.lexsort((height, value, reasons != 0, reasons & CoinRecord.FROZEN)) # last key is the primary one
+        return [ recs[i] for i in order.tolist() ]
+
+
+Snapshot = namedtuple('Snapshot', 'seq generation local_height coins eligible eligible_value num_coins gone next_maturity maturing')
+Snapshot.__doc__ = ''' An immutable view of a CoinIndex, as produced by CoinScanner.
+    seq: the scan request this answers. generation: CoinIndex.generation. coins: all coins (CoinRecord copies), in display
+    order, or None if this isn't a full snapshot. eligible: the eligible coins, in display order. eligible_value: their
+    total value, in sats. num_coins: the number of coins in the wallet. gone: frozenset of the watched outpoint names no
+    longer in the wallet. next_maturity: see CoinIndex.next_maturity_height(). maturing: the coins that become eligible
+    with the next block. '''
+
+
+class CoinScanner(PrintError):
+    ''' Refreshes a CoinIndex and snapshots it on a background thread, so that the wallet lock and the eligibility
+        evaluation never hold up the GUI thread.
+
+        request() may be called any number of times; requests that pile up while a scan runs are answered by a single
+        follow-up scan (a full one if any of them asked for that, watching all the names they watch). Every Snapshot
+        carries the seq of the newest request it answers, and on_snapshot(snapshot) is called from the scanner thread. A snapshot whose seq is below self.requested is already stale (newer data arrived while it
+        was being taken; another snapshot is on its way), see is_stale(). '''
+
+    def __init__(self, index, on_snapshot):
+        self.index = index
+        self.on_snapshot = on_snapshot
+        self.cond = threading.Condition()
+        self.requested = 0 # seq of the newest request
+        self.scanned = 0 # seq of the newest scan started
+        self.full = False # whether any request since that scan asked for a full snapshot
+        self.watch = set() # the names watched by the requests since that scan
+        self.thread = None # started lazily, on the first request
+        self.closed = False
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    def request(self, full = True, watch = ()):
+        ''' Asks for a fresh snapshot. See CoinIndex.snapshot() for full & watch. Returns the seq of the request. '''
+        with self.cond:
+            if self.closed:
+                return self.requested
+            self.requested += 1
+            self.full = self.full or full
+            self.watch.update(watch)
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = "DonateSpareChange scanner", daemon = True)
+                self.thread.start()
+            self.cond.notify()
+            return self.requested
+
+    def is_stale(self, snapshot):
+        return snapshot.seq < self.requested
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and self.scanned >= self.requested:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                seq = self.scanned = self.requested
+                full, watch = self.full, self.watch
+                self.full, self.watch = False, set()
+            try:
+                snapshot = self.index.snapshot(seq, full, watch)
+            except Exception as e:
+                self.print_error("Scan failed:", repr(e))
+                continue
+            if self.closed:
+                return
+            try:
+                self.on_snapshot(snapshot)
+            except Exception as e:
+                self.print_error("on_snapshot callback raised:", repr(e))
@@ -0,0 +1,1360 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# The parts of the plugin that don't need Qt: the donation engine and everything it runs on. Used both by the qt plugin
+# (qt.py) and the headless one for daemon wallets (cmdline.py).
+#
+import os, time, binascii, math, heapq, itertools, threading, traceback
+from collections import OrderedDict, namedtuple, defaultdict
+
+from electroncash.address import Address
+from electroncash.bitcoin import TYPE_ADDRESS
+from electroncash.transaction import Transaction
+from electroncash.i18n import _
+from electroncash.util import PrintError, NotEnoughFunds, ExcessiveFee, InvalidPassword
+from electroncash import version
+
+from .coin_index import CoinIndex
+from .sidecar import HistoryJournal, DonationJournal
+from . import txsize, planner
+from .signing import SigningPool, SigningJob
+from .broadcast import BroadcastQueue
+from .presign import PresignCache
+from .metrics import Metrics, timed
+from .roundrobin import RoundRobin
+
+
+class Loop(PrintError):
+    ''' A minimal event loop on its own thread. It is to the headless plugin what the GUI thread is to the qt one: all of
+    the core's work runs on it, 1 call at a time, so the core needs no locks of its own.
+
+    call_soon() & call_later() may be called from any thread. Exceptions raised by a call are printed and swallowed. '''
+
+    def __init__(self, name = "DonateSpareChange loop"):
+        self.cond = threading.Condition()
+        self.heap = list() # [due time, seq, fn, args] entries, see call_later()
+        self.seq = itertools.count()
+        self.closed = False
+        self.thread = threading.Thread(target = self._run, name = name, daemon = True)
+        self.thread.start()
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    def call_soon(self, fn, *args):
+        return self.call_later(0, fn, *args)
+
+    def call_later(self, delay_ms, fn, *args):
+        ''' Has fn(*args) called on the loop's thread after delay_ms. Returns a handle for cancel(). '''
+        entry = [time.monotonic() + delay_ms / 1e3, next(self.seq), fn, args]
+        with self.cond:
+            if not self.closed:
+                heapq.heappush(self.heap, entry)
+                self.cond.notify()
+        return entry
+
+    @staticmethod
+    def cancel(handle):
+        handle[2] = None # skipped when it comes up
+
+    def call_and_wait(self, fn, *args, timeout = 30.0):
+        ''' Calls fn(*args) on the loop's thread and waits (at most timeout seconds) for it to return. Returns its result. '''
+        if threading.current_thread() is self.thread:
+            return fn(*args)
+        done, result = threading.Event(), list()
+        def call():
+            try:
+                result.append(fn(*args))
+            finally:
+                done.set()
+        self.call_soon(call)
+        done.wait(timeout)
+        return result[0] if result else None
+
+    def close(self):
+        ''' Stops the loop. Calls still queued are dropped. '''
+        with self.cond:
+            self.closed = True
+            self.heap = list()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        entry = heapq.heappop(self.heap)
+                        break
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+                else:
+                    return
+            fn, args = entry[2], entry[3]
+            if fn is None:
+                continue # cancelled
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+
+class LoopTimer:
+    ''' A single-shot timer on a Loop, with the part of the QTimer API that the core uses: start(ms), stop(), isActive(). '''
+
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+        self.handle = None
+
+    def start(self, ms = 0):
+        self.stop()
+        self.handle = self.loop.call_later(ms, self._fire)
+
+    def stop(self):
+        if self.handle:
+            self.loop.cancel(self.handle)
+            self.handle = None
+
+    def isActive(self):
+        return self.handle is not None
+
+    def _fire(self):
+        self.handle = None
+        self.callback()
+
+
+def check_version(plugin):
+    ''' Sets the plugin's is_new_network_callback_api, is_slp & is_shufbeta flags from the Electron Cash version. '''
+    full_ver = CopiedCode.parse_package_version(version.PACKAGE_VERSION)
+    normalized_ver = full_ver[:-1]
+    variant = full_ver[-1]
+
+    if variant == "ShufBeta":
+        plugin.is_shufbeta = True
+    elif variant != '':
+        plugin.print_error("Unknown Electron Cash variant:", variant)
+        return
+    elif normalized_ver >= (3,4) and normalized_ver < (3,5):
+        plugin.is_slp = True
+
+    if plugin.is_shufbeta:
+        min_new_api_ver = (3,9,8)
+    elif plugin.is_slp:
+        min_new_api_ver = (3,4,6)
+    else:
+        min_new_api_ver = (3,3,7)
+
+    plugin.is_new_network_callback_api = normalized_ver >= min_new_api_ver
+
+def is_wallet_incompatible(wallet, print_error):
+    ''' Returns an (incompatible, is_slp) tuple. We only support imported private key and standard spending wallets. '''
+    is_watching_only_method = getattr(wallet, 'is_watching_only', lambda: False)
+    is_slp = wallet.storage.get('wallet_type', '').strip().lower() == 'bip39-slp'
+    try:
+        from electroncash.keystore import Hardware_KeyStore
+        from electroncash.wallet import Multisig_Wallet
+        if (is_slp
+            or is_watching_only_method()
+            or isinstance(wallet, (Multisig_Wallet,))
+            or any([isinstance(k, Hardware_KeyStore) for k in wallet.get_keystores()])):
+            # wallet is multisig, hardware, slp, or watching only.. return True (incompatible)
+            return True, is_slp
+        else:
+            return False, False
+    except (ImportError, AttributeError) as e:
+        # Hmm. Electron Cash API change? Proceed anyway and the user will just get error messages if plugin can't spend.
+        print_error("Error checking wallet compatibility:",repr(e))
+    return is_watching_only_method() or is_slp, is_slp
+
+
+def note_network_event(coin_index, wallet, event, *args):
+    ''' Passes a network event on to wallet's coin index (thread-safe). Returns True if it may have changed wallet's coins. '''
+    if event == 'updated' and (not args or args[0] is wallet):
+        coin_index.note_wallet_updated()
+    elif event == 'verified': # grr.. old api sucks
+        coin_index.note_wallet_updated()
+    elif event == 'wallet_updated' and args[0] is wallet:
+        coin_index.note_wallet_updated()
+    elif event == 'verified2' and args[0] is wallet:
+        if len(args) >= 3:
+            coin_index.note_verified(args[1], args[2]) # tx_hash, height
+        else:
+            coin_index.note_wallet_updated()
+    else:
+        return False
+    return True
+
+
+class NetworkDispatcher(PrintError):
+    ''' The 1 network callback shared by all of our Instances, so that a network event costs O(wallets it affects)
+    rather than O(open wallets).
+
+    Wallet events ('wallet_updated', 'verified2') go to that wallet's Instance only. A new block goes out once, on the
+    thread owning the Instances (the GUI thread, or the cmdline plugin's Loop), to the Instances whose coins tab is
+    showing (the coin ages changed) and to those whose engine asked to be woken at or below the new height; see
+    set_wake_height(). The deprecated network API's events don't say which wallet
+    they are about, so those still go to every Instance. '''
+
+    def __init__(self, plugin, call_soon):
+        self.plugin = plugin
+        self.call_soon = call_soon # call_soon(fn, *args) runs fn on the thread owning the Instances, from any thread
+        self.network = None # the network we are registered with, if any
+        self.instances = dict() # wallet -> Instance. replaced, never mutated, so the network thread can read it lock-free
+        self.active = set() # Instances whose tab is in the foreground
+        self.wakes = dict() # Instance -> block height at which to wake its engine
+        self.wake_heap = list() # (height, seq, Instance) -- stale entries (not matching self.wakes) are skipped
+        self.seq = itertools.count()
+        self.blockchain_dirty = False # set from the network thread; a new block is waiting to be handled on the owning thread
+
+    def diagnostic_name(self): # from PrintError
+        return self.plugin.name + "." + self.__class__.__name__
+
+    def add(self, instance):
+        network = instance.wallet.network
+        self.instances = { **self.instances, instance.wallet : instance }
+        if self.network is None:
+            if self.plugin.is_new_network_callback_api:
+                interests = ['wallet_updated', 'blockchain_updated', 'verified2']
+            else:
+                self.print_error("Warning: Your version of Electron Cash is deprecated. Please upgrade.")
+                interests = ['updated', 'verified']
+            network.register_callback(self.on_network, interests)
+            self.network = network
+
+    def remove(self, instance):
+        self.instances = { w : i for w, i in self.instances.items() if i is not instance }
+        self.active.discard(instance)
+        self.wakes.pop(instance, None)
+        if not self.instances and self.network:
+            self.network.unregister_callback(self.on_network)
+            self.network = None
+
+    def set_active(self, instance, b):
+        if b: self.active.add(instance)
+        else: self.active.discard(instance)
+
+    def set_wake_height(self, instance, height):
+        ''' Have instance.note_network_updated() called on the first block at or above height (None: no block-based wakeup). '''
+        if height is None:
+            self.wakes.pop(instance, None)
+        elif self.wakes.get(instance) != height:
+            self.wakes[instance] = height
+            heapq.heappush(self.wake_heap, (height, next(self.seq), instance))
+
+    def on_network(self, event, *args):
+        # network thread
+        if event == 'blockchain_updated':
+            if not self.blockchain_dirty: # only 1 queued call per burst of headers
+                self.blockchain_dirty = True
+                self.call_soon(self.on_blockchain_updated) # this passes the call to the gui thread (or Loop)
+            return
+        instance = self.instances.get(args[0]) if args else None
+        if instance:
+            instance.on_network(event, *args)
+        elif event in ('updated', 'verified'): # grr.. old api sucks
+            for instance in self.instances.values():
+                instance.on_network(event, *args)
+
+    def on_blockchain_updated(self):
+        self.blockchain_dirty = False
+        if not self.network:
+            return
+        lh = self.network.get_local_height()
+        woken = set(self.active)
+        heap = self.wake_heap
+        while heap and heap[0][0] <= lh:
+            height, seq, instance = heapq.heappop(heap)
+            if self.wakes.get(instance) == height:
+                del self.wakes[instance]
+                woken.add(instance)
+        for instance in woken:
+            instance.note_network_updated()
+
+
+class CheckScheduler(PrintError):
+    ''' Runs the do_check() of every Instance's engine off 1 timer. Requests are coalesced per engine (the earliest one
+    wins), and consecutive checks are spaced stagger_ms apart, so that many wallets needing a check at once (on a new
+    block, say) don't all run it in the same GUI frame.
+
+    make_timer(callback) must return a single-shot timer with start(ms) & stop() methods: a QTimer, or a LoopTimer. '''
+
+    stagger_ms = 50 # Qt ms value -- minimum spacing between 2 engines' do_check()
+
+    def __init__(self, make_timer):
+        self.heap = list() # (due time, seq, engine) -- stale entries (not matching self.due) are skipped
+        self.due = dict() # engine -> monotonic time at which its do_check is due
+        self.seq = itertools.count()
+        self.next_ok = 0.0 # monotonic time before which we won't run another check
+        self.timer = make_timer(self.on_timer)
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    def schedule(self, engine, delay_ms = 0):
+        due = time.monotonic() + delay_ms / 1e3
+        if self.due.get(engine, due + 1) <= due:
+            return # already due sooner
+        self.due[engine] = due
+        heapq.heappush(self.heap, (due, next(self.seq), engine))
+        self._arm()
+
+    def cancel(self, engine):
+        self.due.pop(engine, None)
+
+    def stop(self):
+        self.timer.stop()
+        self.heap, self.due = list(), dict()
+
+    def _arm(self):
+        heap = self.heap
+        while heap and self.due.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        if heap:
+            wait = max(heap[0][0], self.next_ok) - time.monotonic()
+            self.timer.start(max(0, int(math.ceil(wait * 1e3))))
+        else:
+            self.timer.stop()
+
+    def on_timer(self):
+        now = time.monotonic()
+        heap = self.heap
+        while heap and self.due.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        if heap and heap[0][0] <= now and now >= self.next_ok:
+            due, seq, engine = heapq.heappop(heap)
+            del self.due[engine]
+            self.next_ok = now + self.stagger_ms / 1e3
+            try:
+                engine.do_check()
+            except Exception:
+                traceback.print_exc()
+        self._arm()
+
+
+class DataModel:
+    ''' Interface to the permanent store for this plugin's persistent data & settings (basically, Wallet Storage)
+
+    We keep the authoritative copy of our data dict in memory and write it back to wallet storage lazily: setters just
+    mark it dirty, and save() (re)arms a single-shot timer so that a burst of edits (such as the user typing into the
+    amount field) results in 1 storage write rather than 1 per keystroke. flush() writes immediately and is called
+    when the Instance closes.
+
+    The timer comes from make_timer(callback), which must return a single-shot timer with start(ms), stop() and
+    isActive() methods (a QTimer in the GUI, a LoopTimer headless). Without make_timer, every save() writes at once.
+    Each write is counted in metrics, along with its size: storage.write() rewrites the whole wallet file. '''
+
+    HistoryEntry = namedtuple('HistoryEntry', 'address name amount ref txout') # address=str, name=str, amount=int, ref=str, txout=str
+    HistoryIndex = namedtuple('HistoryIndex', 'seen totals counts') # seen=set of HistoryEntry, totals=dict address->int, counts=dict address->int
+
+    flush_interval = 2000 # Qt ms -- coalesce all saves within this window into 1 wallet storage write
+
+    # config key. if true, donation history is moved out of wallet storage into an append-only sidecar file next to the wallet
+    CONFIG_HISTORY_SIDECAR = 'donate_spare_change_history_sidecar'
+
+    def __init__(self, plugin_name, storage, config, make_timer = None, metrics = None):
+        self.storage = storage
+        self.config = config
+        self.metrics = metrics or Metrics()
+        self.data = None # authoritative in-memory copy of our data dict, lazy-loaded from storage by get_data()
+        self.history_index = None # see _get_history_index()
+        self.history_journal = None # see _get_sidecar_history()
+        self.sidecar_history = None
+        self.donation_journal = None # see get_donation_journal()
+        self.dirty = False
+        self.flush_timer = make_timer(self.flush) if make_timer else None
+        self.keys = {
+            'root' : plugin_name + "__Data__v00", # the root-level key that goes into wallet storage for all of our plugin data
+            'charities' : 'charities', # the addresses, which ends up being a list of tuples (enabled, name, address_str)
+            'change_def' : 'change_def', # the definition of what constitutes change, which is a simple tuple
+            'autodonate' : 'autodonate', # if true, automatically donate change without prompting. requires unenecrypted wallet
+            'roundrobin' : 'roundrobin', # list of active charities in round-robin fashion. leftmost entry is the next one to receive a donation
+            'singletx' : 'singletx', # iff true, donations are made with 1 big tx covering all coins, hindering privacy but saving on fees
+            'history' : 'history', # a dict of address -> list of HistoryEntry entries
+            'warn_hi' : 'warn_hi', # if true, warn user when inputting change threshold above 2 mBCH (default: True)
+            'initted' : 'initted', # boolean. if set, this data store has been initted before and doesn't need to get populated with defaults
+            'history_sidecar' : 'history_sidecar', # boolean. if set, 'history' has been migrated to a HistoryJournal sidecar file and is no longer kept here
+        }
+
+    def get_data(self):
+        if self.data is not None:
+            return self.data
+        d = self.storage.get(self.keys['root'], dict()) # note this is a deep copy
+        if not d.get('initted'):
+            # initialize data with defaults
+            charities = [
+                (True, "eatBCH", "pp8skudq3x5hzw8ew7vzsw8tn4k8wxsqsv0lt0mf3g"),
+                (True, "eatBCH_SS", "qrsrvtc95gg8rrag7dge3jlnfs4j9pe0ugrmeml950"),
+                (True, "Coins4Clothes", "qzx4tqcldmvs4up9mewkf3ru0z6vy9wm6qm782fwla"),
+                (False, "Calin", "qplw0d304x9fshz420lkvys2jxup38m9symky6k028"),
+                (False, "CashShuffle", "qqqxxmjyavdkwdj6npa5w6xl0fzq3wc5furaqdpl59"),
+                (False, "Electron-Cash", "qz4wq9m860zr5p2nfdpttm5ymdqdyt3psc95qjagae"),
+            ]
+            change_def = (10500, 72, 0) # sats, blocks, age_type(not used yet)
+            d['charities'] = charities
+            d['change_def'] = change_def
+            d['autodonate'] = False
+            d['roundrobin'] = list()
+            d['singletx'] = False
+            d['history'] = dict()
+            d['warn_hi'] = True
+            d['initted'] = True
+        self.data = d
+        return d
+
+    def put_data(self, datadict, save=True):
+        self.data = datadict
+        self.dirty = True
+        if save: self.save()
+
+    def save(self):
+        ''' Schedules a write of our data to wallet storage. Writes are coalesced; see flush(). '''
+        if not self.dirty:
+            return
+        if self.flush_timer is None:
+            self.flush()
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start(self.flush_interval)
+
+    def flush(self):
+        ''' Writes our data to wallet storage now, if it has unsaved changes. '''
+        if self.flush_timer is not None:
+            self.flush_timer.stop()
+        if self.dirty and self.data is not None:
+            self.storage.put(self.keys['root'], self.data)
+            self.storage.write()
+            self.dirty = False
+            self.metrics.add('storage_writes')
+            self.metrics.add('storage_bytes', self.storage_file_size())
+
+    def storage_file_size(self):
+        path = getattr(self.storage, 'path', None)
+        try:
+            return os.path.getsize(path) if path else 0
+        except OSError:
+            return 0
+
+    def get_charities(self, valid_enabled_only = False):
+        d = self.get_data()
+        ret = d.get('charities', list())
+        if valid_enabled_only:
+            ret = [r for r in ret if r[0] and Address.is_valid(r[2])]
+        return ret
+
+    def set_charities(self, charities, save=True):
+        if isinstance(charities, list):
+            d = self.get_data()
+            d['charities'] = charities
+            self.put_data(d, save=save)
+
+    def get_changedef(self):
+        d = self.get_data()
+        return d.get('change_def')
+
+    def set_changedef(self, cd, save=True):
+        if isinstance(cd, (tuple, list)) and len(cd) >= 3:
+            d = self.get_data()
+            d['change_def'] = cd
+            self.put_data(d, save=save)
+
+    def get_autodonate(self):
+        return self.get_data().get('autodonate', False)
+
+    def set_autodonate(self, b, save = True):
+        try:
+            b = bool(b)
+            d = self.get_data()
+            d['autodonate'] = b
+            self.put_data(d, save=save)
+        except ValueError:
+            pass
+
+    def get_roundrobin(self):
+        return RoundRobin(self.get_data().get('roundrobin', list()))
+
+    def set_roundrobin(self, rr, save = True):
+        if not isinstance(rr, (list, tuple, RoundRobin, set)):
+            raise ValueError('set_roundrobin requires a list, tuple, set, or RoundRobin argument')
+        d = self.get_data()
+        d['roundrobin'] = list(rr)
+        self.put_data(d, save=save)
+
+    def get_history(self):
+        if self.uses_history_journal():
+            return self._get_sidecar_history()
+        return self.get_data().get('history', dict())
+
+    def uses_history_journal(self):
+        d = self.get_data()
+        if d.get('history_sidecar'):
+            return True # already migrated, must stay that way
+        if not self.config or not self.config.get(self.CONFIG_HISTORY_SIDECAR, False):
+            return False
+        # An encrypted wallet file would otherwise leak the donation history in plaintext next to it.
+        return not getattr(self.storage, 'is_encrypted', lambda: False)()
+
+    def _get_sidecar_history(self):
+        ''' Loads the history from the sidecar journal. The first time around, this migrates any history out of wallet
+        storage into the journal. The migration is safe to re-run if we crash half-way, since entries are de-duplicated. '''
+        if self.sidecar_history is None:
+            journal = HistoryJournal.for_wallet(self.storage.path)
+            entries = []
+            for r in journal.read():
+                try:
+                    entries.append(self.HistoryEntry(*r))
+                except TypeError:
+                    journal.print_error("Skipping malformed record", r)
+            d = self.get_data()
+            if not d.get('history_sidecar'):
+                migrated = [ self.HistoryEntry(*item) for l in d.get('history', dict()).values() for item in l ]
+                entries = list(OrderedDict.fromkeys(entries + migrated)) # de-dupe, preserving order
+                journal.rewrite([list(e) for e in entries])
+                d['history'] = dict()
+                d['history_sidecar'] = True
+                self.put_data(d, save = False)
+                self.flush() # journal is safely on disk, so now drop the history from the wallet file
+                journal.print_error("Migrated", len(migrated), "history entries out of wallet storage")
+            h = dict()
+            for hentry in entries:
+                h.setdefault(hentry.address, list()).append(hentry)
+            self.history_journal, self.sidecar_history = journal, h
+        return self.sidecar_history
+
+    def get_donation_journal(self):
+        ''' Returns this wallet's DonationJournal, or None if we can't keep one: the wallet has no file, or its storage is
+        encrypted (the journal is plaintext and would leak the donations). '''
+        if self.donation_journal is None:
+            path = getattr(self.storage, 'path', None)
+            if not path or getattr(self.storage, 'is_encrypted', lambda: False)():
+                return None
+            self.donation_journal = DonationJournal.for_wallet(path)
+        return self.donation_journal
+
+    def set_history(self, h, save = True):
+        if not isinstance(h, dict):
+            raise ValueError('set_history requires a dictionary argument')
+        if self.uses_history_journal():
+            self._get_sidecar_history()
+            self.history_journal.rewrite([ list(self.HistoryEntry(*item)) for l in h.values() for item in l ])
+            self.sidecar_history = h
+            self.history_index = None # rebuilt lazily
+            return
+        d = self.get_data()
+        d['history'] = h
+        self.history_index = None # rebuilt lazily
+        self.put_data(d, save = save)
+
+    def _get_history_index(self):
+        ''' The history index is built once from the history dict, and then maintained incrementally by history_put_entry.
+        It consists of a set of all entries (as tuples, for de-duplication), plus running totals and counts per address. '''
+        if self.history_index is None:
+            seen, totals, counts = set(), defaultdict(int), defaultdict(int)
+            for address, l in self.get_history().items():
+                for item in l:
+                    hentry = self.HistoryEntry(*item)
+                    if hentry in seen: continue
+                    seen.add(hentry)
+                    totals[address] += hentry.amount
+                    counts[address] += 1
+            self.history_index = self.HistoryIndex(seen, totals, counts)
+        return self.history_index
+
+    def history_put_entry(self, hentry, save = True):
+        self.history_put_entries([hentry], save = save)
+
+    def history_put_entries(self, hentries, save = True):
+        ''' Adds the HistoryEntry items in hentries that we don't already have. With the sidecar journal, that's 1 append
+        (and 1 fsync) for all of them. '''
+        if not all(isinstance(hentry, self.HistoryEntry) for hentry in hentries):
+            raise ValueError('history_put requires HistoryEntry arguments')
+        hindex = self._get_history_index()
+        new = [ hentry for hentry in OrderedDict.fromkeys(hentries) if hentry not in hindex.seen ]
+        if not new:
+            return # already have them
+        if self.uses_history_journal():
+            self._get_sidecar_history()
+            self.history_journal.append(*[ list(hentry) for hentry in new ]) # 1 small append -- the wallet file is untouched
+            for hentry in new:
+                self.sidecar_history.setdefault(hentry.address, list()).append(hentry)
+        else:
+            d = self.get_data()
+            h = d.setdefault('history', dict())
+            for hentry in new:
+                h.setdefault(hentry.address, list()).append(hentry)
+            self.put_data(d, save = save)
+        for hentry in new:
+            hindex.seen.add(hentry)
+            hindex.totals[hentry.address] += hentry.amount
+            hindex.counts[hentry.address] += 1
+
+    def history_get_for_address(self, address):
+        l = self.get_history().get(address, list())
+        ret = list()
+        for item in l:
+            hentry = self.HistoryEntry(*item)
+            ret.append(hentry)
+        return ret
+
+    def history_get_total_for_address(self, address):
+        return self._get_history_index().totals.get(address, 0)
+
+    def history_get_count_for_address(self, address):
+        return self._get_history_index().counts.get(address, 0)
+
+    def history_get_totals(self):
+        ''' Returns a dict of address -> (count, total) for every address we ever donated to. Comes from the history index,
+        so it costs O(addresses), not O(history). '''
+        hindex = self._get_history_index()
+        return { address : (hindex.counts[address], total) for address, total in hindex.totals.items() }
+
+    def get_singletx(self):
+        return self.get_data().get('singletx', False)
+
+    def set_singletx(self, b, save = True):
+        try:
+            b = bool(b)
+            d = self.get_data()
+            d['singletx'] = b
+            self.put_data(d, save=save)
+        except ValueError:
+            pass
+
+    def get_warn_high_thresh(self):
+        return self.get_data().get('warn_hi', True)
+
+    def set_warn_high_thresh(self, b, save = True):
+        try:
+            b = bool(b)
+            d = self.get_data()
+            d['warn_hi'] = b
+            self.put_data(d, save=save)
+        except ValueError:
+            pass
+
+
+class Engine(PrintError):
+    ''' The donation engine.  Encapsulates all logic of picking coins to donate, prompting user, setting up Send tab, etc
+
+    It knows nothing about Qt. Everything it needs from the outside world comes from its host, the per-wallet Instance
+    of the qt or the cmdline plugin, which must provide:
+
+        wallet, data (DataModel), config, coin_index, metrics, disabled, incompatible   -- attributes
+        is_schnorr_enabled      -- a function returning whether to sign with Schnorr, or None if Electron Cash can't
+        request_scan(watch)     -- asks for a coin index Snapshot, to be passed to our on_snapshot(). It need not be a full
+                                   one (see CoinIndex.snapshot), and its 'gone' covers the outpoint names in watch
+        call_soon(fn, *args)    -- from any thread, has fn(*args) called on the host's thread (which we run on)
+        make_timer(callback)    -- returns a single-shot timer on the host's thread, with start(ms) & stop() methods
+        set_wake_height(h)      -- has our on_network_updated() called on the first block at or above h (None: never)
+        short_name(), diagnostic_name()
+        notify(msg), show_error(msg), format_amount_and_units(sats)
+        show_transaction(tx, desc)      -- hands a manual donation tx to the user to sign & broadcast
+        make_progress(value, maximum)   -- returns a progress indicator with setValue(n) & close() methods, or None
+        history_changed(), autodonate_turned_off()  -- tell the UI (if any) to refresh
+
+    scheduler is the plugin's CheckScheduler, which runs our do_check(). '''
+
+    retry_interval = 10000 # value is Qt ms value -- when we can't proceed (network not ready, broadcast failed), try again in 10 seconds
+    poll_interval = 10000 # Qt ms value -- how often to look for the changes that come without a network event, see on_poll_timer()
+
+    # config key. number of threads used to sign per-coin auto-donation txs (default: number of CPUs, up to 4)
+    CONFIG_SIGN_THREADS = 'donate_spare_change_sign_threads'
+    # config keys. limits on the size of batched donation txs (defaults: the 100kB standardness limit, no input limit)
+    CONFIG_MAX_TX_SIZE = 'donate_spare_change_max_tx_size'
+    CONFIG_MAX_INPUTS = 'donate_spare_change_max_inputs'
+
+    def __init__(self, host, scheduler):
+        self.host = host # the qt or cmdline 'Instance'
+        self.scheduler = scheduler
+        self.wallet = host.wallet
+        self.config = host.config
+        self.has_schnorr_api = host.is_schnorr_enabled is not None
+        self._is_schnorr_enabled_func = host.is_schnorr_enabled or (lambda: False)
+        self.data = host.data
+        self.metrics = host.metrics # the timings & counters of our hot paths, see metrics.Metrics
+        self.rr = self.data.get_roundrobin()
+        # We don't poll. Coins only become eligible when a new coin arrives or when a block makes them old enough, and
+        # the coin index knows the height at which the next coin matures. So we only wake up on network events that
+        # can actually change the eligible set, or on user edits. See on_network_updated(). The exception is the user
+        # (un)freezing coins, which only a cheap poll of the wallet's frozen sets notices; see on_poll_timer().
+        self.started = False
+        self.poll_timer = host.make_timer(self.on_poll_timer)
+        self.checked_generation = None # the coin index generation as of the last do_check
+        self.wake_height = None # the next height at which a coin matures, as of the last do_check
+        self.check_seq = None # the scan request of the do_check waiting for its snapshot, if any
+        self.check_t0 = None # perf_counter() at the start of that do_check
+        # do_check is run by the plugin's CheckScheduler, which coalesces requests and staggers checks across wallets
+        self.is_foregrounded = False
+        self.last_notify_set = set()
+        self.pending_tx_histories = dict() # dict of tx_desc -> list of HistoryEntry
+        self.suppress_auto = 0
+        self.signer = SigningPool(self.wallet, self.config.get(self.CONFIG_SIGN_THREADS), metrics = self.metrics)
+        self.auto_donation = None # the AutoDonation in progress, if any
+        # the BroadcastQueue & SigningPool call back from their worker threads, which journal the outcome right there (so
+        # that the fsyncs don't hold up our thread) before host.call_soon passes the calls on to our thread
+        self.broadcaster = BroadcastQueue(self.wallet.network, on_result = self.on_broadcast_result_in_worker, metrics = self.metrics)
+        self.inflight_coins = set() # names of coins in txs we are signing/broadcasting, or that were broadcast but the wallet hasn't seen spent yet
+        self.journal = self.data.get_donation_journal() # write-ahead log of our donations, see replay_journal(). may be None.
+        self.recovered = list() # journal records of signed txs from a previous session, to rebroadcast once we're online
+        self.presigned = PresignCache() # txs signed ahead of time for coins maturing with the next block, see presign_ahead()
+        self.presign_run = None # the PresignRun being signed, if any
+        self.presign_height = None # the height we last pre-signed (or tried to) for
+
+        self.update_rr()
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__ + "@" + self.host.diagnostic_name()
+
+    def on_settings_changed(self):
+        ''' Call when the user edited the criteria or the charities. '''
+        self.invalidate_presigned() # pre-signed txs pay the charities, and spend the coins, that were eligible under the old settings
+        self.schedule_check()
+
+    def on_set_label(self, name, text):
+        ''' this will be used to catch tx's that have completed / been sent in non-auto-donate mode by embedding a cookie in tx desc '''
+        self.print_error("set_label called with ", name, text)
+        hentries = self.pending_tx_histories.pop(text, None)
+        if hentries:
+            self.record_donations([(hentries[0].ref, hentries, name)])
+            self.host.history_changed() # force history update
+
+    def journal_log(self, *records):
+        if self.journal:
+            try:
+                self.journal.log(*records)
+            except OSError as e:
+                self.print_error("WARNING: could not write donation journal:", repr(e))
+
+    def history_entries(self, donees, ref):
+        ''' Returns the HistoryEntry list for a donation tx paying donees. The txouts are just the output indices, since the
+        txid isn't known until the tx is signed; record_donations() prepends it. '''
+        # address name amount ref txout
+        return [ self.data.HistoryEntry(address, name, amt, ref, str(i)) for i, ((name, address), amt) in enumerate(donees.items()) ]
+
+    def record_donations(self, donations):
+        ''' donations is a list of (ref, history entries, txid). Writes the history entries to storage, and then marks
+        the donations recorded in the journal. '''
+        self.data.history_put_entries([ hentry if ':' in hentry.txout else hentry._replace(txout = txid + ":" + hentry.txout)
+                                        for ref, hentries, txid in donations for hentry in hentries ], save=False)
+        self.data.flush() # the history must be safely in storage before the journal forgets the donation
+        self.journal_log(*[ dict(ref = ref, state = DonationJournal.RECORDED) for ref, hentries, txid in donations ])
+
+    def replay_journal(self):
+        ''' Finishes whatever donations were in progress when we last went down (crash, or wallet closed mid-donation).
+        Only the few unfinished donations in the journal are looked at -- never the wallet history -- so this is cheap.
+        It is also idempotent: history entries are de-duplicated, so recording a donation twice is harmless. '''
+        if not self.journal:
+            return
+        try:
+            pending = self.journal.replay()
+        except (OSError, ValueError) as e:
+            self.print_error("WARNING: could not read donation journal:", repr(e))
+            return
+        if not pending:
+            return
+        known_txs = getattr(self.wallet, 'transactions', dict())
+        txid_by_label, utxo_names = None, None
+        done, abandoned = list(), list()
+        for rec in pending:
+            ref, txid = rec.get('ref'), rec.get('txid')
+            hentries = [ self.data.HistoryEntry(*e) for e in rec.get('entries', ()) ]
+            if rec.get('mode') == 'manual' and not txid:
+                # manual donations are signed & broadcast by the tx dialog, which labels the tx with our desc
+                if txid_by_label is None:
+                    txid_by_label = { text : name for name, text in getattr(self.wallet, 'labels', dict()).items() }
+                txid = txid_by_label.get(rec.get('desc'))
+            if txid and txid in known_txs:
+                done.append((ref, hentries, txid))
+            elif txid and rec.get('tx'):
+                # signed, and maybe broadcast. Broadcasting it again is harmless either way, so do so once we're online.
+                self.recovered.append(rec)
+                self.inflight_coins.update(rec.get('coins', ()))
+            elif rec.get('mode') == 'manual':
+                # the user may still broadcast it (from a saved tx file, say), for as long as its coins are unspent
+                if utxo_names is None:
+                    utxo_names = { CoinIndex.get_name(c) for c in self.wallet.get_utxos(domain = None, exclude_frozen = False, mature = False, confirmed_only = False) }
+                if all(name in utxo_names for name in rec.get('coins', ())):
+                    self.pending_tx_histories[rec.get('desc')] = hentries
+                else:
+                    abandoned.append(ref)
+            else:
+                abandoned.append(ref) # auto-donation that was never signed, so nothing went out
+        self.journal_log(*[ dict(ref = ref, state = DonationJournal.ABANDONED) for ref in abandoned ])
+        if done:
+            self.record_donations(done)
+            self.host.history_changed()
+        self.print_error("Replayed donation journal: {} recorded, {} to rebroadcast, {} abandoned, {} awaiting the user"
+                         .format(len(done), len(self.recovered), len(abandoned), len(pending) - len(done) - len(self.recovered) - len(abandoned)))
+        try:
+            self.journal.compact()
+        except OSError as e:
+            self.print_error("WARNING: could not compact donation journal:", repr(e))
+
+    def on_recovered_result(self, txid, ok, msg, rec):
+        hentries = [ self.data.HistoryEntry(*e) for e in rec.get('entries', ()) ]
+        if ok or txid in getattr(self.wallet, 'transactions', dict()):
+            if rec.get('desc'):
+                self.wallet.set_label(txid, rec.get('desc'))
+            self.record_donations([(rec.get('ref'), hentries, txid)])
+            self.host.history_changed()
+        else:
+            self.print_error("WARNING: rebroadcast of recovered donation failed", rec.get('desc'), txid, msg)
+            self.journal_log(dict(ref = rec.get('ref'), state = DonationJournal.ABANDONED))
+            self.inflight_coins.difference_update(rec.get('coins', ()))
+            self.retry_later() # its coins are still eligible; donate them afresh
+
+    def set_foregrounded(self, b):
+        self.is_foregrounded = b
+        if not b:
+            self.schedule_check() # we suppress notifications while foregrounded, so give the user any pending notification now
+
+    def on_network_updated(self):
+        ''' Called in the host's thread for every (coalesced) wallet/blockchain network event. Only schedules a do_check if the event could
+        have changed the eligible coin set: new wallet deltas, or the chain reaching the next maturity height. '''
+        if not self.started:
+            return
+        index = self.host.coin_index
+        lh = self.wallet.get_local_height()
+        if (index.has_pending()
+                or index.generation != self.checked_generation # the coins list refreshed the index and eligibility changed
+                or (self.wake_height is not None and lh >= self.wake_height)
+                or self.wants_presign(lh + 1)): # coins mature with the next block; get their txs ready
+            self.schedule_check()
+        else:
+            self.register_wake() # the dispatcher forgets a wakeup once delivered
+
+    def on_poll_timer(self):
+        ''' Coins or addresses being (un)frozen, by the user or by another plugin, comes with no network event. So every
+        poll_interval we compare the wallet's frozen sets (and the change definition) with what the coin index last saw,
+        which costs O(frozen coins & addresses). Only if they differ does a check get scheduled. '''
+        if not self.started:
+            return
+        if self.host.coin_index.has_unseen_changes():
+            self.schedule_check()
+        self.poll_timer.start(self.poll_interval)
+
+    def register_wake(self):
+        ''' Tells the plugin's dispatcher at which block height to next wake us: when the next coin matures, or a block
+        before that if we'll want to pre-sign its donation. '''
+        h = self.wake_height
+        if h is not None and self.data.get_autodonate() and self.presign_height != h:
+            h -= 1
+        self.host.set_wake_height(h)
+
+    def schedule_check(self):
+        if self.started:
+            self.scheduler.schedule(self)
+
+    def retry_later(self):
+        if self.started:
+            self.scheduler.schedule(self, self.retry_interval)
+
+    def update_rr(self):
+        charities = self.data.get_charities(valid_enabled_only = True)
+        charities = [ tuple(charity[1:]) for charity in charities ] # get rid of the "enabled" column -- our round-robin list consits of name,address tuples
+        self.rr.update(charities) #.update preserves original order for ones that are kept.
+        return bool(self.rr)
+
+    def do_check(self):
+        if self.host.disabled or self.host.incompatible:
+            return
+        if not self.wallet.network or not self.wallet.network.is_connected() or not self.wallet.network.is_up_to_date() or not self.wallet.is_up_to_date():
+            self.print_error("Network not connected or wallet/network not up-to-date, will try again later...")
+            self.retry_later()
+            return
+        if self.recovered:
+            recovered, self.recovered = self.recovered, list()
+            for rec in recovered:
+                self.broadcaster.submit(Transaction(rec['tx']), context = (None, rec))
+        self.check_t0 = time.perf_counter()
+        self.check_seq = self.host.request_scan(watch = self.inflight_coins | self.presigned.coin_names()) # continued in on_snapshot()
+
+    def on_snapshot(self, snap):
+        ''' The second half of do_check(), run once the scanner delivers a snapshot taken after do_check() asked for one.
+        The snapshot reflects coins frozen since the last one too, as the index diffs the wallet's frozen sets on every scan. '''
+        if not self.started:
+            return
+        if self.check_seq is None or snap.seq < self.check_seq:
+            # Not the scan we asked for, but one the coins list did. If the eligible set changed without us hearing of it
+            # (the user unfroze some coins, say, then looked at our tab), check it.
+            if self.check_seq is None and snap.generation != self.checked_generation:
+                self.schedule_check()
+            return
+        self.check_seq = None
+        self.inflight_coins.difference_update(snap.gone) # forget donated coins once the wallet saw them spent
+        coins = list(snap.eligible)
+        self.checked_generation = snap.generation
+        self.wake_height = snap.next_maturity
+        if coins and self.update_rr():
+            if self.data.get_autodonate() and not self.wallet.has_password(): # pw check here again in case it changed in the meantime
+                if not self.suppress_auto:
+                    self.auto_donate(coins)
+                else:
+                    self.print_error("Auto-donate suppressed due to extant donations-related txdialog")
+            else:
+                self.notify_user(coins)
+        self.presigned.prune(snap.gone, snap.local_height + 1)
+        self.presign_ahead(snap)
+        self.register_wake()
+        self.metrics.observe('do_check', time.perf_counter() - self.check_t0) # the whole check, including waiting for the scan
+
+    class PresignRun:
+        ''' State of 1 batch of txs being signed ahead of time. '''
+        def __init__(self, height, built):
+            self.height = height # the block the txs are for
+            self.built = built # list of (coin names, round-robin state before, (tx, desc, ref, donees), round-robin state after)
+            self.remaining = len(built) # number of txs not done signing
+            self.job = None # SigningJob
+
+    def presign_ahead(self, snap):
+        ''' Coins become eligible at a height known in advance. So if some will become eligible with the very next block,
+        build & sign their donation txs now, while nothing is waiting on us. When the block arrives, auto_donate() then
+        finds them in self.presigned and only has to broadcast them. '''
+        target = snap.local_height + 1
+        if not self.wants_presign(target):
+            return
+        self.presign_height = target # 1 try per block is plenty
+        if self.suppress_auto or self.wallet.has_password() or not self.update_rr():
+            return
+        coins = [ c for c in snap.maturing if CoinIndex.get_name(c) not in self.inflight_coins ]
+        if not coins:
+            return
+        coins.sort(key = lambda c: (c.value, c.height)) # the order on_snapshot() will see them in
+        rr = RoundRobin(self.rr) # advanced by make_transaction() as if for real, while self.rr stays put
+        built = list()
+        for batch in self.plan_batches(coins, self.data.get_singletx()):
+            rr_before = list(rr)
+            txinfo = self.make_transaction(batch, rr = rr)
+            if txinfo[0] is None:
+                break # every later tx would be keyed on a round-robin state we won't reach
+            built.append(([CoinIndex.get_name(c) for c in batch], rr_before, txinfo, list(rr)))
+        if not built:
+            return
+        self.print_error("Pre-signing", len(built), "txs for", len(coins), "coins maturing at height", target)
+        run = self.presign_run = self.PresignRun(target, built)
+        run.job = self.signer.sign_all([b[2][0] for b in built],
+                                       on_signed = lambda i, exc: self.host.call_soon(self.on_presigned, run, i, exc),
+                                       on_done = lambda: None)
+
+    def wants_presign(self, target):
+        return (self.wake_height == target and self.presign_height != target and not self.presign_run
+                and self.data.get_autodonate())
+
+    def on_presigned(self, run, i, exc):
+        if run is not self.presign_run:
+            return # invalidated meanwhile
+        run.remaining -= 1
+        if not run.remaining:
+            self.presign_run = None
+        if exc is None:
+            names, rr_before, txinfo, rr_after = run.built[i]
+            self.presigned.put(names, rr_before, PresignCache.Entry(*txinfo, rr_after, run.height))
+        elif not isinstance(exc, SigningJob.Cancelled):
+            self.print_error("Pre-signing failed:", repr(exc))
+            run.job.cancel() # most likely the wallet got a password; auto_donate will deal with it
+
+    def invalidate_presigned(self):
+        if self.presign_run:
+            self.presign_run.job.cancel()
+            self.presign_run = None
+        self.presign_height = None
+        self.presigned.clear()
+
+    def newref(self): return str(binascii.hexlify(os.urandom(8))).split("'")[1]
+
+    def plan_batches(self, coins, batched=True):
+        ''' Splits coins into the txs we will make: as few as possible when batched (each one still relayable, see
+        planner.plan_batches), or 1 per coin when not. '''
+        config = self.config
+        return planner.plan_batches(coins, num_recipients = len(self.rr),
+                                    max_inputs = config.get(self.CONFIG_MAX_INPUTS) if batched else 1,
+                                    max_tx_size = config.get(self.CONFIG_MAX_TX_SIZE, planner.MAX_STANDARD_TX_SIZE),
+                                    schnorr = bool(self._is_schnorr_enabled_func()))
+
+    def manual_donate(self, coins, batched=True):
+        ''' This will either make as few batched TXs as possible or pop up many tx windows '''
+        if not self.update_rr() or not coins:
+            return 0
+        list_of_coins = self.plan_batches(coins, batched)
+        for coins in list_of_coins:
+            tx, desc, ref, donees = self.make_transaction(coins)
+            if not tx:
+                self.show_error(_("There was a problem creating the transaction. Please contact the developer."))
+                return -1
+            hentries = self.history_entries(donees, ref)
+            self.pending_tx_histories[desc] = hentries
+            self.journal_log(dict(ref = ref, state = DonationJournal.INTENT, mode = 'manual', desc = desc,
+                                  coins = [CoinIndex.get_name(c) for c in coins], entries = [list(h) for h in hentries]))
+
+            # .. aaaand Show it!
+            self.host.show_transaction(tx, desc)
+
+        return 1
+
+    def on_autodonate_disabled(self):
+        self.suppress_auto = 0 # turn off 'auto' suppression because user messed with UI
+        self.invalidate_presigned()
+
+    def suppress_auto_push(self):
+        ''' Suppresses auto-donation while a donation tx the user is to sign is on screen. Undo with suppress_auto_pop(). '''
+        self.suppress_auto += 1
+
+    def suppress_auto_pop(self):
+        if self.suppress_auto:
+            self.suppress_auto -= 1
+            self.print_error("suppress_auto =", self.suppress_auto)
+            if not self.suppress_auto:
+                self.schedule_check() # auto-donate whatever became eligible while we were suppressed
+
+
+    class AutoDonation:
+        ''' State of 1 in-progress auto-donation run. '''
+        def __init__(self, txs, coin_names, dlg):
+            self.txs = txs # list of (tx, desc, ref, donees)
+            self.coin_names = coin_names # list of lists of the names of the coins spent by each tx
+            self.dlg = dlg # progress dialog, or None if every tx was pre-signed
+            self.job = None # SigningJob
+            self.done = 0 # number of txs done signing
+            self.signing_finished = False
+            self.pending = 0 # number of txs queued for broadcast, whose result we are waiting for
+            self.broadcast = list() # (ref, history entries, txid) of the txs the network accepted
+            self.finished = False
+            self.ct, self.tot = 0, 0
+            self.password_error = False
+
+    def get_broadcast_func(self):
+        network = self.wallet.network
+        if hasattr(network, 'broadcast_transaction'):
+            return network.broadcast_transaction
+        elif hasattr(network, 'broadcast'):
+            return network.broadcast
+        return None
+
+    def auto_donate(self, coins):
+        ''' Builds the donation txs here on the host's thread (the round-robin state lives here), then signs them on the
+        SigningPool's worker threads. Each signed tx streams back to us via host.call_soon and is queued on the
+        BroadcastQueue right away, while a progress dialog (if the host has one) shows how far along we are. History is only written once the
+        network accepted a tx (see on_broadcast_result). '''
+        self.print_error("Auto-donate called with ", coins)
+        if self.auto_donation:
+            self.print_error("Previous auto-donation still in progress, will try again later")
+            self.retry_later()
+            return
+        coins = [c for c in coins if CoinIndex.get_name(c) not in self.inflight_coins]
+        if not coins:
+            return
+        if not self.get_broadcast_func():
+            # wtf. someone changed the API
+            self.show_error(_("Don't know how to broadcast a transaction. Are you on Electron Cash 3.2 or above?"))
+            return
+        batches = self.plan_batches(coins, self.data.get_singletx())
+        txs, coin_names, presigned = [], [], set()
+        for batch in batches:
+            names = [CoinIndex.get_name(c) for c in batch]
+            hit = self.presigned.take(names, self.rr)
+            if hit:
+                self.rr = RoundRobin(hit.rr_after)
+                self.data.set_roundrobin(self.rr)
+                presigned.add(len(txs))
+                tx, desc, ref, donees = hit.tx, hit.desc, hit.ref, hit.donees
+            else:
+                tx, desc, ref, donees = self.make_transaction(batch)
+            if tx is None:
+                self.print_error("WARNING: tx is None for", desc)
+                continue
+            txs.append((tx, desc, ref, donees))
+            coin_names.append(names)
+        if not txs:
+            return
+        for names in coin_names:
+            self.inflight_coins.update(names)
+        # 1 journal append for the whole round: the intents, plus the pre-signed txs, which are signed already
+        self.journal_log(*([ dict(ref = ref, state = DonationJournal.INTENT, mode = 'auto', desc = desc, coins = names,
+                                  entries = [list(h) for h in self.history_entries(donees, ref)])
+                             for (tx, desc, ref, donees), names in zip(txs, coin_names) ]
+                           + [ self.signed_record(txs[i]) for i in sorted(presigned) ]))
+
+        to_sign = [ i for i in range(len(txs)) if i not in presigned ]
+        dlg = self.host.make_progress(len(presigned), len(txs)) if to_sign else None
+        ad = self.auto_donation = self.AutoDonation(txs, coin_names, dlg)
+        for i in sorted(presigned):
+            self.on_tx_signed(ad, i, None) # straight to the broadcast queue
+        # the callbacks below run in worker threads
+        ad.job = self.signer.sign_all([txs[i][0] for i in to_sign],
+                                      on_signed = lambda j, exc: self.on_tx_signed_in_worker(ad, to_sign[j], exc),
+                                      on_done = lambda: self.host.call_soon(self.on_signing_done, ad))
+
+    @staticmethod
+    def signed_record(txinfo):
+        tx, desc, ref, donees = txinfo
+        return dict(ref = ref, state = DonationJournal.SIGNED, txid = tx.txid(), tx = tx.serialize())
+
+    def on_tx_signed_in_worker(self, ad, i, exc):
+        ''' SigningPool worker thread. Journals the signed tx (before it can be broadcast), then has on_tx_signed() called
+        on our thread. '''
+        if exc is None and ad is self.auto_donation and self.started:
+            self.journal_log(self.signed_record(ad.txs[i]))
+        self.host.call_soon(self.on_tx_signed, ad, i, exc)
+
+    def on_tx_signed(self, ad, i, exc):
+        if ad is not self.auto_donation or not self.started:
+            return # stale, or we are closing. abort!
+        ad.done += 1
+        if ad.dlg: ad.dlg.setValue(ad.done)
+        tx, desc, ref, donees = ad.txs[i]
+        if exc is None:
+            # already journaled, by on_tx_signed_in_worker() or auto_donate()
+            if self.broadcaster.submit(tx, context = (ad, i)):
+                ad.pending += 1
+            else:
+                self.print_error("WARNING: already broadcasting", tx.txid())
+            return
+        self.journal_log(dict(ref = ref, state = DonationJournal.ABANDONED))
+        self.inflight_coins.difference_update(ad.coin_names[i])
+        if isinstance(exc, InvalidPassword):
+            if not ad.password_error:
+                ad.password_error = True
+                ad.job.cancel()
+        elif not isinstance(exc, SigningJob.Cancelled):
+            self.print_error("WARNING: failed to sign", desc, repr(exc))
+
+    def on_signing_done(self, ad):
+        if ad is not self.auto_donation:
+            return
+        self.auto_donation = None
+        ad.signing_finished = True
+        if ad.dlg:
+            ad.dlg.close()
+        if not self.started:
+            return # auto kicked off just as the window was closing. abort!
+        if ad.password_error:
+            self.data.set_autodonate(False)
+            self.host.autodonate_turned_off()
+            self.show_error(_("Wallet now has a password. Auto-donate was turned off."))
+        self.maybe_finish(ad)
+
+    def on_broadcast_result_in_worker(self, txid, ok, msg, context):
+        ''' BroadcastQueue worker thread. Journals an accepted auto-donation tx, then has on_broadcast_result() called on
+        our thread. '''
+        ad, ix = context
+        if ok and ad is not None and self.started:
+            self.journal_log(dict(ref = ad.txs[ix][2], state = DonationJournal.BROADCAST, txid = txid))
+        self.host.call_soon(self.on_broadcast_result, txid, ok, msg, context)
+
+    def on_broadcast_result(self, txid, ok, msg, context):
+        if not self.started:
+            return # we are closing. abort!
+        ad, ix = context
+        if ad is None:
+            self.on_recovered_result(txid, ok, msg, ix) # ix is the journal record
+            return
+        ad.pending -= 1
+        tx, desc, ref, donees = ad.txs[ix]
+        if ok:
+            if msg != txid: self.print_error("Warning: txid != data", msg, txid)
+            self.wallet.set_label(txid, desc) # already journaled, by on_broadcast_result_in_worker()
+            hentries = self.history_entries(donees, ref)
+            ad.broadcast.append((ref, hentries, txid))
+            ad.ct += len(hentries)
+            ad.tot += sum(h.amount for h in hentries)
+        else:
+            self.print_error("WARNING: broadcast failed for", desc, txid, msg)
+            self.journal_log(dict(ref = ref, state = DonationJournal.ABANDONED))
+            self.inflight_coins.difference_update(ad.coin_names[ix])
+            self.retry_later() # the coin is still eligible; try to donate it again later
+        self.maybe_finish(ad)
+
+    def maybe_finish(self, ad):
+        ''' Called as the pieces of an auto-donation complete. Once all txs are signed and their broadcasts resolved, tells the user. '''
+        if ad.finished or not ad.signing_finished or ad.pending:
+            return
+        ad.finished = True
+        if ad.broadcast:
+            self.record_donations(ad.broadcast)
+        if ad.ct:
+            self.host.notify(_("Auto-donated {} coins, {}").format(ad.ct,self.host.format_amount_and_units(int(ad.tot))))
+            self.host.history_changed() # so that we see the new history immediately
+
+    @timed('make_transaction')
+    def make_transaction(self, coins, rr = None):
+        ''' Builds the donation tx for coins, paying the charities in round-robin order. Pass a copy of self.rr as rr to
+        build a tx speculatively: the copy is advanced instead, nothing is saved, and errors are only logged. '''
+        speculative = rr is not None
+        if not speculative:
+            rr = self.rr
+        show_error = self.print_error if speculative else self.show_error
+        coins = [ c.to_utxo() for c in coins ] # CoinRecords -> fresh utxo dicts, which Electron Cash adds the input info to
+        totalSats = 0
+        ref = self.newref()
+        desc = self.host.short_name() + ": "
+        donees = dict()
+        outputs = list()
+        for coin in coins:
+            donee = rr.rotate()
+            amt = donees.get(donee, 0)
+            sats = coin['value']
+            amt += sats
+            totalSats += sats
+            donees[donee] = amt
+        for donee,amt in donees.items():
+            addr_str = donee[1]
+            address = Address.from_string(addr_str)
+            outputs.append((TYPE_ADDRESS, address, int(amt)))
+        desc += ', '.join([donee[0] for donee in donees])
+        desc += " (ref: %s)" % ref
+
+        tx = None
+        gross_outputs, gross_donees = outputs, donees
+        try:
+            schnorr_kwargs={}
+            if self.has_schnorr_api:
+                schnorr_kwargs['sign_schnorr'] = self._is_schnorr_enabled_func()
+            # Predict the signed size from the number & type of inputs and outputs, so that we only build the tx once.
+            size = txsize.estimate_tx_size(len(coins), [txsize.output_script_size(o[1]) for o in outputs],
+                                           schnorr = bool(schnorr_kwargs.get('sign_schnorr')))
+            tx, outputs, donees = self._make_tx_paying_fee(coins, gross_outputs, gross_donees, size, schnorr_kwargs)
+            actual = tx.estimated_size() # just serializes the tx we already have
+            if actual > size:
+                # The model assumes compressed pubkeys; an imported uncompressed key makes the input bigger. Pay for the real size.
+                self.print_error("Size model said {} bytes but tx is {} bytes, rebuilding".format(size, actual))
+                tx, outputs, donees = self._make_tx_paying_fee(coins, gross_outputs, gross_donees, actual, schnorr_kwargs)
+        except NotEnoughFunds:
+            show_error(_("Insufficient funds"))
+        except ExcessiveFee:
+            show_error(_("Excessive Fee"))
+        except BaseException as e:
+            import traceback
+            traceback.print_exc()
+            self.print_error("Outputs:",outputs)
+            show_error(str(e) or "Unknown Error")
+
+        if not speculative:
+            self.data.set_roundrobin(self.rr)
+        return tx, desc, ref, donees
+
+    def _make_tx_paying_fee(self, coins, outputs, donees, size, schnorr_kwargs):
+        ''' Makes the tx, with each output paying a portion of the fee to reach 1.0 sats/B for a tx of `size` bytes.
+        Returns the (tx, outputs, donees) with the fees deducted. '''
+        each_fee = int(math.ceil(size / len(outputs)))
+        outputs = [ (o[0], o[1], o[2]-each_fee) for o in outputs ]
+        donees = { d:v-each_fee for d,v in donees.items() }
+        if any([ bool(o[2] <= 0) for o in outputs]):
+            raise NotEnoughFunds
+        tx = self.wallet.make_unsigned_transaction(inputs=coins, outputs=outputs, config=self.config, fixed_fee=each_fee*len(outputs), **schnorr_kwargs)
+        return tx, outputs, donees
+
+    def show_error(self, msg):
+        self.host.show_error(msg)
+
+    def notify_user(self, coins):
+        #self.print_error("Prompt user called with", coins)
+        if not coins: return
+        if self.is_foregrounded:
+            # We don't do anything when the user has the tab open, because they can do
+            # manual donations then, so they don't need to be prompted.
+            #self.print_error("Not notifying user, tab is foregrounded.")
+            return
+        coinset = { CoinIndex.get_name(c) for c in coins }
+        if coinset == self.last_notify_set:
+            #self.print_error("Not notifying user, set of coins hasn't changed.")
+            return
+        msg = [
+            _("You have {} coins eligible for donation totaling {}.").format(len(coins),
+                                                                             self.host.format_amount_and_units(sum([c.value for c in coins])) ),
+            "",
+            #_("Do you wish to go to the Send tab and donate now?")
+            _("(Go to the 'Donate Change' tab to donate)")
+        ]
+        self.host.notify(msg[0]) #'\n'.join(msg))
+        self.last_notify_set = coinset
+
+    def do_send_tab_send(self, coins):
+        self.print_error("Do send tab send called with", coins)
+
+    def stop(self):
+        self.started = False
+        self.scheduler.cancel(self)
+        self.poll_timer.stop()
+        if self.auto_donation:
+            self.auto_donation.job.cancel()
+            if self.auto_donation.dlg:
+                self.auto_donation.dlg.close()
+            self.auto_donation = None
+        self.invalidate_presigned()
+        self.signer.shutdown()
+        self.broadcaster.close()
+
+    def start(self):
+        self.started = True
+        self.replay_journal()
+        self.schedule_check()
+        self.poll_timer.start(self.poll_interval)
+
+
+#####
+import re
+class CopiedCode:
+    ''' Code copied from elsewhere (EC sourcecode, etc), that we can't rely
+    on always being there across EC versions.. so we pasted it here. The
+    nature of plugins! '''
+
+    _RX_NORMALIZER = re.compile(r'(\.0+)*$')
+    _RX_VARIANT_TOKEN_PARSE = re.compile(r'^(\d+)(.+)$')
+
+    @staticmethod
+    def normalize_version(v):
+        """Used for PROTOCOL_VERSION normalization, e.g '1.4.0' -> (1,4) """
+        return tuple(int(x) for x in __class__._RX_NORMALIZER.sub('', v.strip()).split("."))
+
+    @staticmethod
+    def parse_package_version(pvstr):
+        """ Basically returns a tuple of the normalized version plus the 'variant'
+        string at the end. Eg '3.3.0' -> (3, 3, ''), '3.2.2CS' -> (3, 2, 2, 'CS'),
+        etc.
+
+        Some more examples:
+                '3.3.5CS' -> (3, 3, 5, 'CS')
+                '3.4.5_iOS' -> (3, 4, 5, '_iOS')
+                '3.3.5' -> (3, 3, 5, '')
+                '3.3' -> (3, 3, '')
+                '3.3.0' -> (3, 3, '')
+                '   3.2.2.0 ILikeSpaces ' -> (3, 2, 2, 'ILikeSpaces')
+        Note how 0 fields at the end of the version get normalized with the 0 lopped off:
+                '3.3.0' -> (3, 3, '')
+                '3.5.0.0.0' -> (3, 5, '')
+                '3.5.0.0.0_iOS' -> (3, 5, '_iOS')
+        ... and, finally: The last element is *always* going to be present as
+        a string, the 'variant'. The 'variant' will be the empty string '' if
+        this is the default Electron Cash. If you don't like this heterogeneity of
+        types in a tuple, take the retVal[:-1] slice of the array to toss it
+        (or just use normalize_version above).
+        """
+        def raise_(e=None):
+            exc = ValueError('Failed to parse package version for: "{}"'.format(pvstr))
+            if e: raise exc from e
+            else: raise exc
+        toks = [x.strip() for x in pvstr.split(".")]
+        if not toks:
+            raise_()
+        if toks[-1].isdigit():
+            # Missing 'variant' at end.. add the default '' variant.
+            toks.append('')
+        else:
+            # had 'variant' at end, parse it.
+            m = __class__._RX_VARIANT_TOKEN_PARSE.match(toks[-1])
+            if m:
+                # pop off end and...
+                toks[-1:] = [m.group(1), # add the digit portion back (note it's still a str at this point)
+                             m.group(2).strip()] # add the leftovers as the actual variant
+            else:
+                raise_()
+        try:
+            # make sure everything but the last element is an int.
+            toks[:-1] = [int(x) for x in toks[:-1]]
+        except ValueError as e:
+            raise_(e)
+        # .. and.. finally: Normalize it! (lopping off zeros at the end)
+        toks[:-1] = __class__.normalize_version('.'.join(str(t) for t in toks[:-1]))
+        return tuple(toks)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import os, re
+
+from electroncash.util import PrintError
+
+from .metrics import Timing
+
+
+class TextfileExporter(PrintError):
+    ''' Periodically writes a wallet's donation & engine metrics to a Prometheus node-exporter textfile, for the
+    textfile collector to pick up: <dir>/donate_spare_change_<wallet>.prom, where <dir> is the directory set in the
+    config key CONFIG_DIR. Off unless that key is set.
+
+    Everything written is already counted as it happens (metrics.Metrics, the history index, the coin index), so an
+    export is just formatting, never a rescan. The file is written to a temporary name and renamed into place, so a
+    scrape sees either the old file or the new one, never half of one. The file is removed when the wallet closes.
+
+    Runs on the host's thread (see core.Engine), using the host's wallet_name, config, metrics, data & snapshot. '''
+
+    # config key. the node-exporter textfile collector directory to write to (default: None = don't export)
+    CONFIG_DIR = 'donate_spare_change_metrics_dir'
+    # config key. time in ms between 2 exports (default: default_interval)
+    CONFIG_INTERVAL = 'donate_spare_change_metrics_interval'
+    default_interval = 15000 # ms
+
+    PREFIX = 'donate_spare_change_'
+
+    @classmethod
+    def for_host(cls, host, make_timer):
+        ''' Returns an exporter for host if exporting is configured, otherwise None. '''
+        d = host.config.get(cls.CONFIG_DIR)
+        return cls(host, d, make_timer) if d else None
+
+    def __init__(self, host, directory, make_timer):
+        self.host = host
+        self.wallet_name = host.wallet_name
+        self.path = os.path.join(os.path.expanduser(directory),
+                                 self.PREFIX + re.sub(r'[^A-Za-z0-9_.-]', '_', self.wallet_name) + '.prom')
+        self.interval = int(host.config.get(self.CONFIG_INTERVAL, self.default_interval))
+        self.timer = make_timer(self.on_timer)
+        self.failed = False # so that we complain once, not every interval
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__ + "@" + self.wallet_name
+
+    def start(self):
+        self.print_error("Exporting metrics to", self.path)
+        self.timer.start(0)
+
+    def stop(self):
+        self.timer.stop()
+        try:
+            os.remove(self.path) # a wallet that's closed shouldn't keep reporting its last values
+        except OSError:
+            pass
+
+    def on_timer(self):
+        self.export()
+        self.timer.start(self.interval)
+
+    def export(self):
+        tmp = self.path + '.tmp' # the textfile collector only reads *.prom
+        try:
+            text = self.render()
+            with open(tmp, 'w', encoding = 'utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.failed = False
+        except Exception as e:
+            if not self.failed:
+                self.print_error("Failed to write", self.path, ":", repr(e))
+            self.failed = True
+
+    @staticmethod
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self):
+        ''' Returns the textfile contents, in the Prometheus text exposition format. '''
+        host, out = self.host, list()
+        wallet = 'wallet="{}"'.format(self.escape(self.wallet_name))
+
+        def family(name, kind, help_text, samples):
+            ''' samples: list of (suffix, extra labels or '', value) '''
+            out.append("# HELP {}{} {}".format(self.PREFIX, name, help_text))
+            out.append("# TYPE {}{} {}".format(self.PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                out.append("{}{}{}{{{}}} {}".format(self.PREFIX, name, suffix, wallet + ("," + labels if labels else ""), value))
+
+        snap = host.snapshot
+        if snap is not None:
+            family('coins', 'gauge', "Coins in the wallet, as of the last scan.", [('', '', snap.num_coins)])
+            family('eligible_coins', 'gauge', "Coins eligible for donation, as of the last scan.", [('', '', len(snap.eligible))])
+            family('eligible_value_satoshis', 'gauge', "Total value of the coins eligible for donation, as of the last scan.",
+                   [('', '', snap.eligible_value)])
+
+        m = host.metrics.summary(cumulative = True) # not affected by the Diagnostics 'Reset' button, so counters never go backwards
+        counters = m['counters']
+        family('broadcasts_total', 'counter', "Donation transactions broadcast, by outcome.",
+               [('', 'result="ok"', counters.get('broadcast_ok', 0)), ('', 'result="failed"', counters.get('broadcast_failed', 0))])
+        family('broadcast_retries_total', 'counter', "Donation transaction broadcasts that failed and were retried.",
+               [('', '', counters.get('broadcast_retries', 0))])
+        family('storage_writes_total', 'counter', "Writes of the plugin's data to wallet storage.",
+               [('', '', counters.get('storage_writes', 0))])
+        family('storage_written_bytes_total', 'counter', "Bytes written to wallet storage by those writes.",
+               [('', '', counters.get('storage_bytes', 0))])
+
+        data = host.data
+        names = { c[2] : c[1] for c in data.get_charities() } # address -> name
+        totals = sorted(data.history_get_totals().items())
+        labels = lambda address: 'charity="{}",address="{}"'.format(self.escape(names.get(address, '')), self.escape(address))
+        family('donations_total', 'counter', "Donations made, by recipient.", [ ('', labels(a), ct) for a, (ct, tot) in totals ])
+        family('donated_satoshis_total', 'counter', "Satoshis donated, by recipient.", [ ('', labels(a), tot) for a, (ct, tot) in totals ])
+
+        samples = list()
+        for op, t in sorted(m['timings'].items()):
+            op = 'op="{}"'.format(self.escape(op))
+            cumulative = 0
+            for le, n in zip(Timing.BUCKETS + ('+Inf',), t['buckets']):
+                cumulative += n
+                samples.append(('_bucket', '{},le="{}"'.format(op, le), cumulative))
+            samples.append(('_sum', op, repr(t['total'])))
+            samples.append(('_count', op, t['calls']))
+        family('operation_duration_seconds', 'histogram', "Duration of the plugin's hot path operations (do_check, scan, ...).", samples)
+
+        out.append('')
+        return '\n'.join(out)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import time, threading, functools, bisect
+from collections import deque, defaultdict
+
+
+class Timing:
+    ''' Latency stats for 1 timed operation. The percentiles are over the most recent `window` calls only. The histogram
+    covers all calls: buckets[i] counts the calls taking at most BUCKETS[i] seconds but more than BUCKETS[i-1], and the
+    last bucket counts the ones slower than BUCKETS[-1].
+
+    calls, total & buckets only ever grow, as the exporter publishes them as a Prometheus histogram. reset() just notes
+    their current values as the baseline that summary() reports from, and starts the percentiles & max afresh. '''
+
+    __slots__ = ('calls', 'total', 'max', 'recent', 'buckets', 'base')
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds
+
+    def __init__(self, window):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen = window)
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+        self.base = (0, 0.0, list(self.buckets)) # calls, total & buckets as of the last reset()
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent.append(seconds)
+        self.buckets[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def reset(self):
+        self.base = (self.calls, self.total, list(self.buckets))
+        self.max = 0.0
+        self.recent.clear()
+
+    def summary(self, cumulative = False):
+        ''' calls, total & buckets are since the last reset(), or since the start if cumulative. p50, p95 & max are
+        always since the last reset(). '''
+        r = sorted(self.recent)
+        pct = lambda p: r[min(len(r) - 1, int(p * len(r)))] if r else 0.0
+        calls, total, buckets = self.calls, self.total, list(self.buckets)
+        if not cumulative:
+            base_calls, base_total, base_buckets = self.base
+            calls, total, buckets = calls - base_calls, total - base_total, [ n - b for n, b in zip(buckets, base_buckets) ]
+        return dict(calls = calls, total = total, p50 = pct(0.50), p95 = pct(0.95), max = self.max, buckets = buckets)
+
+
+class Metrics:
+    ''' Timers and counters for the plugin's hot paths. There is 1 of these per wallet Instance, shared by everything
+    working for it (coin index, engine, data model, signing & broadcast workers), hence from several threads.
+
+    Recording is cheap: a perf_counter() pair and a few additions under a lock. All the sorting for the percentiles is
+    left to summary(), which only runs when someone looks.
+
+    There are 2 views of the same numbers: the Diagnostics display, which the user can reset() to start counting from
+    zero, and the cumulative one the exporter publishes as Prometheus counters & histograms, which must never go
+    backwards. So reset() doesn't clear anything the exporter sees; it just moves the display's baseline. '''
+
+    window = 512 # calls per operation that the percentiles are computed over
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = dict() # name -> Timing
+        self.counters = defaultdict(int) # name -> int
+        self.counters_base = dict() # name -> value of that counter as of the last reset()
+        self.started = self.since = time.time()
+
+    def observe(self, name, seconds):
+        ''' Records 1 call of operation `name` that took `seconds`. '''
+        with self.lock:
+            t = self.timings.get(name)
+            if t is None:
+                t = self.timings[name] = Timing(self.window)
+            t.add(seconds)
+
+    def add(self, name, n = 1):
+        ''' Adds n to counter `name`. '''
+        with self.lock:
+            self.counters[name] += n
+
+    def time(self, name):
+        ''' Context manager timing its block as 1 call of operation `name`. '''
+        return _Span(self, name)
+
+    def summary(self, cumulative = False):
+        ''' Returns a dict: timings (name -> dict of calls, total, p50, p95 & max, in seconds, and the histogram buckets, see
+        Timing), counters (name -> int) and since (the time.time() at which counting started).
+
+        Counting starts at the last reset(), and operations & counters with nothing to report since then are left out.
+        If cumulative, everything since this object was created is reported instead (except the percentiles & max). '''
+        with self.lock:
+            if cumulative:
+                timings = { name : t.summary(True) for name, t in self.timings.items() }
+                return dict(timings = timings, counters = dict(self.counters), since = self.started)
+            timings = { name : t.summary() for name, t in self.timings.items() if t.calls > t.base[0] }
+            counters = { name : n - self.counters_base.get(name, 0) for name, n in self.counters.items() }
+            return dict(timings = timings, counters = { name : n for name, n in counters.items() if n }, since = self.since)
+
+    def reset(self):
+        ''' Restarts the counting summary() reports. The cumulative numbers are unaffected. '''
+        with self.lock:
+            for t in self.timings.values():
+                t.reset()
+            self.counters_base = dict(self.counters)
+            self.since = time.time()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 't0')
+
+    def __init__(self, metrics, name):
+        self.metrics, self.name = metrics, name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t0)
+
+
+def timed(name):
+    ''' Method decorator: times every call of the method as operation `name` in self.metrics. '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - t0)
+        return wrapper
+    return decorator
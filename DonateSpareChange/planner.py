@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import math
+
+from . import txsize
+
+MAX_STANDARD_TX_SIZE = 100000 # bytes. nodes won't relay bigger txs
+
+
+def max_inputs_for_size(max_tx_size, num_recipients, schnorr = False, output_script_size = txsize.P2PKH_SCRIPT_SIZE, limit = None):
+    ''' Returns the largest number of inputs a donation tx can have and still fit in max_tx_size bytes (at least 1).
+    Since every coin is assigned its own round-robin recipient, a tx with k inputs has min(k, num_recipients) outputs. '''
+    def size(k):
+        return txsize.estimate_tx_size(k, [output_script_size] * min(k, max(1, num_recipients)), schnorr = schnorr)
+    lo, hi = 1, max(1, limit or max_tx_size) # size(k) grows with k, so binary search for the last k that fits
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if size(mid) <= max_tx_size:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def plan_batches(coins, num_recipients, max_inputs = None, max_tx_size = MAX_STANDARD_TX_SIZE, schnorr = False,
+                 output_script_size = txsize.P2PKH_SCRIPT_SIZE):
+    ''' Partitions coins into donation txs, returning a list of lists of coins (1 list per tx).
+
+    Every tx respects max_tx_size and max_inputs. Within those limits the total number of bytes broadcast is minimised:
+    the inputs cost the same however they are grouped, so what's left to save is the per-tx overhead and outputs, which
+    means using as few txs as possible. Coins are dealt out largest-first in 'snake' order, so that each tx ends up with a
+    similar total value (and hence similarly sized outputs to each recipient).
+
+    max_inputs = 1 gives the 1-tx-per-coin (privacy-preserving) plan. '''
+    n = len(coins)
+    if not n:
+        return []
+    cap = max_inputs_for_size(max_tx_size, num_recipients, schnorr, output_script_size, limit = n)
+    if max_inputs:
+        cap = max(1, min(cap, int(max_inputs)))
+    num_batches = int(math.ceil(n / cap))
+    if num_batches == 1:
+        return [list(coins)]
+    batches = [ list() for _ in range(num_batches) ]
+    for i, c in enumerate(sorted(coins, key = lambda c: c.value, reverse = True)):
+        rnd, j = divmod(i, num_batches)
+        batches[j if rnd % 2 == 0 else num_batches - 1 - j].append(c)
+    return batches
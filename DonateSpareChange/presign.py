@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+from collections import namedtuple
+
+
+class PresignCache:
+    ''' Donation txs that were built and signed ahead of time, for coins that are about to become eligible.
+
+        An entry is only good for exactly the coins it spends, starting from exactly the round-robin state it was built
+        with (the round-robin decides who gets paid, and advances as the tx is built). So that pair is the key, and a
+        lookup with anything else simply misses. Entries also go stale when one of their coins is spent elsewhere, or
+        when the block they were made for came and went without them being used; see prune(). '''
+
+    Entry = namedtuple('Entry', 'tx desc ref donees rr_after height') # rr_after = round-robin state after the tx, height = the block it was made for
+
+    def __init__(self):
+        self.entries = dict() # (frozenset of coin names, tuple of round-robin items) -> Entry
+
+    @staticmethod
+    def key(coin_names, rr):
+        return frozenset(coin_names), tuple(tuple(item) for item in rr)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, coin_names, rr, entry):
+        self.entries[self.key(coin_names, rr)] = entry
+
+    def take(self, coin_names, rr):
+        ''' Removes and returns the entry for exactly these coins & round-robin state, or None. '''
+        return self.entries.pop(self.key(coin_names, rr), None)
+
+    def coin_names(self):
+        ''' Returns the set of the names of all coins spent by our entries. '''
+        return set().union(*(k[0] for k in self.entries))
+
+    def prune(self, spent_names, min_height):
+        ''' Drops entries spending coins in spent_names, or made for a block below min_height (unused). '''
+        for k, e in list(self.entries.items()):
+            if e.height < min_height or not k[0].isdisjoint(spent_names):
+                del self.entries[k]
+
+    def clear(self):
+        self.entries.clear()
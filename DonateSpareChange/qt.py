@@ -5,21 +5,24 @@
 # Copyright (C) 2019 Calin Culianu
 # LICENSE: MIT
 #
-import sys, os, time, binascii, math
+import sys, os, time, math
 
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
 from electroncash.address import Address
-from electroncash.bitcoin import TYPE_ADDRESS
 from electroncash.i18n import _
 from electroncash.plugins import BasePlugin, hook
-from electroncash.util import PrintError, profiler, NotEnoughFunds, ExcessiveFee, InvalidPassword
+from electroncash.util import PrintError
 from electroncash_gui.qt.amountedit import BTCAmountEdit
 from electroncash_gui.qt.util import ColorScheme
-from electroncash import version
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict
+
+from .coin_index import CoinIndex, CoinScanner
+from .metrics import Metrics, timed
+from .exporter import TextfileExporter
+from .core import DataModel, Engine, NetworkDispatcher, CheckScheduler, check_version, is_wallet_incompatible, note_network_event
 
 
 class Plugin(BasePlugin):
@@ -34,7 +37,10 @@ class Plugin(BasePlugin):
         self.is_new_network_callback_api = False
         self.is_slp = False
         self.is_shufbeta = False
-        self._check_version()  # will set is_new_network_callback_api & is_slp
+        check_version(self)  # will set is_new_network_callback_api & is_slp
+        self.caller = None # QtCaller the dispatcher uses to get to the GUI thread
+        self.dispatcher = None # NetworkDispatcher shared by all instances, created on first load_wallet
+        self.scheduler = None # CheckScheduler shared by all instances, created on first load_wallet
 
     def shortName(self):
         return _("Donate Change")
@@ -62,6 +68,9 @@ class Plugin(BasePlugin):
             instance.close()
             ct += 1
         self.instances = list()
+        if self.scheduler:
+            self.scheduler.stop()
+        self.caller, self.dispatcher, self.scheduler = None, None, None
         self.print_error("on_close: closed %d extant instances" % (ct) )
 
     @hook
@@ -86,6 +95,10 @@ class Plugin(BasePlugin):
         if Plugin.HAS_SCHNORR_API is None:
             Plugin.HAS_SCHNORR_API = bool(getattr(window, 'is_schnorr_enabled', False) or getattr(window.wallet, 'is_schnorr_enabled', False))
             self.print_error("Schnorr API present in this Electron Cash:", "YES" if Plugin.HAS_SCHNORR_API else "No")
+        if not self.dispatcher:
+            self.caller = QtCaller()
+            self.dispatcher = NetworkDispatcher(self, self.caller)
+            self.scheduler = CheckScheduler(lambda callback: make_qtimer(None, callback))
         self.instances.append(Instance(self, wallet, window))
 
     @hook
@@ -104,33 +117,13 @@ class Plugin(BasePlugin):
             if instance.wallet == wallet:
                 instance.on_set_label(name, text)
 
-    def _check_version(self):
-        full_ver = CopiedCode.parse_package_version(version.PACKAGE_VERSION)
-        normalized_ver = full_ver[:-1]
-        variant = full_ver[-1]
-
-        if variant == "ShufBeta":
-            self.is_shufbeta = True
-        elif variant != '':
-            self.print_error("Unknown Electron Cash variant:", variant)
-            return
-        elif normalized_ver >= (3,4) and normalized_ver < (3,5):
-            self.is_slp = True
-
-        if self.is_shufbeta:
-            min_new_api_ver = (3,9,8)
-        elif self.is_slp:
-            min_new_api_ver = (3,4,6)
-        else:
-            min_new_api_ver = (3,3,7)
-
-        self.is_new_network_callback_api = normalized_ver >= min_new_api_ver
-
 
 class Instance(QWidget, PrintError):
     ''' Encapsulates a wallet-specific instance. '''
 
-    sig_network_updated = pyqtSignal()
+    sig_network_updated = pyqtSignal() # coalesced: at most 1 per min_refresh_interval, see note_network_updated()
+    sig_network_dirty = pyqtSignal() # emitted from the network thread, on the first event after a refresh
+    sig_snapshot = pyqtSignal(object) # coin_index.Snapshot. emitted from the scanner thread
     sig_user_tabbed_to_us = pyqtSignal()
     sig_user_tabbed_from_us = pyqtSignal()
     sig_window_moved = pyqtSignal()
@@ -138,54 +131,101 @@ class Instance(QWidget, PrintError):
     sig_window_activation_changed = pyqtSignal()
     sig_window_unblocked = pyqtSignal()
 
+    # config key. minimum time in ms between 2 refreshes caused by network events (default: min_refresh_interval)
+    CONFIG_MIN_REFRESH_INTERVAL = 'donate_spare_change_min_refresh_interval'
+    min_refresh_interval = 250 # Qt ms value
+    # config key. if true (the default), the tab's widgets are only built when the user first visits the tab
+    CONFIG_LAZY_TAB = 'donate_spare_change_lazy_tab'
+
     def __init__(self, plugin, wallet, window):
         super().__init__()
         self.plugin = plugin
         self.wallet = wallet
         self.window = window
         self.window.installEventFilter(self)
+        self.config = plugin.config
         self.wallet_name = os.path.split(wallet.storage.path)[1]
-        self.data = self.DataModel(self, self.wallet.storage, self.plugin.config)
+        self.caller = QtCaller(self) # how the Qt-free code (scanner, engine) gets back to the GUI thread
+        self.metrics = Metrics() # timings & counters of our hot paths, see get_diagnostics()
+        self.data = DataModel(self.plugin.name, self.wallet.storage, self.config, make_timer = lambda callback: make_qtimer(self, callback),
+                              metrics = self.metrics)
         self.already_warned_incompatible = False
-        self.incompatible, self.is_slp = self.is_wallet_incompatibile()
-        self.disabled = False
+        self.incompatible, self.is_slp = is_wallet_incompatible(self.wallet, self.print_error)
+        self.is_schnorr_enabled = self.get_schnorr_enabled_func()
+        self.disabled = bool(self.incompatible)
+        if self.incompatible:
+            self.print_error("Wallet is incompatible, disabling for this wallet")
         self.did_register_callback = False
-
-        # do stuff to setup UI...
-        from .ui import Ui_Instance
-        self.ui = Ui_Instance()
-        self.ui.setupUi(self)
-        self.platform_cleanups()
-
-        self.ch_mgr = self.CharitiesMgr(self, self.ui, self.data)
-        self.cr_mgr = self.CriteriaMgr(self, self.ui, self.data)
-        self.co_mgr = self.CoinsMgr(self, self.ui, self.data)
-        self.engine = self.Engine(self, self.wallet, self.window, self.co_mgr, self.data)
+        # Network events arrive in storms (thousands a second during sync or a reorg). The network thread only raises
+        # network_dirty, and the GUI thread turns any number of those into 1 sig_network_updated per refresh interval.
+        self.network_dirty = False
+        self.last_network_refresh = 0.0 # time.monotonic() of the last sig_network_updated
+        self.network_refresh_timer = QTimer(self)
+        self.network_refresh_timer.setSingleShot(True)
+        self.network_refresh_timer.timeout.connect(self.on_network_refresh_timer)
+        self.sig_network_dirty.connect(self.on_network_dirty)
+        self.coin_index = CoinIndex(self.wallet, self.data.get_changedef, self.metrics) # incrementally-maintained coin eligibility, shared by the engine and the coins list
+        # The index is only ever refreshed on the scanner's thread. The GUI thread just renders the snapshots it hands us.
+        self.scanner = CoinScanner(self.coin_index, on_snapshot = lambda snap: self.sig_snapshot.emit(snap))
+        self.snapshot = None # the newest Snapshot we received
+        self.sig_snapshot.connect(self.on_snapshot)
+
+        # The widgets & their managers are built by setup_ui(), normally not until the user first visits our tab: most
+        # wallets' tabs never get looked at, and building them (plus the coins list's first scan) is most of the cost
+        # of opening a wallet. Until then we're an empty placeholder tab, but the engine below runs regardless.
+        self.ui = None
+        self.ch_mgr, self.cr_mgr, self.co_mgr, self.di_mgr = (None,) * 4
+        self.engine = Engine(self, self.plugin.scheduler)
+        self.exporter = TextfileExporter.for_host(self, lambda callback: make_qtimer(self, callback)) # None unless configured
 
         # connect any signals/slots
-        self.cr_mgr.criteria_changed_signal.connect(self.co_mgr.refresh)
+        self.sig_user_tabbed_to_us.connect(lambda: self.engine.set_foregrounded(True))
+        self.sig_user_tabbed_from_us.connect(lambda: self.engine.set_foregrounded(False))
+        self.sig_network_updated.connect(self.engine.on_network_updated)
         self.sig_user_tabbed_to_us.connect(self.on_user_tabbed_to_us)
         # connect cashaddr signal to refresh all UI addresses, etc
         self.window.cashaddr_toggled_signal.connect(self.refresh_all)
-        self.sig_window_unblocked.connect(self.ch_mgr.refresh) # special case -- prefs screen may have closed and our units changed.
-
-        self.disable_if_incompatible()
 
         if self.wallet.network and not self.incompatible:
-            if self.plugin.is_new_network_callback_api:
-                interests = ['wallet_updated', 'blockchain_updated', 'verified2']
-            else:
-                self.print_error("Warning: Your version of Electron Cash is deprecated. Please upgrade.")
-                interests = ['updated', 'verified']
-            self.wallet.network.register_callback(self.on_network, interests)
+            self.plugin.dispatcher.add(self) # network events reach us via the plugin's dispatcher, which calls self.on_network
             self.did_register_callback = True
+            self.sig_user_tabbed_to_us.connect(lambda: self.on_tab_active_changed(True))
+            self.sig_user_tabbed_from_us.connect(lambda: self.on_tab_active_changed(False))
 
 
         # finally, add the UI to the wallet window
         window.tabs.addTab(self, plugin.icon(), plugin.shortName())
+        if not self.config.get(self.CONFIG_LAZY_TAB, True):
+            self.setup_ui()
 
         if not self.incompatible:
             self.engine.start()
+            if self.exporter:
+                self.exporter.start()
+
+    def setup_ui(self):
+        ''' Builds our tab's widgets and their managers, which also starts the coins list's first scan. Called from
+        event() when the tab is first shown (or from __init__ if lazy tab construction is off). '''
+        if self.ui or not self.wallet:
+            return
+        from .ui import Ui_Instance
+        self.ui = Ui_Instance()
+        self.ui.setupUi(self)
+        self.platform_cleanups()
+
+        self.ch_mgr = self.CharitiesMgr(self, self.ui, self.data)
+        self.cr_mgr = self.CriteriaMgr(self, self.ui, self.data)
+        self.co_mgr = self.CoinsMgr(self, self.ui, self.data)
+        self.di_mgr = self.DiagnosticsMgr(self, self.ui)
+
+        self.cr_mgr.criteria_changed_signal.connect(self.co_mgr.refresh)
+        self.cr_mgr.criteria_changed_signal.connect(self.engine.on_settings_changed)
+        self.cr_mgr.autodonate_enabled_signal.connect(self.engine.schedule_check)
+        self.cr_mgr.autodonate_disabled_signal.connect(self.engine.on_autodonate_disabled)
+        self.ch_mgr.charities_changed_signal.connect(self.engine.on_settings_changed)
+        self.sig_window_unblocked.connect(self.ch_mgr.refresh) # special case -- prefs screen may have closed and our units changed.
+
+        self.disable_if_incompatible()
 
     def platform_cleanups(self):
         if sys.platform != 'darwin':
@@ -214,34 +254,132 @@ class Instance(QWidget, PrintError):
                     w.setFont(f)
 
     def on_network(self, event, *args):
-        # network thread
-        if event == 'updated' and (not args or args[0] is self.wallet):
-            self.sig_network_updated.emit() # this passes the call to the gui thread
-        elif event == 'verified': # grr.. old api sucks
-            self.sig_network_updated.emit() # this passes the call to the gui thread
-        elif event in ('wallet_updated', 'verified2') and args[0] is self.wallet:
-            self.sig_network_updated.emit() # this passes the call to the gui thread
-        elif event == 'blockchain_updated':
-            self.sig_network_updated.emit() # this passes the call to the gui thread
-
-    def is_wallet_incompatibile(self):
-        is_watching_only_method = getattr(self.wallet, 'is_watching_only', lambda: False)
-        is_slp = self.wallet.storage.get('wallet_type', '').strip().lower() == 'bip39-slp'
-        try:
-            from electroncash.keystore import Hardware_KeyStore
-            from electroncash.wallet import Multisig_Wallet
-            if (is_slp
-                or is_watching_only_method()
-                or isinstance(self.wallet, (Multisig_Wallet,))
-                or any([isinstance(k, Hardware_KeyStore) for k in self.wallet.get_keystores()])):
-                # wallet is multisig, hardware, slp, or watching only.. return True (incompatible)
-                return True, is_slp
-            else:
-                return False, False
-        except (ImportError, AttributeError) as e:
-            # Hmm. Electron Cash API change? Proceed anyway and the user will just get error messages if plugin can't spend.
-            self.print_error("Error checking wallet compatibility:",repr(e))
-        return is_watching_only_method() or is_slp, is_slp
+        # network thread. called by the plugin's NetworkDispatcher for the events concerning our wallet.
+        if note_network_event(self.coin_index, self.wallet, event, *args):
+            self.note_network_updated()
+
+    def note_network_updated(self):
+        # any thread
+        if not self.network_dirty:
+            self.network_dirty = True
+            self.sig_network_dirty.emit() # this passes the call to the gui thread
+
+    def on_network_dirty(self):
+        if self.plugin and not self.network_refresh_timer.isActive():
+            interval = self.plugin.config.get(self.CONFIG_MIN_REFRESH_INTERVAL, self.min_refresh_interval) / 1e3
+            wait = self.last_network_refresh + interval - time.monotonic()
+            self.network_refresh_timer.start(max(0, int(math.ceil(wait * 1e3))))
+
+    def on_network_refresh_timer(self):
+        if not self.plugin:
+            return # closed
+        self.network_dirty = False # before emitting, so that events arriving during the refresh schedule another one
+        self.last_network_refresh = time.monotonic()
+        self.sig_network_updated.emit()
+
+    def request_scan(self, watch = (), full = False):
+        ''' Asks the scanner for a fresh snapshot, which on_snapshot() will pass on to the coins list and the engine. It's a
+        full one (with all the coins, for the coins list) if asked for, and always while the coins list is showing, so that
+        an engine request coming in right after a coins list one can't have it answered by an eligible-only snapshot. '''
+        full = full or bool(self.co_mgr and self.co_mgr.active)
+        return self.scanner.request(full = full, watch = watch)
+
+    def on_snapshot(self, snap):
+        if not self.plugin or self.scanner.is_stale(snap):
+            return # closed, or newer data arrived while this was being taken and another snapshot is on its way
+        self.snapshot = snap
+        if self.co_mgr and snap.coins is not None:
+            self.co_mgr.render(snap)
+        self.engine.on_snapshot(snap)
+
+    def on_tab_active_changed(self, b):
+        ''' The dispatcher only passes new blocks on to us while our tab is showing, or when our engine asked for them. '''
+        if self.plugin and self.plugin.dispatcher:
+            self.plugin.dispatcher.set_active(self, b)
+
+    def get_diagnostics(self):
+        ''' Returns the timings & counters of this wallet's hot paths, as a dict. See metrics.Metrics.summary(). '''
+        return self.metrics.summary()
+
+    def reset_diagnostics(self):
+        self.metrics.reset()
+
+    def get_schnorr_enabled_func(self):
+        if not Plugin.HAS_SCHNORR_API:
+            return None
+        if getattr(self.window, 'is_schnorr_enabled', None): # 4.0.3 & 4.0.4 API
+            return self.window.is_schnorr_enabled
+        elif getattr(self.wallet, 'is_schnorr_enabled', None): # 4.0.4-git and beyond API
+            return self.wallet.is_schnorr_enabled
+        raise RuntimeError("Cannot find 'is_schnorr_enabled' function -- FIXME")
+
+    # --- The things the (Qt-free) Engine needs from us. See core.Engine.
+
+    def call_soon(self, fn, *args):
+        self.caller(fn, *args)
+
+    def make_timer(self, callback):
+        return make_qtimer(self, callback)
+
+    def set_wake_height(self, height):
+        if self.did_register_callback and self.plugin and self.plugin.dispatcher:
+            self.plugin.dispatcher.set_wake_height(self, height)
+
+    def short_name(self):
+        return self.plugin.shortName()
+
+    def notify(self, msg):
+        self.window.notify(msg)
+
+    def show_error(self, msg):
+        self.window.show_error(msg = (self.plugin.shortName() + ":\n\n" + msg))
+
+    def format_amount_and_units(self, sats):
+        return self.window.format_amount_and_units(sats)
+
+    def history_changed(self):
+        if self.ch_mgr:
+            self.ch_mgr.refresh()
+
+    def autodonate_turned_off(self):
+        if self.cr_mgr:
+            self.cr_mgr.refresh()
+
+    def make_progress(self, value, maximum):
+        dlg = QProgressDialog(_("Auto-Donating, please wait..."), "", value, maximum, self.window)
+        dlg.setAttribute(Qt.WA_DeleteOnClose) # so close() is all the engine has to do
+        dlg.setCancelButton(None)
+        dlg.setWindowTitle(self.plugin.shortName())
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.setMinimumDuration(0)
+        dlg.setValue(value)
+        return dlg
+
+    def show_transaction(self, tx, desc):
+        self.window.show_transaction(tx, desc)
+
+        if self.data.get_autodonate():
+            ''' Hack -- in case the user hit "donate eligible" while in auto-mode, suppress auto-donation while
+                the tx dialog is up using this monkey-patching technique. ;) '''
+
+            try:
+                from electroncash_gui.qt.transaction_dialog import dialogs
+                txdlg = dialogs[-1]
+                origMethod = txdlg.closeEvent
+                def myCloseEvent(event):
+                    if not self.plugin:
+                        origMethod(event)
+                        return # early return -- plugin was closed!
+                    self.print_error("monkey-patched tx dialog close called", event)
+                    origMethod(event)
+                    if event.isAccepted():
+                        self.engine.suppress_auto_pop()
+                txdlg.closeEvent = myCloseEvent
+                self.engine.suppress_auto_push()
+            except (AttributeError, ImportError):
+                import traceback
+                traceback.print_exc()
+                self.print_error("Could not suppress auto")
 
     def on_user_tabbed_to_us(self):
         #self.print_error("user tabbed to us")
@@ -266,8 +404,6 @@ class Instance(QWidget, PrintError):
 
     def disable_if_incompatible(self):
         if self.incompatible:
-            self.disabled = True
-            self.print_error("Wallet is incompatible, disabling for this wallet")
             gbs = [self.ui.gb_criteria, self.ui.gb_coins, self.ui.gb_charities]
             for gb in gbs: gb.setEnabled(False) # disable all controls
 
@@ -279,6 +415,7 @@ class Instance(QWidget, PrintError):
         #self.print_error("got event with type",event.type())
         if event.type() in (QEvent.WindowUnblocked, QEvent.ShowToParent) and self.wallet:
             if event.type() == QEvent.ShowToParent:
+                self.setup_ui() # first visit: build the tab now, so that its managers hear the signal below
                 self.sig_user_tabbed_to_us.emit()
             else:
                 self.sig_window_unblocked.emit()
@@ -303,6 +440,9 @@ class Instance(QWidget, PrintError):
         return super().eventFilter(window, event)
 
     def refresh_all(self):
+        if not self.ui:
+            return # nothing to refresh until our tab is first shown
+        # NB: coins the user froze/unfroze in the meantime are picked up by the coin index's next refresh (it diffs the wallet's frozen sets)
         self.cr_mgr.refresh()
         self.co_mgr.refresh()
         # NB: we do NOT call ch_mgr.refresh() here because this refresh_all function is called a on_network and the user might be editing
@@ -324,8 +464,12 @@ class Instance(QWidget, PrintError):
     def close(self):
         self.print_error("Close called on an Instance")
         self.engine.stop()
-        if self.did_register_callback:
-            self.wallet.network and self.wallet.network.unregister_callback(self.on_network)
+        if self.exporter:
+            self.exporter.stop()
+        self.scanner.close()
+        self.data.flush() # write out any pending changes before the wallet goes away
+        if self.did_register_callback and self.plugin.dispatcher:
+            self.plugin.dispatcher.remove(self)
         if self.window:
             self.window.removeEventFilter(self)
             ix = self.window.tabs.indexOf(self)
@@ -333,7 +477,8 @@ class Instance(QWidget, PrintError):
                 self.window.tabs.removeTab(ix)
                 self.deleteLater() # since qt doesn't delete us, we need to explicitly delete ourselves, otherwise the QWidget lives around forever in memory
         self.disabled = True
-        self.window, self.plugin, self.wallet, self.wallet_name, self.data, self.ch_mgr, self.co_mgr, self.cr_mgr, self.engine = (None,) * 9 # trigger object cleanup sooner rather than later!
+        self.window, self.plugin, self.wallet, self.wallet_name, self.data, self.ch_mgr, self.co_mgr, self.cr_mgr, self.di_mgr, self.engine, self.exporter, self.coin_index, self.scanner, self.snapshot = (None,) * 14
+        self.is_schnorr_enabled = None # trigger object cleanup sooner rather than later!
 
     #overrides PrintError super
     def diagnostic_name(self):
@@ -343,6 +488,8 @@ class Instance(QWidget, PrintError):
     class CharitiesMgr(QObject, PrintError):
         ''' Manages the 'Charities' treewidget and associated GUI controls and per-wallet data. '''
 
+        charities_changed_signal = pyqtSignal()
+
         def __init__(self, parent, ui, data):
             super().__init__(parent)
             self.parent = parent
@@ -476,6 +623,7 @@ class Instance(QWidget, PrintError):
                 charities.append((enabled, name, address))
 
             self.data.set_charities(charities, save=True)
+            self.charities_changed_signal.emit()
 
         def refresh(self):
             if not self.refresh_blocked:
@@ -495,6 +643,7 @@ class Instance(QWidget, PrintError):
         criteria_changed_signal = pyqtSignal()
         user_began_editing_signal = pyqtSignal()
         autodonate_disabled_signal = pyqtSignal()
+        autodonate_enabled_signal = pyqtSignal()
 
         WARN_HIGH_AMOUNT = 200000 # in sats: 2 mBCH
 
@@ -623,6 +772,8 @@ class Instance(QWidget, PrintError):
             self.data.set_autodonate(b, save = True)
             if was and not b:
                 self.autodonate_disabled_signal.emit()
+            elif b and not was:
+                self.autodonate_enabled_signal.emit()
 
         def on_singletx_checked(self, b):
             self.data.set_singletx(b, save = True)
@@ -662,7 +813,186 @@ class Instance(QWidget, PrintError):
                 self.popup_timer = None
 
     class CoinsMgr(QObject, PrintError):
-        ''' Manages the 'Coins' treewidget and associated GUI controls and per-wallet data. '''
+        ''' Manages the 'Coins' treeview and associated GUI controls and per-wallet data. '''
+
+        class CoinsModel(QAbstractTableModel):
+            ''' Table model backing the coins treeview.  Each row is just a reference to a CoinRecord from a
+            coin index Snapshot -- no per-row Qt objects are created, and cell text and colors are only produced when the view asks
+            for them, which it only does for visible rows. '''
+
+            COL_AMOUNT, COL_ADDRESS, COL_AGE, COL_STATUS = range(4)
+
+            def __init__(self, mgr):
+                super().__init__(mgr)
+                self.mgr = mgr # CoinsMgr
+                self.coins = list() # the CoinRecords, in display order
+                self.names = list() # outpoint names, parallel to self.coins
+                self.name_set = set()
+                self.states = dict() # outpoint name -> row_state() as of the last reconcile
+                self.local_height = None
+                self.sort_column, self.sort_order = -1, Qt.AscendingOrder # -1 = our 'natural' order: eligible first, then by amount, height
+                self.headers = [ _("Amount"), _("Address"), _("Age"), _("Status") ]
+
+            def rowCount(self, parent = QModelIndex()):
+                return 0 if parent.isValid() else len(self.coins)
+
+            def columnCount(self, parent = QModelIndex()):
+                return 0 if parent.isValid() else len(self.headers)
+
+            def headerData(self, section, orientation, role = Qt.DisplayRole):
+                if orientation == Qt.Horizontal and role == Qt.DisplayRole and 0 <= section < len(self.headers):
+                    return self.headers[section]
+                return None
+
+            def flags(self, index):
+                if not index.isValid():
+                    return Qt.NoItemFlags
+                return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+            def data(self, index, role = Qt.DisplayRole):
+                if not index.isValid() or index.row() >= len(self.coins):
+                    return None
+                c = self.coins[index.row()]
+                if role == Qt.DisplayRole:
+                    return self.mgr.cell_text(c, index.column())
+                elif role == Qt.ForegroundRole:
+                    return self.mgr.cell_brush(c, index.column())
+                elif role == Qt.UserRole:
+                    return c # the coin itself.. in case we need it later
+                return None
+
+            def sort_key(self, column):
+                if column == self.COL_AMOUNT:
+                    return lambda c: c.value
+                elif column == self.COL_ADDRESS:
+                    return lambda c: c.address.to_ui_string()
+                elif column == self.COL_AGE:
+                    return lambda c: c.age
+                elif column == self.COL_STATUS:
+                    return lambda c: (c.is_frozen, not c.is_eligible, c.reasons) # same order as the text, without making it
+                return lambda c: (c.is_frozen, not c.is_eligible, c.value, c.height)
+
+            def is_reversed(self):
+                return self.sort_column >= 0 and self.sort_order == Qt.DescendingOrder
+
+            @staticmethod
+            def row_state(c):
+                ''' The parts of a coin that can change while it sits in the list. '''
+                return (c.reasons, c.height)
+
+            def sort(self, column, order = Qt.AscendingOrder):
+                ''' Overrides QAbstractItemModel. Called by the view when the user clicks a header. Persistent indices (such as
+                the selection) are remapped so they keep pointing at the same coins. '''
+                self.sort_column, self.sort_order = column, order
+                self.layoutAboutToBeChanged.emit()
+                key = self.sort_key(column)
+                perm = sorted(range(len(self.coins)), key = lambda row: key(self.coins[row]), reverse = self.is_reversed())
+                self.coins = [self.coins[row] for row in perm]
+                self.names = [self.names[row] for row in perm]
+                old2new = [0] * len(perm)
+                for new, old in enumerate(perm):
+                    old2new[old] = new
+                from_list = self.persistentIndexList()
+                to_list = [ self.index(old2new[i.row()], i.column()) for i in from_list ]
+                self.changePersistentIndexList(from_list, to_list)
+                self.layoutChanged.emit()
+
+            def _in_order(self, key, a, b):
+                return key(a) >= key(b) if self.is_reversed() else key(a) <= key(b)
+
+            def _insert_pos(self, key, c):
+                ''' Binary search for the row at which c goes, given that self.coins is sorted. '''
+                k, rev = key(c), self.is_reversed()
+                lo, hi = 0, len(self.coins)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    km = key(self.coins[mid])
+                    if (km >= k) if rev else (km <= k):
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return lo
+
+            def _emit_row_runs(self, rows, first_col, last_col):
+                ''' Emits one dataChanged per contiguous run of rows. '''
+                runs = []
+                for row in sorted(rows):
+                    if runs and runs[-1][1] == row - 1:
+                        runs[-1][1] = row
+                    else:
+                        runs.append([row, row])
+                for first, last in runs:
+                    self.dataChanged.emit(self.index(first, first_col), self.index(last, last_col))
+
+            def reconcile(self, coins, local_height):
+                ''' Update the model in place to contain exactly `coins`, keyed by outpoint name: only coins that went away get
+                removed, only new coins get inserted (at their sorted position), and only rows whose state changed get a
+                dataChanged. The selection and scroll position are preserved since the rows are never reset. A new block
+                with no other effect just emits a single dataChanged covering the Age column. '''
+                new = { CoinIndex.get_name(c) : c for c in coins }
+                # 1. Remove vanished coins, in contiguous runs from the bottom up so that row numbers stay valid
+                gone = self.name_set - new.keys()
+                if gone:
+                    runs = []
+                    for row in reversed(range(len(self.names))):
+                        if self.names[row] in gone:
+                            if runs and runs[-1][0] == row + 1:
+                                runs[-1][0] = row
+                            else:
+                                runs.append([row, row])
+                    for first, last in runs:
+                        self.beginRemoveRows(QModelIndex(), first, last)
+                        del self.coins[first:last+1]
+                        del self.names[first:last+1]
+                        self.endRemoveRows()
+                    self.name_set -= gone
+                    for name in gone:
+                        self.states.pop(name, None)
+                # 2. Update rows whose eligibility/frozen state or height changed
+                changed = []
+                for row, name in enumerate(self.names):
+                    c = new[name]
+                    self.coins[row] = c
+                    st = self.row_state(c)
+                    if st != self.states[name]:
+                        self.states[name] = st
+                        changed.append(row)
+                if changed:
+                    self._emit_row_runs(changed, 0, self.columnCount()-1)
+                    # The list was sorted before, so it's still sorted iff every changed row is in order with its neighbours.
+                    key, n = self.sort_key(self.sort_column), len(self.coins)
+                    if any( (row > 0 and not self._in_order(key, self.coins[row-1], self.coins[row]))
+                            or (row < n-1 and not self._in_order(key, self.coins[row], self.coins[row+1]))
+                            for row in changed ):
+                        self.sort(self.sort_column, self.sort_order) # re-sort via layoutChanged -- no rebuild, selection is kept
+                if local_height != self.local_height and self.coins:
+                    # ages moved. Repaint just the Age column; the view only re-queries the visible cells.
+                    self.dataChanged.emit(self.index(0, self.COL_AGE), self.index(len(self.coins)-1, self.COL_AGE))
+                self.local_height = local_height
+                # 3. Insert new coins
+                added = [ name for name in new if name not in self.name_set ]
+                if added:
+                    if len(added) > 64:
+                        # lots of new coins (such as the initial load): append them all at once and then sort once
+                        first = len(self.coins)
+                        self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+                        for name in added:
+                            self._insert(len(self.coins), name, new[name])
+                        self.endInsertRows()
+                        self.sort(self.sort_column, self.sort_order)
+                    else:
+                        key = self.sort_key(self.sort_column)
+                        for name in added:
+                            row = self._insert_pos(key, new[name])
+                            self.beginInsertRows(QModelIndex(), row, row)
+                            self._insert(row, name, new[name])
+                            self.endInsertRows()
+
+            def _insert(self, row, name, c):
+                self.coins.insert(row, c)
+                self.names.insert(row, name)
+                self.name_set.add(name)
+                self.states[name] = self.row_state(c)
 
         def __init__(self, parent, ui, data):
             super().__init__(parent)
@@ -670,12 +1000,16 @@ class Instance(QWidget, PrintError):
             self.ui = ui
             self.data = data
             self.active = False # we won't refresh on "updated" signals until this is true (when user tabs to us)
+            self.metrics = parent.metrics
 
+            self.model = self.CoinsModel(self)
+            self.ui.tree_coins.setModel(self.model)
+            self.ui.tree_coins.header().setSortIndicator(-1, Qt.AscendingOrder) # start out in 'natural' order
             self.ui.tree_coins.setColumnWidth(0, 120)
             self.ui.tree_coins.setColumnWidth(1, 120)
             self.ui.tree_coins.setColumnWidth(2, 70)
-            self.brushNormal, self.brushIneligible, self.brushFrozen, self.brushEligible = (
-                QBrush(), QBrush(QColor("#999999")),
+            self.brushIneligible, self.brushFrozen, self.brushEligible = (
+                QBrush(QColor("#999999")),
                 QBrush(QColor("lightblue") if ColorScheme.dark_scheme else QColor("#003399")),
                 QBrush(ColorScheme.GREEN.as_color() if ColorScheme.dark_scheme else QColor("darkgreen"))
             )
@@ -688,7 +1022,7 @@ class Instance(QWidget, PrintError):
             self.parent.sig_user_tabbed_from_us.connect(lambda: self.on_activate_status_change(False))
             self.parent.sig_user_tabbed_to_us.connect(lambda: self.on_activate_status_change(True))
             self.parent.sig_network_updated.connect(self.on_network_updated) # when tx's come in or blocks come in, we need to refresh utxo list.
-            self.ui.tree_coins.itemSelectionChanged.connect(self.on_selection_changed) # coins selection changed
+            self.ui.tree_coins.selectionModel().selectionChanged.connect(self.on_selection_changed) # coins selection changed
             self.ui.bt_donate_selected.clicked.connect(self.on_donate_selected)
             self.ui.bt_donate_all.clicked.connect(self.on_donate_all)
             # Context Menu Setup
@@ -712,118 +1046,80 @@ class Instance(QWidget, PrintError):
             #self.print_error("refresh")
             self.reload()
 
-        def get_coins(self, eligible_only = False, from_treewidget = False, selected_only = False):
-            ''' Returns a list of coins, either from the cached items in the treewidget or from the wallet. '''
+        def selected_rows(self):
+            return sorted(ix.row() for ix in self.ui.tree_coins.selectionModel().selectedRows())
+
+        def get_coins(self, eligible_only = False, from_view = False, selected_only = False):
+            ''' Returns a list of coins, either from the coins currently displayed in the treeview or from the newest snapshot
+            of the wallet. '''
 
-            if from_treewidget:
+            if from_view:
                 if selected_only:
-                    items = self.ui.tree_coins.selectedItems()
+                    coins = [self.model.coins[row] for row in self.selected_rows()]
                 else:
-                    items = self.ui.tree_coins.findItems("", Qt.MatchContains, 0)
-                okcoins = 0
-                def chk(item):
-                    nonlocal okcoins
-                    ok = item.data(0, Qt.UserRole)['is_eligible']
-                    okcoins = okcoins + int(ok)
-                    return not eligible_only or ok
-                coins = [item.data(0, Qt.UserRole) for item in items if chk(item)] # narrow down to eligibile coins if eligible_only is true
-                return coins, okcoins
-            else:
-                okcoins = 0
-                amount, age, agetype = self.data.get_changedef()
-                if amount is None: amount = 0
-                lh = self.parent.wallet.get_local_height()
-                coins = self.parent.wallet.get_utxos(domain = None, exclude_frozen = False, mature = True, confirmed_only = False)
-                for c in coins:
-                    c['is_frozen'] = int(bool(self.parent.wallet.is_frozen(c['address'])) or c.get('is_frozen_coin', False))
-                    c['age'] = (lh - c['height']) + 1 if c['height'] and c['height'] > 0 else -1
-                    valtest = c['value'] <  amount
-                    agetest = age <= 0 or ( c['age'] >= age )
-                    dusttest = c['value'] > 770 # we hard-code 546 + 224 as the minimal size we consider "dust"
-                    #self.print_error("lh",lh,"cheight",c['height'],"age",age)
-                    c['is_eligible'] = int(not c['is_frozen'] and valtest and agetest and dusttest)
-                    if c['is_eligible']:
-                        c['eligibility_text'] = _("Eligible for donation")
-                        okcoins += 1
-                    else:
-                        txt = _("Ineligible:") + " "
-                        reasons = []
-                        if c['is_frozen']: reasons.append(_("Frozen"))
-                        else:
-                            if not dusttest: reasons.append(_("Dust"))
-                            else:
-                                if not valtest: reasons.append(_("Amount"))
-                                if not agetest: reasons.append(_("Age"))
-                        c['eligibility_text'] = txt + ', '.join(reasons)
-                coins.sort(key=lambda c: [ c['is_frozen'], 100-c['is_eligible'], c['value'], c['height'], ], reverse = False)
+                    coins = self.model.coins
+                okcoins = sum(c.is_eligible for c in coins)
                 if eligible_only:
-                    return [c for c in coins if c['is_eligible'] ], okcoins
-                return coins, okcoins
+                    coins = [c for c in coins if c.is_eligible] # narrow down to eligibile coins if eligible_only is true
+                return list(coins), okcoins
+            else:
+                snap = self.parent.snapshot
+                coins = snap and (snap.eligible if eligible_only else snap.coins)
+                if coins is None:
+                    return list(), 0
+                return list(coins), len(snap.eligible)
 
         def reload(self):
             #self.print_error("reload")
-            self.ui.tree_coins.clear()
             if not self.parent.wallet or self.parent.incompatible:
+                self.model.reconcile([], None)
                 return
-            scroll_pos_val = self.ui.tree_coins.verticalScrollBar().value() # save previous scroll bar position
-            oldSelCoins, oldCount = self.get_coins(from_treewidget = True, selected_only = True) # save previous selection
-            oldSelNames = {self.get_name(selCoin) for selCoin in oldSelCoins}
-
-            self.ui.bt_donate_selected.setEnabled(False)
+            self.parent.request_scan(full = True) # the scanner thread does the work; we get called back in render()
 
-            coins, okcoins = self.get_coins()
-            for c in coins:
-                item = self.add_item(c)
-                if self.get_name(c) in oldSelNames:
-                    # restore previous selection state on coin
-                    item.setSelected(True)
+        @timed('render')
+        def render(self, snap):
+            ''' Shows a Snapshot. Called on the GUI thread for every fresh snapshot; ignored while our tab isn't showing (tabbing
+            to us triggers a new scan anyway). '''
+            if not self.active or not self.parent.wallet or self.parent.incompatible:
+                return
+            coins, okcoins = snap.coins, len(snap.eligible)
+            self.model.reconcile(coins, snap.local_height)
 
             if not len(coins):
                 self.ui.lbl_utxos.setText(_("This wallet is currently empty and has no coins"))
             else:
                 self.ui.lbl_utxos.setText(_("{}/{} coins meet the specified criteria").format(okcoins, len(coins)))
             self.ui.bt_donate_all.setEnabled(okcoins)
-
-            timer = QTimer(self) # attach a timer object to us. Timer will be auto-killed either by python GC or if we die before it fires because we are its parent
-            def restoreScrollBar():
-                nonlocal timer
-                timer.deleteLater() # otherwise dead timer lives on.
-                timer = None
-                if self.ui and self.ui.tree_coins:
-                    self.ui.tree_coins.updateGeometry()
-                    self.ui.tree_coins.verticalScrollBar().setValue(scroll_pos_val) # restore scroll bar to previous
-
-            timer.setSingleShot(True)
-            timer.timeout.connect(restoreScrollBar)
-            timer.start(1)  # need to do this from a timer some time later due to Qt quirks
-
-        def add_item(self, c):
-            address, value, height, is_frozen, is_eligible, status = c.get('address').to_ui_string(), c.get('value'), c.get('height'), c.get('is_frozen'), c.get('is_eligible'), c.get('eligibility_text')
-            amtText = self.parent.window.format_amount(value) + ' '+ self.parent.window.base_unit()
-            age = c.get('age')
-            ageText = (str(age) + " blk" + ("s" if age > 1 else "")) if age > -1 else _("unconf.")
-            item = QTreeWidgetItem(self.ui.tree_coins, [amtText, address, ageText, status])
-            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-            item.setData(0, Qt.UserRole, c) # save the coin itself inside the item.. in case we need it later
-            brush = self.brushNormal
-            if is_frozen: brush = self.brushFrozen
-            elif not is_eligible: brush = self.brushIneligible
-            nCols = self.ui.tree_coins.columnCount()
-            if brush != self.brushNormal:
-                for i in range(0, nCols):
-                    item.setForeground(i, brush)
-            if is_eligible: item.setForeground(nCols-1, self.brushEligible)
-            return item
+            self.on_selection_changed() # selected coins may have changed eligibility
+
+        def cell_text(self, c, col):
+            ''' Called lazily by the model, only for cells the view actually displays. '''
+            if col == self.model.COL_AMOUNT:
+                return self.parent.window.format_amount(c.value) + ' '+ self.parent.window.base_unit()
+            elif col == self.model.COL_ADDRESS:
+                return c.address.to_ui_string()
+            elif col == self.model.COL_AGE:
+                age = c.age
+                return (str(age) + " blk" + ("s" if age > 1 else "")) if age > -1 else _("unconf.")
+            elif col == self.model.COL_STATUS:
+                return c.eligibility_text()
+            return None
+
+        def cell_brush(self, c, col):
+            if c.is_frozen: return self.brushFrozen
+            elif not c.is_eligible: return self.brushIneligible
+            elif col == self.model.COL_STATUS: return self.brushEligible
+            return None
 
         def get_name(self, coin):
-            return self.parent.window.utxo_list.get_name(coin)
+            return CoinIndex.get_name(coin)
 
-        def on_selection_changed(self):
-            coins, has_eligible = self.get_coins(from_treewidget = True, eligible_only = True, selected_only = True)
+        def on_selection_changed(self, *args):
+            coins, has_eligible = self.get_coins(from_view = True, eligible_only = True, selected_only = True)
             self.ui.bt_donate_selected.setEnabled(has_eligible)
 
         def on_context_menu(self, point):
-            coins, has_eligible = self.get_coins(from_treewidget = True, eligible_only = False, selected_only = True)
+            coins, has_eligible = self.get_coins(from_view = True, eligible_only = False, selected_only = True)
             if coins:
                 menu = QMenu(self.ui.tree_coins)
                 menu.addAction(_("Show in Coins Tab"), lambda: self.on_show_in_coins_tab(coins))
@@ -846,512 +1142,111 @@ class Instance(QWidget, PrintError):
             self.parent.window.tabs.setCurrentWidget(tab)
 
         def on_donate_selected(self):
-            coins, okcount = self.get_coins(from_treewidget = True, eligible_only = True, selected_only = True)
+            coins, okcount = self.get_coins(from_view = True, eligible_only = True, selected_only = True)
             self._do_manual_donate(coins)
 
         def _do_manual_donate(self, coins):
             if coins:
                 is_batched = self.data.get_singletx()
-                if not is_batched and len(coins) > 1:
-                    if not self.parent.window.question(_("You are about to create {} separate transaction windows. You will need to sign and broadcast each one.\n\nProceed?").format(len(coins))):
+                engine = self.parent.engine
+                num_txs = len(engine.plan_batches(coins, is_batched)) if engine.update_rr() else 0
+                if num_txs > 1:
+                    if not self.parent.window.question(_("You are about to create {} separate transaction windows. You will need to sign and broadcast each one.\n\nProceed?").format(num_txs)):
                         return
                 if not self.parent.engine.manual_donate(coins, batched=is_batched):
                     self.parent.window.show_error(_("No charities are enabled!"))
 
         def on_donate_all(self):
-            coins, okcount = self.get_coins(from_treewidget = True, eligible_only = True, selected_only = False)
+            coins, okcount = self.get_coins(from_view = True, eligible_only = True, selected_only = False)
             self._do_manual_donate(coins)
 
 
-    # nested class.. handles writing our data dict to/from persisten store
-    class DataModel:
-        ''' Interface to the permanent store for this plugin's persistent data & settings (basically, Wallet Storage) '''
+    class DiagnosticsMgr(QObject, PrintError):
+        ''' Manages the collapsible 'Diagnostics' section at the bottom of the tab, which shows the timings & counters of
+        Instance.get_diagnostics(). It's collapsed by default, and only updates while it's expanded and our tab is showing. '''
 
-        HistoryEntry = namedtuple('HistoryEntry', 'address name amount ref txout') # address=str, name=str, amount=int, ref=str, txout=str
+        refresh_interval = 1000 # Qt ms -- how often the numbers update while they're showing
 
-        def __init__(self, parent, storage, config):
-            self.parent = parent
-            self.storage = storage
-            self.config = config
-            self.keys = {
-                'root' : self.parent.plugin.name + "__Data__v00", # the root-level key that goes into wallet storage for all of our plugin data
-                'charities' : 'charities', # the addresses, which ends up being a list of tuples (enabled, name, address_str)
-                'change_def' : 'change_def', # the definition of what constitutes change, which is a simple tuple
-                'autodonate' : 'autodonate', # if true, automatically donate change without prompting. requires unenecrypted wallet
-                'roundrobin' : 'roundrobin', # list of active charities in round-robin fashion. leftmost entry is the next one to receive a donation
-                'singletx' : 'singletx', # iff true, donations are made with 1 big tx covering all coins, hindering privacy but saving on fees
-                'history' : 'history', # a dict of address -> list of HistoryEntry entries
-                'warn_hi' : 'warn_hi', # if true, warn user when inputting change threshold above 2 mBCH (default: True)
-                'initted' : 'initted', # boolean. if set, this data store has been initted before and doesn't need to get populated with defaults
-            }
-
-        def get_data(self):
-            d = self.storage.get(self.keys['root'], dict())
-            if not d.get('initted'):
-                # initialize data with defaults
-                charities = [
-                    (True, "eatBCH", "pp8skudq3x5hzw8ew7vzsw8tn4k8wxsqsv0lt0mf3g"),
-                    (True, "eatBCH_SS", "qrsrvtc95gg8rrag7dge3jlnfs4j9pe0ugrmeml950"),
-                    (True, "Coins4Clothes", "qzx4tqcldmvs4up9mewkf3ru0z6vy9wm6qm782fwla"),
-                    (False, "Calin", "qplw0d304x9fshz420lkvys2jxup38m9symky6k028"),
-                    (False, "CashShuffle", "qqqxxmjyavdkwdj6npa5w6xl0fzq3wc5furaqdpl59"),
-                    (False, "Electron-Cash", "qz4wq9m860zr5p2nfdpttm5ymdqdyt3psc95qjagae"),
-                ]
-                change_def = (10500, 72, 0) # sats, blocks, age_type(not used yet)
-                d['charities'] = charities
-                d['change_def'] = change_def
-                d['autodonate'] = False
-                d['roundrobin'] = list()
-                d['singletx'] = False
-                d['history'] = dict()
-                d['warn_hi'] = True
-                d['initted'] = True
-            return d
-
-        def put_data(self, datadict, save=True):
-            self.storage.put(self.keys['root'], datadict)
-            if save: self.save()
-
-        def save(self):
-            self.storage.write()
-
-        def get_charities(self, valid_enabled_only = False):
-            d = self.get_data()
-            ret = d.get('charities', list())
-            if valid_enabled_only:
-                ret = [r for r in ret if r[0] and Address.is_valid(r[2])]
-            return ret
-
-        def set_charities(self, charities, save=True):
-            if isinstance(charities, list):
-                d = self.get_data()
-                d['charities'] = charities
-                self.put_data(d, save=save)
-
-        def get_changedef(self):
-            d = self.get_data()
-            return d.get('change_def')
-
-        def set_changedef(self, cd, save=True):
-            if isinstance(cd, (tuple, list)) and len(cd) >= 3:
-                d = self.get_data()
-                d['change_def'] = cd
-                self.put_data(d, save=save)
-
-        def get_autodonate(self):
-            return self.get_data().get('autodonate', False)
-
-        def set_autodonate(self, b, save = True):
-            try:
-                b = bool(b)
-                d = self.get_data()
-                d['autodonate'] = b
-                self.put_data(d, save=save)
-            except ValueError:
-                pass
-
-        def get_roundrobin(self):
-            return RoundRobin(self.get_data().get('roundrobin', list()))
-
-        def set_roundrobin(self, rr, save = True):
-            if not isinstance(rr, (list, tuple, RoundRobin, set)):
-                raise ValueError('set_roundrobin requires a list, tuple, set, or RoundRobin argument')
-            d = self.get_data()
-            d['roundrobin'] = list(rr)
-            self.put_data(d, save=save)
-
-        def get_history(self):
-            return self.get_data().get('history', dict())
-
-        def set_history(self, h, save = True):
-            if not isinstance(h, dict):
-                raise ValueError('set_history requires a dictionary argument')
-            d = self.get_data()
-            d['history'] = h
-            self.put_data(d, save = save)
-
-        def history_put_entry(self, hentry, save = True):
-            if not isinstance(hentry, self.HistoryEntry):
-                raise ValueError('history_put requires a HistoryEntry argument')
-            h = self.get_history()
-            l = h.get(hentry.address, list())
-            wasempty = not bool(l)
-            if hentry not in l:
-                l.append(hentry)
-            if wasempty: h[hentry.address] = l
-            self.set_history(h, save = save)
-
-        def history_get_for_address(self, address):
-            l = self.get_history().get(address, list())
-            ret = list()
-            for item in l:
-                hentry = self.HistoryEntry(*item)
-                ret.append(hentry)
-            return ret
-
-        def history_get_total_for_address(self, address):
-            l = self.history_get_for_address(address)
-            return sum([hentry.amount for hentry in l])
-
-        def get_singletx(self):
-            return self.get_data().get('singletx', False)
-
-        def set_singletx(self, b, save = True):
-            try:
-                b = bool(b)
-                d = self.get_data()
-                d['singletx'] = b
-                self.put_data(d, save=save)
-            except ValueError:
-                pass
+        def __init__(self, parent, ui):
+            super().__init__(parent)
+            self.parent = parent # Instance
+            self.ui = ui
+            self.active = False # true while our tab is showing
 
-        def get_warn_high_thresh(self):
-            return self.get_data().get('warn_hi', True)
+            # This section isn't in the Qt Designer .ui file; it's built here and appended below everything else.
+            ui.fr_diagnostics = QWidget(parent)
+            layout = QGridLayout(ui.fr_diagnostics)
+            layout.setContentsMargins(0,0,0,0)
+            ui.tb_diagnostics = QToolButton(ui.fr_diagnostics)
+            ui.tb_diagnostics.setText(_("Diagnostics"))
+            ui.tb_diagnostics.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
+            ui.tb_diagnostics.setArrowType(Qt.RightArrow)
+            ui.tb_diagnostics.setAutoRaise(True)
+            ui.tb_diagnostics.setCheckable(True)
+            layout.addWidget(ui.tb_diagnostics, 0, 0, 1, 1)
+            ui.bt_diagnostics_reset = QPushButton(_("Reset"), ui.fr_diagnostics)
+            ui.bt_diagnostics_reset.setToolTip(_("Start counting from zero"))
+            layout.addWidget(ui.bt_diagnostics_reset, 0, 2, 1, 1)
+            layout.setColumnStretch(1, 1)
+            ui.tree_diagnostics = QTreeWidget(ui.fr_diagnostics)
+            ui.tree_diagnostics.setHeaderLabels([ _("Operation"), _("Calls"), _("p50 (ms)"), _("p95 (ms)"), _("Max (ms)") ])
+            ui.tree_diagnostics.setRootIsDecorated(False)
+            ui.tree_diagnostics.setUniformRowHeights(True)
+            ui.tree_diagnostics.setMaximumHeight(180)
+            ui.tree_diagnostics.setColumnWidth(0, 160)
+            layout.addWidget(ui.tree_diagnostics, 1, 0, 1, 3)
+            ui.lbl_diagnostics = QLabel(ui.fr_diagnostics)
+            layout.addWidget(ui.lbl_diagnostics, 2, 0, 1, 3)
+            ui.gridLayout_4.addWidget(ui.fr_diagnostics, 4, 0, 1, 2)
+            self.show_details(False)
 
-        def set_warn_high_thresh(self, b, save = True):
-            try:
-                b = bool(b)
-                d = self.get_data()
-                d['warn_hi'] = b
-                self.put_data(d, save=save)
-            except ValueError:
-                pass
-
-    class Engine(QObject, PrintError):
-        ''' The donation engine.  Encapsulates all logic of picking coins to donate, prompting user, setting up Send tab, etc '''
-
-        timer_interval = 10000 # value is Qt ms value -- 10 second interval
-
-        def __init__(self, parent, wallet, window, co_mgr, data):
-            super().__init__(parent) # QObject c'tor
-            self.parent = parent # class 'Instance' instance
-            self.wallet = wallet
-            self.window = window
-            if Plugin.HAS_SCHNORR_API:
-                if getattr(window, 'is_schnorr_enabled', None): # 4.0.3 & 4.0.4 API
-                    self._is_schnorr_enabled_func = window.is_schnorr_enabled
-                elif getattr(window.wallet, 'is_schnorr_enabled', None): # 4.0.4-git and beyond API
-                    self._is_schnorr_enabled_func = window.wallet.is_schnorr_enabled
-                else:
-                    raise RuntimeError("Cannot find 'is_schnorr_enabled' function -- FIXME")
-            else:
-                self._is_schnorr_enabled_func = lambda: False
-            self.data = data
-            self.co_mgr = co_mgr
-            self.parent.cr_mgr.autodonate_disabled_signal.connect(self.on_autodonate_disabled)
-            self.rr = self.data.get_roundrobin()
             self.timer = QTimer(self)
-            self.timer.setInterval(self.timer_interval) # wake up every 10 seconds
-            self.timer.timeout.connect(self.do_check)
-            self.is_foregrounded = False
-            self.last_notify_set = set()
-            self.pending_tx_histories = dict() # dict of tx_desc -> list of HistoryEntry
-            self.suppress_auto = 0
-
-            self.update_rr()
-
-            self.parent.sig_user_tabbed_to_us.connect(lambda: self.set_foregrounded(True))
-            self.parent.sig_user_tabbed_from_us.connect(lambda: self.set_foregrounded(False))
+            self.timer.timeout.connect(self.refresh)
+            ui.tb_diagnostics.toggled.connect(self.on_toggled)
+            ui.bt_diagnostics_reset.clicked.connect(self.on_reset)
+            self.parent.sig_user_tabbed_to_us.connect(lambda: self.on_activate_status_change(True))
+            self.parent.sig_user_tabbed_from_us.connect(lambda: self.on_activate_status_change(False))
 
         def diagnostic_name(self): # from PrintError
             return self.__class__.__name__ + "@" + self.parent.diagnostic_name()
 
-        def on_set_label(self, name, text):
-            ''' this will be used to catch tx's that have completed / been sent in non-auto-donate mode by embedding a cookie in tx desc '''
-            self.print_error("set_label called with ", name, text)
-            hentries = self.pending_tx_histories.pop(text, None)
-            if hentries:
-                for hentry in hentries:
-                    txout = hentry[-1]
-                    if txout.find(':') < 0:
-                        # was missing txid because this was generated by manual_donate where tx was unsigned
-                        txout = name + ":" + txout
-                        hentry = self.data.HistoryEntry(*hentry[:-1], txout)
-                    self.data.history_put_entry(hentry, save=False)
-                self.data.save()
-                self.parent.ch_mgr.refresh() # force history update
-
-        def set_foregrounded(self, b): self.is_foregrounded = b
-
-        def update_rr(self):
-            charities = self.data.get_charities(valid_enabled_only = True)
-            charities = [ tuple(charity[1:]) for charity in charities ] # get rid of the "enabled" column -- our round-robin list consits of name,address tuples
-            self.rr.update(charities) #.update preserves original order for ones that are kept.
-            return bool(self.rr)
-
-        def do_check(self):
-            if self.parent.disabled or self.parent.incompatible:
-                return
-            if not self.wallet.network or not self.wallet.network.is_connected() or not self.wallet.network.is_up_to_date() or not self.wallet.is_up_to_date():
-                self.print_error("Network not connected or wallet/network not up-to-date, will try again later...")
-                return
-            coins, ct = self.co_mgr.get_coins(from_treewidget = False, eligible_only = True)
-            if coins and self.update_rr():
-                if self.data.get_autodonate() and not self.wallet.has_password(): # pw check here again in case it changed in the meantime
-                    if not self.suppress_auto:
-                        self.auto_donate(coins)
-                    else:
-                        self.print_error("Auto-donate suppressed due to extant donations-related txdialog")
-                else:
-                    self.notify_user(coins)
+        def show_details(self, b):
+            self.ui.tb_diagnostics.setArrowType(Qt.DownArrow if b else Qt.RightArrow)
+            for w in (self.ui.tree_diagnostics, self.ui.lbl_diagnostics, self.ui.bt_diagnostics_reset):
+                w.setVisible(b)
 
-        def newref(self): return str(binascii.hexlify(os.urandom(8))).split("'")[1]
+        def on_toggled(self, b):
+            self.show_details(b)
+            self.update_timer()
+
+        def on_activate_status_change(self, b):
+            self.active = b
+            self.update_timer()
 
-        def manual_donate(self, coins, batched=True):
-            ''' This will either make 1 big batched TX or pop up many tx windows '''
-            if not self.update_rr() or not coins:
-                return 0
-            list_of_coins = []
-            if batched:
-                list_of_coins = [coins]
+        def update_timer(self):
+            if self.active and self.ui.tb_diagnostics.isChecked():
+                self.refresh()
+                self.timer.start(self.refresh_interval)
             else:
-                list_of_coins = [[c] for c in coins]
-            for coins in list_of_coins:
-                tx, desc, ref, donees = self.make_transaction(coins)
-                if not tx:
-                    self.show_error(_("There was a problem creating the transaction. Please contact the developer."))
-                    return -1
-                i = 0
-                for donee,amt in donees.items():
-                    name,address = donee
-                    # address name amount ref txout
-                    hentry = self.data.HistoryEntry(address,name,amt,ref,str(i))
-                    l = self.pending_tx_histories.get(desc,list())
-                    l.append(hentry)
-                    self.pending_tx_histories[desc] = l
-                    i += 1
-
-                # .. aaaand Show it!
-                self.window.show_transaction(tx, desc)
-
-                if self.data.get_autodonate():
-                    ''' Hack -- in case the user hit "donate eligible" while in auto-mode, suppress auto-donation while
-                        the tx dialog is up using this monkey-patching technique. ;) '''
-
-                    try:
-                        from electroncash_gui.qt.transaction_dialog import dialogs
-                        txdlg = dialogs[-1]
-                        origMethod = txdlg.closeEvent
-                        def myCloseEvent(event):
-                            if not self.parent or not self.parent.plugin:
-                                origMethod(event)
-                                return # early return -- plugin was closed!
-                            self.print_error("monkey-patched tx dialog close called", event)
-                            origMethod(event)
-                            if event.isAccepted() and self.suppress_auto:
-                                self.suppress_auto -= 1
-                                self.print_error("tx dialog close suppress_auto =", self.suppress_auto)
-                        txdlg.closeEvent = myCloseEvent
-                        self.suppress_auto += 1
-                    except (AttributeError, ImportError):
-                        import traceback
-                        traceback.print_exc()
-                        self.print_error("Could not suppress auto")
-
-            return 1
-
-        def on_autodonate_disabled(self):
-            self.suppress_auto = 0 # turn off 'auto' suppression because user messed with UI
-
-
-        def auto_donate(self, coins):
-            self.print_error("Auto-donate called with ", coins)
-            def on_box_is_up():
-                if not self.parent or not self.parent.plugin:
-                    return # early return -- auto kicked off just as the window was closing. abort!
-                txs = []
-                try:
-                    if self.data.get_singletx():
-                        tx, desc, ref, donees = self.make_transaction(coins)
-                        self.wallet.sign_transaction(tx, None)
-                        txs.append((tx, desc, ref, donees))
-                    else:
-                        for c in coins:
-                            tx, desc, ref, donees = self.make_transaction([c])
-                            self.wallet.sign_transaction(tx, None)
-                            txs.append((tx, desc, ref, donees))
-                except InvalidPassword:
-                    self.data.set_autodonate(False)
-                    self.parent.cr_mgr.refresh()
-                    self.show_error(_("Wallet now has a password. Auto-donate was turned off."))
-                    return
-
-                bcast = None
-                network = self.wallet.network
-                if hasattr(network, 'broadcast_transaction'):
-                    bcast = network.broadcast_transaction
-                elif hasattr(network, 'broadcast'):
-                    bcast = network.broadcast
-                else:
-                    # wtf. someone changed the API
-                    self.show_error(_("Don't know how to broadcast a transaction. Are you on Electron Cash 3.2 or above?"))
-                    return
-                ct = 0
-                tot = 0
-                for tx,desc,ref,donees in txs:
-                    if tx is None:
-                        self.print_error("WARNING: tx is None for", desc)
-                        continue
-                    status, data = bcast(tx)
-                    if status:
-                        if data != tx.txid(): self.print_error("Warning: txid != data", data, tx.txid())
-                        self.wallet.set_label(tx.txid(), desc)
-                        i = 0
-                        for donee,amt in donees.items():
-                            name,address = donee
-                            # address name amount ref txout
-                            self.data.history_put_entry(self.data.HistoryEntry(address,name,amt,ref,tx.txid()+":"+str(i)), save=False)
-                            i += 1
-                            ct += 1
-                            tot += amt
-                    else:
-                        self.print_error("WARNING: got false status for", desc,tx.txid())
-                if ct:
-                    self.data.save()
-                    self.window.notify(_("Auto-donated {} coins, {}").format(ct,self.window.format_amount_and_units(int(tot))))
-                    self.parent.ch_mgr.refresh() # so that we see the new history immediately
-
-
-            show_please_wait(msg=_("Auto-Donating, please wait..."), title=self.parent.plugin.shortName(),
-                             parent=None, on_shown=on_box_is_up)
-
-        def make_transaction(self, coins):
-            totalSats = 0
-            ref = self.newref()
-            desc = self.parent.plugin.shortName() + ": "
-            donees = dict()
-            outputs = list()
-            for coin in coins:
-                donee = self.rr.rotate()
-                amt = donees.get(donee, 0)
-                sats = coin['value']
-                amt += sats
-                totalSats += sats
-                donees[donee] = amt
-            for donee,amt in donees.items():
-                addr_str = donee[1]
-                address = Address.from_string(addr_str)
-                outputs.append((TYPE_ADDRESS, address, int(amt)))
-            desc += ', '.join([donee[0] for donee in donees])
-            desc += " (ref: %s)" % ref
-
-            tx = None
-            try:
-                schnorr_kwargs={}
-                if Plugin.HAS_SCHNORR_API:
-                    schnorr_kwargs['sign_schnorr'] = self._is_schnorr_enabled_func()
-                # first make a 0-fee tx to figure out the tx size.
-                tx0 = self.wallet.make_unsigned_transaction(inputs=coins, outputs=outputs, config=self.window.config, fixed_fee=0, **schnorr_kwargs)
-                size = tx0.estimated_size()
-                # next, make each output pay a portion of the fee to reach 1.0 sats/B
-                each_fee = int(math.ceil(size / len(outputs)))
-                #print("got size",size,"each_fee",each_fee)
-                #print("old outputs",outputs)
-                outputs = [ (o[0], o[1], o[2]-each_fee) for o in outputs ]
-                donees = { d:v-each_fee for d,v in donees.items() }
-                #print("revised outputs",outputs)
-                if any([ bool(o[2] <= 0) for o in outputs]):
-                    raise NotEnoughFunds
-                tx = self.wallet.make_unsigned_transaction(inputs=coins, outputs=outputs, config=self.window.config, fixed_fee=each_fee*len(outputs), **schnorr_kwargs)
-            except NotEnoughFunds:
-                self.show_error(_("Insufficient funds"))
-            except ExcessiveFee:
-                self.show_error(_("Excessive Fee"))
-            except BaseException as e:
-                import traceback
-                traceback.print_exc()
-                self.print_error("Outputs:",outputs)
-                self.show_error(str(e) or "Unknown Error")
-
-            self.data.set_roundrobin(self.rr)
-            return tx, desc, ref, donees
-
-        def show_error(self, msg):
-            self.window.show_error(msg = (self.parent.plugin.shortName() + ":\n\n" + msg))
-
-        def notify_user(self, coins):
-            #self.print_error("Prompt user called with", coins)
-            if not coins: return
-            if self.is_foregrounded:
-                # We don't do anything when the user has the tab open, because they can do
-                # manual donations then, so they don't need to be prompted.
-                #self.print_error("Not notifying user, tab is foregrounded.")
-                return
-            '''
-            if (self.window.tabs.currentWidget() == self.window.send_tab
-                and self.window.message_e.text().startswith(self.parent.plugin.shortName() + ":")
-                and self.window.message_e.isReadOnly()):
-                # todo: only suppress here if the active send tab thing is our tx?
-                #self.print_error("Not notifying user, send tab is already active.")
-                return
-            '''
-            coinset = { self.co_mgr.get_name(c) for c in coins }
-            if coinset == self.last_notify_set:
-                #self.print_error("Not notifying user, set of coins hasn't changed.")
+                self.timer.stop()
+
+        def on_reset(self):
+            self.parent.reset_diagnostics()
+            self.refresh()
+
+        def refresh(self):
+            if not self.parent.wallet:
                 return
-            msg = [
-                _("You have {} coins eligible for donation totaling {}.").format(len(coins),
-                                                                                 self.window.format_amount_and_units(sum([c['value'] for c in coins])) ),
-                "",
-                #_("Do you wish to go to the Send tab and donate now?")
-                _("(Go to the 'Donate Change' tab to donate)")
-            ]
-            self.window.notify(msg[0]) #'\n'.join(msg))
-            self.last_notify_set = coinset
-
-        def do_send_tab_send(self, coins):
-            self.print_error("Do send tab send called with", coins)
-
-        def stop(self):
-            self.timer.stop()
-
-        def start(self):
-            self.timer.start()
-
-class RoundRobin(list):
-    ''' A list that is useful for a round-robin queue, allowing you to take items in the list and put them to the back.
-        Note that .to_back() allows you to send arbitrary items in the list to the back, not just the first item.
-        .update() allows one to update the list whilst preserving the original order for items that remain in the list. '''
-
-    def front(self):
-        if len(self):
-            return self[0]
-        return None
-
-    def push_front_unique(self, item):
-        ''' Only inserts item if it doesn't already exist in the list and is not None. '''
-        if item is not None and item not in self:
-            self.insert(0, item)
-        return self
-
-    def update(self, l):
-        ''' Update this list to include only items in the collection l, deleting items from self that aren't in l, whilst preserving
-            the original order of self. As a final pass it inserts to front all items in l that weren't originally in self. '''
-        tmp = self.copy()
-        self.clear()
-        for t in tmp:
-            if t in l:
-                self.append(t)
-        for item in l:
-            self.push_front_unique(item)
-        return self
-
-    def to_back(self, item = None):
-        if item is None:
-            # this call path basically says to unconditionally take whatever was at the front and put it to the back.
-            item = self.pop(0) # IndexError possible here if caller misuing class
-            self.append(item)
-        else:
-            for i, elem in enumerate(self):
-                # look for item in list.. if found, take it out
-                if elem == item:
-                    self.pop(i)
-                    break
-            # and now put item at back. note this may end up growing the list by 1 if item was not in list.  but that's ok and is a feature.
-            self.append(item)
-        return self
-
-    def rotate(self): ret = self.front(); self.to_back(); return ret
+            d = self.parent.get_diagnostics()
+            ms = lambda secs: "{:.2f}".format(secs * 1e3)
+            tree = self.ui.tree_diagnostics
+            tree.clear()
+            for name, t in sorted(d['timings'].items()):
+                tree.addTopLevelItem(QTreeWidgetItem([ name, str(t['calls']), ms(t['p50']), ms(t['p95']), ms(t['max']) ]))
+            for name, n in sorted(d['counters'].items()):
+                tree.addTopLevelItem(QTreeWidgetItem([ name, str(n), "", "", "" ]))
+            self.ui.lbl_diagnostics.setText(_("Since {}. Percentiles are over the last {} calls.")
+                                            .format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(d['since'])), Metrics.window))
 
 
 def custom_question_box(msg, title="", buttons=[_("Cancel"), _("Ok")], parent = None, icon = QMessageBox.Question):
@@ -1369,28 +1264,6 @@ def custom_question_box(msg, title="", buttons=[_("Cancel"), _("Ok")], parent =
     clicked = mb.clickedButton()
     return clicked.text() if clicked else ""
 
-def show_please_wait(msg, title=_("Please wait"), parent = None, on_shown = None):
-    from electroncash_gui.qt.util import WindowModalDialog
-
-    class MyDlg(WindowModalDialog):
-        sig_shown = pyqtSignal(object)
-        def showEvent(self, event):
-            ret = super().showEvent(event)
-            do_later(self, 20, lambda: self.sig_shown.emit(self))
-            #self.sig_shown.emit(self)
-            return ret
-
-    dlg = MyDlg(parent=parent, title = title)
-    if callable(on_shown):
-        dlg.sig_shown.connect(on_shown)
-    dlg.sig_shown.connect(lambda x: x.accept()) # force to close if we get to this point
-    vbox = QVBoxLayout(dlg)
-    vbox.addWidget(QLabel(msg))
-    dlg.setWindowModality(Qt.WindowModal if parent else Qt.ApplicationModal)
-
-    dlg.exec_()
-    dlg.deleteLater()
-
 def do_later(parent, when_ms, fun, *args):
     timer = QTimer(parent)
     def timer_cb():
@@ -1404,68 +1277,26 @@ def do_later(parent, when_ms, fun, *args):
     timer.start(when_ms)
     return timer
 
-#####
-import re
-class CopiedCode:
-    ''' Code copied from elsewhere (EC sourcecode, etc), that we can't rely
-    on always being there across EC versions.. so we pasted it here. The
-    nature of plugins! '''
-
-    _RX_NORMALIZER = re.compile(r'(\.0+)*$')
-    _RX_VARIANT_TOKEN_PARSE = re.compile(r'^(\d+)(.+)$')
-
-    @staticmethod
-    def normalize_version(v):
-        """Used for PROTOCOL_VERSION normalization, e.g '1.4.0' -> (1,4) """
-        return tuple(int(x) for x in __class__._RX_NORMALIZER.sub('', v.strip()).split("."))
-
-    @staticmethod
-    def parse_package_version(pvstr):
-        """ Basically returns a tuple of the normalized version plus the 'variant'
-        string at the end. Eg '3.3.0' -> (3, 3, ''), '3.2.2CS' -> (3, 2, 2, 'CS'),
-        etc.
-
-        Some more examples:
-                '3.3.5CS' -> (3, 3, 5, 'CS')
-                '3.4.5_iOS' -> (3, 4, 5, '_iOS')
-                '3.3.5' -> (3, 3, 5, '')
-                '3.3' -> (3, 3, '')
-                '3.3.0' -> (3, 3, '')
-                '   3.2.2.0 ILikeSpaces ' -> (3, 2, 2, 'ILikeSpaces')
-        Note how 0 fields at the end of the version get normalized with the 0 lopped off:
-                '3.3.0' -> (3, 3, '')
-                '3.5.0.0.0' -> (3, 5, '')
-                '3.5.0.0.0_iOS' -> (3, 5, '_iOS')
-        ... and, finally: The last element is *always* going to be present as
-        a string, the 'variant'. The 'variant' will be the empty string '' if
-        this is the default Electron Cash. If you don't like this heterogeneity of
-        types in a tuple, take the retVal[:-1] slice of the array to toss it
-        (or just use normalize_version above).
-        """
-        def raise_(e=None):
-            exc = ValueError('Failed to parse package version for: "{}"'.format(pvstr))
-            if e: raise exc from e
-            else: raise exc
-        toks = [x.strip() for x in pvstr.split(".")]
-        if not toks:
-            raise_()
-        if toks[-1].isdigit():
-            # Missing 'variant' at end.. add the default '' variant.
-            toks.append('')
-        else:
-            # had 'variant' at end, parse it.
-            m = __class__._RX_VARIANT_TOKEN_PARSE.match(toks[-1])
-            if m:
-                # pop off end and...
-                toks[-1:] = [m.group(1), # add the digit portion back (note it's still a str at this point)
-                             m.group(2).strip()] # add the leftovers as the actual variant
-            else:
-                raise_()
-        try:
-            # make sure everything but the last element is an int.
-            toks[:-1] = [int(x) for x in toks[:-1]]
-        except ValueError as e:
-            raise_(e)
-        # .. and.. finally: Normalize it! (lopping off zeros at the end)
-        toks[:-1] = __class__.normalize_version('.'.join(str(t) for t in toks[:-1]))
-        return tuple(toks)
+
+class QtCaller(QObject):
+    ''' Lets any thread have a function called on the GUI thread: caller(fn, *args) queues up fn(*args). This is the
+    call_soon() of the Qt-free core (see core.Engine & core.NetworkDispatcher). '''
+
+    sig_call = pyqtSignal(object, object) # fn, args
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.sig_call.connect(self.on_call, Qt.QueuedConnection)
+
+    def on_call(self, fn, args):
+        fn(*args)
+
+    def __call__(self, fn, *args):
+        self.sig_call.emit(fn, args)
+
+def make_qtimer(parent, callback):
+    ''' Returns a single-shot QTimer calling callback. This is the make_timer() of the Qt-free core. '''
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.timeout.connect(callback)
+    return timer
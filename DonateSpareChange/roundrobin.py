@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+from collections import deque
+
+
+class RoundRobin:
+    ''' A round-robin queue, allowing you to take items in the queue and put them to the back.
+        Note that .to_back() allows you to send arbitrary items in the queue to the back, not just the first item.
+        .update() allows one to update the queue whilst preserving the original order for items that remain in it.
+
+        rotate(), front(), to_back() and push_front_unique() are O(1) (amortized), and update() is O(n), no matter how
+        many items there are. Items live in a deque, each tagged with a serial number, and self.index maps every item to
+        the serial number of its one live entry. Moving an item just appends a fresh entry, leaving the old one behind to
+        be skipped (and eventually compacted away) as stale.
+
+        Items must be hashable. Lists (as read back from wallet storage) are converted to tuples. Iterating yields the
+        items in order, so list(rr) is the persisted representation. '''
+
+    def __init__(self, items = ()):
+        self.queue = deque() # (item, serial) entries, some of which may be stale
+        self.index = dict() # item -> serial number of its live entry in self.queue
+        self.serial = 0
+        for item in items:
+            self.queue.append(self._entry(self._norm(item)))
+        self._maybe_compact() # in case items had duplicates
+
+    @staticmethod
+    def _norm(item):
+        return tuple(item) if isinstance(item, list) else item
+
+    def _entry(self, item):
+        self.serial += 1
+        self.index[item] = self.serial
+        return item, self.serial
+
+    def _is_live(self, entry):
+        return self.index.get(entry[0]) == entry[1]
+
+    def _trim(self):
+        ''' Drops stale entries from the front of the queue. '''
+        q = self.queue
+        while q and not self._is_live(q[0]):
+            q.popleft()
+
+    def _maybe_compact(self):
+        if len(self.queue) > 2 * len(self.index) + 32:
+            self.queue = deque(e for e in self.queue if self._is_live(e))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return (e[0] for e in self.queue if self._is_live(e))
+
+    def __contains__(self, item):
+        return self._norm(item) in self.index
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "RoundRobin({!r})".format(list(self))
+
+    def copy(self):
+        return RoundRobin(self)
+
+    def front(self):
+        self._trim()
+        return self.queue[0][0] if self.queue else None
+
+    def push_front_unique(self, item):
+        ''' Only inserts item if it doesn't already exist in the queue and is not None. '''
+        item = self._norm(item)
+        if item is not None and item not in self.index:
+            self.queue.appendleft(self._entry(item))
+        return self
+
+    def update(self, l):
+        ''' Update this queue to include only items in the collection l, deleting items from self that aren't in l, whilst
+            preserving the original order of self. As a final pass it inserts to front all items in l that weren't
+            originally in self. '''
+        l = [self._norm(item) for item in l]
+        keep = set(l)
+        for item in [item for item in self.index if item not in keep]:
+            del self.index[item] # its entry is now stale
+        for item in l:
+            self.push_front_unique(item)
+        self._maybe_compact()
+        return self
+
+    def to_back(self, item = None):
+        if item is None:
+            # this call path basically says to unconditionally take whatever was at the front and put it to the back.
+            self._trim()
+            item = self.queue.popleft()[0] # IndexError possible here if caller misusing class
+        else:
+            # note this may end up growing the queue by 1 if item was not in it. but that's ok and is a feature.
+            item = self._norm(item)
+        self.queue.append(self._entry(item))
+        self._maybe_compact()
+        return self
+
+    def rotate(self): ret = self.front(); self.to_back(); return ret
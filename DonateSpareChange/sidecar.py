@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Sidecar files: small files we keep next to the wallet file so that we don't
+# have to rewrite the (potentially huge) wallet file for every little change.
+#
+import json, os, threading
+from collections import OrderedDict
+
+from electroncash.util import PrintError
+
+
+class JsonLinesFile(PrintError):
+    ''' An append-only file of JSON records, one record per line.
+
+        Appending a record costs 1 small write (plus an fsync), regardless of how many records the file holds. A crash
+        mid-append can at worst leave a torn last line, which read() silently skips. rewrite() atomically replaces the
+        whole file (write to a temp file, fsync, rename). We are the file's only writer, so whether it ends in a newline
+        (i.e. the last append wasn't torn) is only looked up on disk once, and tracked in memory from then on. '''
+
+    SUFFIX = None # subclasses: appended to the wallet path to get the path of the sidecar file
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ends_clean = None # whether the file ends with a complete line. None = not known yet
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__ + "@" + os.path.basename(self.path)
+
+    @classmethod
+    def for_wallet(cls, wallet_path):
+        return cls(wallet_path + cls.SUFFIX)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        ''' Returns the list of all records in the file. Unparseable lines (torn writes) are skipped. '''
+        ret = []
+        with self.lock:
+            if not os.path.exists(self.path):
+                return ret
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for lineno, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        ret.append(json.loads(line))
+                    except ValueError:
+                        self.print_error("Skipping corrupt record on line", lineno)
+        return ret
+
+    def append(self, *records):
+        if not records:
+            return
+        data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.ends_clean is None:
+                    self.ends_clean = not f.tell() or self._ends_with_newline()
+                if not self.ends_clean:
+                    data = '\n' + data # previous append was torn; don't glue our record onto the garbage
+                self.ends_clean = False # until the write below completes
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                self.ends_clean = True
+
+    def rewrite(self, records):
+        tmp = self.path + '.tmp'
+        with self.lock:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for r in records:
+                    f.write(json.dumps(r, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.ends_clean = True
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+
+class HistoryJournal(JsonLinesFile):
+    ''' Donation history, stored as one [address, name, amount, ref, txout] record per line. '''
+
+    SUFFIX = '.donate_spare_change_history.jsonl'
+
+
+class DonationJournal(JsonLinesFile):
+    ''' Write-ahead log of the donations we make, so that a crash can't make us lose track of a donation that went out.
+
+        Each donation (identified by its ref) moves through the states intent -> signed -> broadcast -> recorded, or ends
+        up abandoned if it never made it onto the network. Every state change is appended as 1 record holding the
+        donation's ref, its new state, and whatever fields became known along with it; replay() merges them back into 1
+        dict per donation. Only unfinished donations are kept in memory, and the file is compacted down to just those
+        every so often, so it stays small no matter how many donations are made.
+
+        log() may be called from any thread: the engine logs signed and broadcast txs from the worker threads that
+        signed or broadcast them, so that the fsyncs don't hold up the GUI thread. '''
+
+    SUFFIX = '.donate_spare_change_journal.jsonl'
+
+    INTENT, SIGNED, BROADCAST, RECORDED, ABANDONED = 'intent', 'signed', 'broadcast', 'recorded', 'abandoned'
+    FINAL_STATES = (RECORDED, ABANDONED)
+
+    compact_threshold = 256 # compact once the file holds at least this many records, most of them for finished donations
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.pending = OrderedDict() # ref -> merged record, for donations not in a final state. oldest first.
+        self.num_records = 0 # number of records in the file
+        self.state_lock = threading.RLock() # guards pending & num_records
+
+    def _apply(self, record):
+        ref = record.get('ref')
+        if not ref:
+            return
+        if record.get('state') in self.FINAL_STATES:
+            self.pending.pop(ref, None)
+        else:
+            self.pending.setdefault(ref, dict()).update(record)
+
+    def replay(self):
+        ''' Reads the journal, returning the list of unfinished donations (merged records), oldest first. '''
+        records = self.read()
+        with self.state_lock:
+            self.pending.clear()
+            for r in records:
+                self._apply(r)
+            self.num_records = len(records)
+            return [ dict(r) for r in self.pending.values() ]
+
+    def log(self, *records):
+        ''' Durably appends state changes. Each record is a dict with at least 'ref' and 'state' keys. '''
+        if not records:
+            return
+        with self.state_lock:
+            for r in records:
+                self._apply(r)
+            self.append(*records)
+            self.num_records += len(records)
+            if self.num_records >= self.compact_threshold and self.num_records > 2 * len(self.pending):
+                self.compact()
+
+    def compact(self):
+        ''' Atomically rewrites the file to hold just 1 merged record per unfinished donation. '''
+        with self.state_lock:
+            if self.num_records > len(self.pending):
+                self.rewrite(list(self.pending.values()))
+                self.num_records = len(self.pending)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from electroncash.util import PrintError
+
+from .metrics import Metrics
+
+
+def default_workers():
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class SigningJob:
+    ''' Handle for one batch of txs submitted to a SigningPool. '''
+
+    class Cancelled(Exception):
+        ''' Passed to on_signed for txs that were skipped because the job was cancelled. '''
+
+    def __init__(self, count, on_done):
+        self.remaining = count
+        self.on_done = on_done
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        ''' Txs that haven't started signing yet will be skipped. '''
+        self.cancelled = True
+
+    def task_done(self):
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.on_done()
+
+
+class SigningPool(PrintError):
+    ''' Signs independent transactions concurrently on a pool of worker threads.
+
+        Signing is dominated by libsecp256k1, which is called via ctypes and hence runs without holding the GIL, so the
+        workers really do sign in parallel. (With the pure-python ecdsa fallback there is no speedup, but also no harm.)
+        Each tx is signed by exactly one worker, and nothing but the tx itself is mutated, so the caller can keep using the
+        wallet from its own thread meanwhile. '''
+
+    def __init__(self, wallet, max_workers = None, metrics = None):
+        self.wallet = wallet
+        self.metrics = metrics or Metrics()
+        self.max_workers = max(1, int(max_workers or default_workers()))
+        self.executor = None # created lazily, on first use
+
+    def diagnostic_name(self): # from PrintError
+        return self.__class__.__name__
+
+    def sign_all(self, txs, on_signed, on_done, password = None):
+        ''' Submits every tx in txs for signing. on_signed(i, exc) is called from a worker thread as soon as txs[i] is done,
+        in completion order, with exc being None on success. on_done() is called from a worker thread once after all of
+        them. Returns a SigningJob, which may be used to cancel the remainder. '''
+        job = SigningJob(len(txs), on_done)
+        if not txs:
+            on_done()
+            return job
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers = self.max_workers)
+        for i, tx in enumerate(txs):
+            self.executor.submit(self._sign, job, i, tx, password, on_signed)
+        return job
+
+    def _sign(self, job, i, tx, password, on_signed):
+        exc = None
+        try:
+            if job.cancelled:
+                exc = SigningJob.Cancelled()
+            else:
+                with self.metrics.time('sign_transaction'):
+                    self.wallet.sign_transaction(tx, password)
+        except BaseException as e:
+            exc = e
+            self.metrics.add('sign_failed')
+        try:
+            on_signed(i, exc)
+        except BaseException as e:
+            self.print_error("on_signed callback raised:", repr(e))
+        finally:
+            job.task_done()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+            self.executor = None
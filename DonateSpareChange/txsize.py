@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Analytic transaction size model for our donation transactions, so that we can
+# figure out the fee before building the tx rather than building it twice.
+#
+# Our txs are always: N P2PKH inputs (we refuse multisig & hardware wallets),
+# and M outputs to P2PKH or P2SH charity addresses. The sizes here match what
+# Electron Cash's Transaction.estimated_size() produces for such txs.
+#
+from electroncash.address import Address
+
+TX_OVERHEAD = 4 + 4 # version + locktime (the in/out counts are varints, added separately)
+OUTPOINT_SIZE = 32 + 4 # prevout hash + prevout n
+SEQUENCE_SIZE = 4
+OUTPUT_VALUE_SIZE = 8
+
+ECDSA_SIG_SIZE = 72 # DER signature + sighash byte, as estimated by Electron Cash
+SCHNORR_SIG_SIZE = 65 # 64-byte Schnorr signature + sighash byte
+COMPRESSED_PUBKEY_SIZE = 33
+UNCOMPRESSED_PUBKEY_SIZE = 65
+
+P2PKH_SCRIPT_SIZE = 25 # OP_DUP OP_HASH160 <20 bytes> OP_EQUALVERIFY OP_CHECKSIG
+P2SH_SCRIPT_SIZE = 23 # OP_HASH160 <20 bytes> OP_EQUAL
+
+
+def varint_size(n):
+    if n < 0xfd: return 1
+    if n <= 0xffff: return 3
+    if n <= 0xffffffff: return 5
+    return 9
+
+def p2pkh_input_size(schnorr = False, compressed = True):
+    sig = SCHNORR_SIG_SIZE if schnorr else ECDSA_SIG_SIZE
+    pub = COMPRESSED_PUBKEY_SIZE if compressed else UNCOMPRESSED_PUBKEY_SIZE
+    script = 1 + sig + 1 + pub # <push sig> <push pubkey>
+    return OUTPOINT_SIZE + varint_size(script) + script + SEQUENCE_SIZE
+
+def output_script_size(address):
+    return P2SH_SCRIPT_SIZE if getattr(address, 'kind', None) == Address.ADDR_P2SH else P2PKH_SCRIPT_SIZE
+
+def output_size(script_size):
+    return OUTPUT_VALUE_SIZE + varint_size(script_size) + script_size
+
+def estimate_tx_size(num_inputs, output_script_sizes, schnorr = False, compressed = True):
+    ''' Returns the estimated size in bytes of a signed tx spending num_inputs P2PKH coins to outputs having the given
+    scriptPubKey sizes. '''
+    return (TX_OVERHEAD
+            + varint_size(num_inputs) + num_inputs * p2pkh_input_size(schnorr, compressed)
+            + varint_size(len(output_script_sizes)) + sum(output_size(s) for s in output_script_sizes))
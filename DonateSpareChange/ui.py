@@ -28,7 +28,7 @@ class Ui_Instance(object):
         self.gridLayout_2 = QtWidgets.QGridLayout(self.gb_coins)
         self.gridLayout_2.setContentsMargins(6, 6, 6, 12)
         self.gridLayout_2.setObjectName("gridLayout_2")
-        self.tree_coins = QtWidgets.QTreeWidget(self.gb_coins)
+        self.tree_coins = QtWidgets.QTreeView(self.gb_coins)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.MinimumExpanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -44,9 +44,10 @@ class Ui_Instance(object):
         self.tree_coins.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.tree_coins.setTextElideMode(QtCore.Qt.ElideMiddle)
         self.tree_coins.setIndentation(5)
-        self.tree_coins.setColumnCount(4)
+        self.tree_coins.setRootIsDecorated(False)
+        self.tree_coins.setUniformRowHeights(True)
+        self.tree_coins.setSortingEnabled(True)
         self.tree_coins.setObjectName("tree_coins")
-        item_0 = QtWidgets.QTreeWidgetItem(self.tree_coins)
         self.tree_coins.header().setMinimumSectionSize(19)
         self.gridLayout_2.addWidget(self.tree_coins, 0, 0, 1, 5)
         self.lbl_utxos = QtWidgets.QLabel(self.gb_coins)
@@ -226,17 +227,6 @@ class Ui_Instance(object):
         Instance.setWindowTitle(_translate("Instance", "Form"))
         self.gb_coins.setTitle(_translate("Instance", "Coins (UTXOs)"))
         self.tree_coins.setToolTip(_translate("Instance", "<html><head/><body><p>The set of all coins (UTXOs) in your wallet are displayed here.</p><p>Coins that meet the criteria for donation that you specified are marked as <span style=\" font-weight:600;\">eligible</span>.</p></body></html>"))
-        self.tree_coins.headerItem().setText(0, _translate("Instance", "Amount"))
-        self.tree_coins.headerItem().setText(1, _translate("Instance", "Address"))
-        self.tree_coins.headerItem().setText(2, _translate("Instance", "Age"))
-        self.tree_coins.headerItem().setText(3, _translate("Instance", "Status"))
-        __sortingEnabled = self.tree_coins.isSortingEnabled()
-        self.tree_coins.setSortingEnabled(False)
-        self.tree_coins.topLevelItem(0).setText(0, _translate("Instance", "0.001 mBCH"))
-        self.tree_coins.topLevelItem(0).setText(1, _translate("Instance", "qqashdaishdaskudhaskuh837"))
-        self.tree_coins.topLevelItem(0).setText(2, _translate("Instance", "120 blk"))
-        self.tree_coins.topLevelItem(0).setText(3, _translate("Instance", "123 blocks old, eligible for donation"))
-        self.tree_coins.setSortingEnabled(__sortingEnabled)
         self.lbl_utxos.setText(_translate("Instance", "2/16 coins meet specified criteria"))
         self.bt_donate_selected.setToolTip(_translate("Instance", "<html><head/><body><p>Create a new transaction for all the coins you selected that are <span style=\" font-weight:600;\">eligible</span>.</p><p>Recipients will be selected in a round-robin fashion from the set of all recipients.</p></body></html>"))
         self.bt_donate_selected.setText(_translate("Instance", "Donate Selected"))
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Times the plugin's hot paths against a synthetic wallet (see fakes.py) and prints a report. Save a report with
+# --json and compare a later run against it with --compare to spot regressions:
+#
+#   python3 benchmarks/bench.py --electron-cash ~/Electron-Cash --json before.json
+#   ... hack hack ...
+#   python3 benchmarks/bench.py --electron-cash ~/Electron-Cash --compare before.json
+#
+# Each benchmark has an untimed setup and a timed target, run for a number of rounds (like pytest-benchmark's
+# pedantic mode). The medians are what gets compared. Peak memory is measured with tracemalloc in 1 extra round.
+# The coins list benchmarks need PyQt5, and run on the offscreen platform.
+#
+import sys, os, argparse, json, platform, random, statistics, time, tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = list() # (name, factory) in registration order. factory(ctx) returns (setup, target), see bench()
+
+
+def bench(name):
+    ''' Registers a benchmark. The decorated factory gets the Context and returns (setup, target): setup() is run
+    untimed before every round and returns the args for target(*args), which is what gets timed. '''
+    def decorator(factory):
+        BENCHMARKS.append((name, factory))
+        return factory
+    return decorator
+
+
+class Context:
+    ''' The synthetic wallet and the plugin objects built on it, shared by the benchmarks of 1 run. '''
+
+    def __init__(self, args):
+        from fakes import FakeWallet, FakeConfig, make_charities, make_history
+        from DonateSpareChange.coin_index import CoinIndex
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.config = FakeConfig()
+        self.wallet = FakeWallet(n = args.utxos, seed = args.seed)
+        self.charities = make_charities(args.charities, self.rng)
+        self.history = make_history(args.history, self.charities, self.rng)
+        self.data = self.make_data()
+        self.index = CoinIndex(self.wallet, self.data.get_changedef)
+        self.index.refresh()
+
+    def make_data(self, history = True):
+        from fakes import FakeStorage, NullTimer
+        from DonateSpareChange.core import DataModel
+        data = DataModel("DonateSpareChange", FakeStorage(), self.config, make_timer = lambda callback: NullTimer())
+        data.set_charities(list(self.charities))
+        if history:
+            h = dict()
+            for entry in self.history:
+                h.setdefault(entry[0], list()).append(entry)
+            data.set_history(h)
+        data.flush()
+        data.data = None # so the next access loads it back from storage, as a freshly opened wallet would
+        return data
+
+    def make_engine(self):
+        from fakes import FakeHost, NullTimer
+        from DonateSpareChange.core import Engine, CheckScheduler
+        return Engine(FakeHost(self.wallet, self.config, self.data, self.index), CheckScheduler(lambda callback: NullTimer()))
+
+
+# --- Coin index: what the coins list and the engine's checks scan the wallet with
+
+@bench("coin_index.full_scan")
+def _(ctx):
+    from DonateSpareChange.coin_index import CoinIndex
+    def target(index):
+        index.refresh()
+        index.get_coins()
+    return (lambda: (CoinIndex(ctx.wallet, ctx.data.get_changedef),)), target
+
+@bench("coin_index.get_coins")
+def _(ctx):
+    return (lambda: ()), lambda: ctx.index.get_coins()
+
+@bench("coin_index.get_coins_eligible")
+def _(ctx):
+    return (lambda: ()), lambda: ctx.index.get_coins(eligible_only = True)
+
+@bench("coin_index.snapshot")
+def _(ctx):
+    return (lambda: ()), lambda: ctx.index.snapshot(0)
+
+@bench("coin_index.snapshot[eligible]")
+def _(ctx):
+    return (lambda: ()), lambda: ctx.index.snapshot(0, full = False)
+
+@bench("coin_index.new_coin")
+def _(ctx):
+    added = list()
+    def setup():
+        if added: # take back the coin of the last round, so every round sees the same wallet
+            ctx.wallet.utxos.remove(added.pop())
+            ctx.index.note_wallet_updated()
+            ctx.index.refresh()
+        added.extend(ctx.wallet.receive(1))
+        ctx.index.note_wallet_updated()
+        return ()
+    return setup, lambda: ctx.index.refresh()
+
+@bench("coin_index.new_block")
+def _(ctx):
+    def target():
+        ctx.index.refresh()
+        ctx.index.get_coins()
+    return (lambda: ctx.wallet.new_block() or ()), target
+
+
+# --- The engine
+
+@bench("engine.make_transaction[batch]")
+def _(ctx):
+    engine = ctx.make_engine()
+    def setup():
+        ctx.index.refresh()
+        coins, _ = ctx.index.get_coins(eligible_only = True)
+        return coins[:ctx.args.batch], engine.rr.copy()
+    return setup, engine.make_transaction
+
+@bench("engine.make_transaction[per_coin]")
+def _(ctx):
+    engine = ctx.make_engine()
+    def setup():
+        ctx.index.refresh()
+        coins, _ = ctx.index.get_coins(eligible_only = True)
+        return coins[:ctx.args.batch], engine.rr.copy()
+    def target(coins, rr):
+        for c in coins:
+            engine.make_transaction([c], rr = rr)
+    return setup, target
+
+@bench("engine.plan_batches")
+def _(ctx):
+    engine = ctx.make_engine()
+    def setup():
+        ctx.index.refresh()
+        return (ctx.index.get_coins(eligible_only = True)[0],)
+    return setup, engine.plan_batches
+
+
+# --- Round-robin
+
+@bench("roundrobin.rotate[x10000]")
+def _(ctx):
+    from DonateSpareChange.roundrobin import RoundRobin
+    def target(rr):
+        for _ in range(10000):
+            rr.rotate()
+    return (lambda: (RoundRobin([c[1:] for c in ctx.charities]),)), target
+
+@bench("roundrobin.update")
+def _(ctx):
+    from DonateSpareChange.roundrobin import RoundRobin
+    items = [ tuple(c[1:]) for c in ctx.charities ]
+    def setup():
+        new = items[1:] + [("NewCharity", items[0][1] + "x")] # 1 removed, 1 added
+        ctx.rng.shuffle(new)
+        return RoundRobin(items), new
+    return setup, lambda rr, new: rr.update(new)
+
+@bench("roundrobin.load")
+def _(ctx):
+    from DonateSpareChange.roundrobin import RoundRobin
+    stored = [ list(c[1:]) for c in ctx.charities ] # lists, as they come back from wallet storage
+    return (lambda: (stored,)), RoundRobin
+
+
+# --- DataModel history
+
+@bench("datamodel.history_totals")
+def _(ctx):
+    def target(data):
+        for c in ctx.charities:
+            data.history_get_total_for_address(c[2])
+            data.history_get_count_for_address(c[2])
+    return (lambda: (ctx.make_data(),)), target # a fresh model, so the history index gets built from storage
+
+@bench("datamodel.history_get_for_address")
+def _(ctx):
+    def target(data):
+        for c in ctx.charities:
+            data.history_get_for_address(c[2])
+    data = ctx.make_data()
+    return (lambda: (data,)), target
+
+@bench("datamodel.history_put_entry[x100]+flush")
+def _(ctx):
+    from fakes import make_history
+    def setup():
+        data = ctx.make_data()
+        data.history_get_total_for_address(None) # build the index untimed
+        return data, [ data.HistoryEntry(*e) for e in make_history(100, ctx.charities, ctx.rng) ]
+    def target(data, entries):
+        for e in entries:
+            data.history_put_entry(e)
+        data.flush()
+    return setup, target
+
+@bench("datamodel.flush")
+def _(ctx):
+    def setup():
+        data = ctx.make_data()
+        data.set_autodonate(True)
+        return (data,)
+    return setup, lambda data: data.flush()
+
+
+# --- The coins list (Qt)
+
+def qt_benchmarks():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtCore import QObject, Qt
+        from PyQt5.QtWidgets import QApplication
+        from DonateSpareChange.qt import Instance
+    except ImportError as e:
+        print("Skipping the coins list benchmarks:", e, file = sys.stderr)
+        return
+    from fakes import FakeWindow
+    app = QApplication.instance() or QApplication([]) # keep a reference, or Qt goes away
+    CoinsModel = Instance.CoinsMgr.CoinsModel
+
+    class CoinsMgr(QObject):
+        ''' Just what the CoinsModel needs from Instance.CoinsMgr. '''
+        cell_text = Instance.CoinsMgr.cell_text
+        cell_brush = Instance.CoinsMgr.cell_brush
+        def __init__(self):
+            super().__init__()
+            self.app = app
+            self.parent = type("Parent", (), dict(window = FakeWindow()))()
+            self.brushIneligible = self.brushFrozen = self.brushEligible = None
+            self.model = CoinsModel(self)
+
+    def paint(model, rows = 40):
+        ''' What the view asks for to paint the visible rows. '''
+        for row in range(min(rows, model.rowCount())):
+            for col in range(model.columnCount()):
+                ix = model.index(row, col)
+                model.data(ix, Qt.DisplayRole)
+                model.data(ix, Qt.ForegroundRole)
+
+    @bench("coins_list.initial_load")
+    def _(ctx):
+        def target(mgr, snap):
+            mgr.model.reconcile(snap.coins, snap.local_height)
+            paint(mgr.model)
+        return (lambda: (CoinsMgr(), ctx.index.snapshot(0))), target
+
+    @bench("coins_list.new_block")
+    def _(ctx):
+        def setup():
+            mgr = CoinsMgr()
+            snap = ctx.index.snapshot(0)
+            mgr.model.reconcile(snap.coins, snap.local_height)
+            ctx.wallet.new_block()
+            return mgr, ctx.index.snapshot(1)
+        def target(mgr, snap):
+            mgr.model.reconcile(snap.coins, snap.local_height)
+            paint(mgr.model)
+        return setup, target
+
+
+# --- Running & reporting
+
+def run(args):
+    ctx = Context(args)
+    results = dict()
+    for name, factory in BENCHMARKS:
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        setup, target = factory(ctx)
+        target(*setup()) # warm up
+        times = list()
+        for _ in range(args.rounds):
+            a = setup()
+            t0 = time.perf_counter()
+            target(*a)
+            times.append(time.perf_counter() - t0)
+        a = setup()
+        tracemalloc.start()
+        target(*a)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = dict(min = min(times), max = max(times), mean = statistics.mean(times), median = statistics.median(times),
+                             stddev = statistics.stdev(times) if len(times) > 1 else 0.0, rounds = len(times), peak_bytes = peak)
+        print_row(name, results[name], file = sys.stderr) # progress
+    return results
+
+def print_row(name, r, base = None, threshold = 0.0, file = sys.stdout):
+    ms = lambda s: "%10.3f" % (s * 1e3)
+    line = "{:<42}{}{}{}{}{}{:>10.1f}".format(name, ms(r['min']), ms(r['median']), ms(r['mean']), ms(r['stddev']), ms(r['max']),
+                                               r['peak_bytes'] / 1024)
+    if base:
+        change = r['median'] / base['median'] - 1 if base['median'] else 0.0
+        verdict = "REGRESSION" if change > threshold else ("faster" if change < -threshold else "")
+        line += "  {:>+7.1%} {}".format(change, verdict)
+    print(line, file = file)
+
+def report(params, results, baseline = None, threshold = 0.0):
+    ''' Prints the results table. Returns the names of the benchmarks that regressed against baseline. '''
+    print("Parameters:", ", ".join("{}={}".format(k, v) for k, v in sorted(params.items())))
+    if baseline and dict(baseline['params'], rounds = None) != dict(params, rounds = None):
+        print("WARNING: the baseline was run with different parameters:", baseline['params'])
+    header = "{:<42}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format("benchmark (ms)", "min", "median", "mean", "stddev", "max", "peak KiB")
+    if baseline:
+        header += "  {:>7}".format("vs base")
+    print(header)
+    regressed = list()
+    for name, r in results.items():
+        base = baseline and baseline['results'].get(name)
+        print_row(name, r, base, threshold)
+        if base and base['median'] and r['median'] / base['median'] - 1 > threshold:
+            regressed.append(name)
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the DonateSpareChange plugin against a synthetic wallet.")
+    parser.add_argument('--electron-cash', metavar = 'PATH', help = "Electron Cash source checkout to import electroncash from")
+    parser.add_argument('--utxos', type = int, default = 10000, help = "coins in the wallet (default: %(default)s)")
+    parser.add_argument('--charities', type = int, default = 10, help = "charities (default: %(default)s)")
+    parser.add_argument('--history', type = int, default = 5000, help = "donation history entries (default: %(default)s)")
+    parser.add_argument('--batch', type = int, default = 200, help = "coins per make_transaction (default: %(default)s)")
+    parser.add_argument('--rounds', type = int, default = 10, help = "timed rounds per benchmark (default: %(default)s)")
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--no-qt', action = 'store_true', help = "skip the coins list benchmarks")
+    parser.add_argument('--json', metavar = 'FILE', help = "save the results, to --compare against later")
+    parser.add_argument('--compare', metavar = 'FILE', help = "compare against results saved with --json")
+    parser.add_argument('--threshold', type = float, default = 0.10,
+                        help = "a median this much slower than the baseline's is a regression (default: %(default)s)")
+    parser.add_argument('filter', nargs = '*', help = "only run benchmarks whose name contains one of these")
+    args = parser.parse_args()
+
+    if args.electron_cash:
+        sys.path.insert(0, os.path.abspath(os.path.expanduser(args.electron_cash)))
+    sys.path.insert(0, REPO_ROOT)
+    if not args.no_qt:
+        qt_benchmarks()
+
+    params = dict(utxos = args.utxos, charities = args.charities, history = args.history, batch = args.batch,
+                  rounds = args.rounds, seed = args.seed)
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressed = report(params, results, baseline, args.threshold)
+    if args.json:
+        from DonateSpareChange.coin_index import np
+        with open(args.json, 'w') as f:
+            json.dump(dict(params = params, python = platform.python_version(), numpy = np is not None, results = results), f, indent = 1)
+    if regressed:
+        print("\n{} benchmark(s) regressed by more than {:.0%}: {}".format(len(regressed), args.threshold, ", ".join(regressed)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
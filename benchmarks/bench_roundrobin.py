@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Micro-benchmark of RoundRobin: times rotate(), to_back(item) & update() per call, at a range of recipient counts, to
+# show that rotate() & to_back() cost the same per call with 10 recipients as with 10000. The list-based RoundRobin the
+# plugin used before is timed alongside, for comparison:
+#
+#   python3 benchmarks/bench_roundrobin.py --electron-cash ~/Electron-Cash
+#   python3 benchmarks/bench_roundrobin.py --electron-cash ~/Electron-Cash --sizes 10 1000 10000 100000
+#
+import sys, os, argparse, random, time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ListRoundRobin(list):
+    ''' The list-based RoundRobin that roundrobin.RoundRobin replaced, verbatim minus the docstrings. Only here to be
+    timed against. '''
+
+    def front(self):
+        if len(self):
+            return self[0]
+        return None
+
+    def push_front_unique(self, item):
+        if item is not None and item not in self:
+            self.insert(0, item)
+        return self
+
+    def update(self, l):
+        tmp = self.copy()
+        self.clear()
+        for t in tmp:
+            if t in l:
+                self.append(t)
+        for item in l:
+            self.push_front_unique(item)
+        return self
+
+    def to_back(self, item = None):
+        if item is None:
+            item = self.pop(0)
+            self.append(item)
+        else:
+            for i, elem in enumerate(self):
+                if elem == item:
+                    self.pop(i)
+                    break
+            self.append(item)
+        return self
+
+    def rotate(self): ret = self.front(); self.to_back(); return ret
+
+
+def make_items(n):
+    ''' n (name, address) recipients, like DataModel.update_rr passes in. '''
+    return [ ("Charity%d" % i, "bitcoincash:q%040x" % i) for i in range(n) ]
+
+def time_per_call(cls, op, n, calls, repeat, rng):
+    ''' Best of `repeat` runs of `calls` calls of op on a cls holding n recipients, in seconds per call. '''
+    items = make_items(n)
+    best = None
+    for _ in range(repeat):
+        rr = cls(items)
+        if op == 'rotate':
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                rr.rotate()
+        elif op == 'to_back':
+            picks = [ rng.choice(items) for _ in range(calls) ] # recipients anywhere in the queue, not just at the front
+            t0 = time.perf_counter()
+            for item in picks:
+                rr.to_back(item)
+        elif op == 'update':
+            edits = list()
+            for _ in range(calls): # 1 recipient removed & 1 added per update, as when the user edits the list
+                new = list(items)
+                new[rng.randrange(n)] = ("NewCharity", "bitcoincash:p%040x" % rng.getrandbits(160))
+                edits.append(new)
+            t0 = time.perf_counter()
+            for new in edits:
+                rr.update(new)
+        else:
+            raise ValueError(op)
+        elapsed = (time.perf_counter() - t0) / calls
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description = "Times RoundRobin's operations per call, at a range of recipient counts.")
+    parser.add_argument('--electron-cash', metavar = 'PATH', help = "Electron Cash source checkout to import electroncash from")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10, 100, 1000, 10000], help = "recipient counts (default: %(default)s)")
+    parser.add_argument('--calls', type = int, default = 10000, help = "rotate/to_back calls per run (default: %(default)s)")
+    parser.add_argument('--update-calls', type = int, default = 10, help = "update calls per run (default: %(default)s)")
+    parser.add_argument('--repeat', type = int, default = 5, help = "runs per measurement; the best is reported (default: %(default)s)")
+    parser.add_argument('--old-max', type = int, default = 1000,
+                        help = "only time the old class's O(n^2) update up to this many recipients (default: %(default)s)")
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    if args.electron_cash:
+        sys.path.insert(0, os.path.abspath(os.path.expanduser(args.electron_cash)))
+    sys.path.insert(0, REPO_ROOT)
+    from DonateSpareChange.roundrobin import RoundRobin
+
+    rng = random.Random(args.seed)
+    us = lambda secs: "{:.3f}".format(secs * 1e6)
+    print("{:>10}  {:>12} {:>12}  {:>12} {:>12}  {:>12} {:>12}".format(
+          "recipients", "rotate us", "(old)", "to_back us", "(old)", "update us", "(old)"))
+    rotate = dict()
+    for n in args.sizes:
+        row = list()
+        for op in ('rotate', 'to_back', 'update'):
+            calls = args.update_calls if op == 'update' else args.calls
+            new = time_per_call(RoundRobin, op, n, calls, args.repeat, rng)
+            old = None
+            if op != 'update' or n <= args.old_max:
+                old = time_per_call(ListRoundRobin, op, n, calls, 1 if op == 'update' else args.repeat, rng)
+            row += [ us(new), us(old) if old is not None else '-' ]
+            if op == 'rotate':
+                rotate[n] = new
+        print("{:>10}  {:>12} {:>12}  {:>12} {:>12}  {:>12} {:>12}".format(n, *row))
+    lo, hi = min(args.sizes), max(args.sizes)
+    print("\nrotate per call at {} recipients is {:.2f}x what it is at {}.".format(hi, rotate[hi] / rotate[lo], lo))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Synthetic stand-ins for the Electron Cash objects the plugin talks to (wallet, wallet storage, network, config), so
+# that its hot paths can be timed without a live wallet. They implement just the parts of the real APIs the plugin
+# uses. Everything is generated from a seed, so runs with the same parameters see the same wallet.
+#
+# Electron Cash itself must still be importable (for Address & friends); see bench.py.
+#
+import copy, random
+
+from electroncash.address import Address
+
+from DonateSpareChange import txsize
+from DonateSpareChange.metrics import Metrics
+
+
+def make_address(rng):
+    return Address.from_P2PKH_hash(bytes(rng.getrandbits(8) for _ in range(20)))
+
+def make_utxos(n, tip, rng, addresses = 200):
+    ''' n utxo dicts, like Wallet.get_utxos() returns, spread over `addresses` addresses and the last ~2000 blocks below
+    tip. About 2% are unconfirmed, and values are log-uniform from dust to 1 BCH, so every eligibility reason shows up. '''
+    addrs = [ make_address(rng) for _ in range(max(1, addresses)) ]
+    utxos = list()
+    for i in range(n):
+        utxos.append({
+            'prevout_hash' : '%064x' % rng.getrandbits(256),
+            'prevout_n' : rng.randrange(4),
+            'address' : rng.choice(addrs),
+            'value' : int(10 ** rng.uniform(2.5, 8)),
+            'height' : 0 if rng.random() < 0.02 else tip - rng.randrange(2000),
+            'coinbase' : False,
+        })
+    return utxos
+
+def make_charities(m, rng):
+    ''' m charities in DataModel format: (enabled, name, address_str). About 1 in 10 is disabled. '''
+    return [ (i % 10 != 9, "Charity%d" % i, make_address(rng).to_string(Address.FMT_CASHADDR)) for i in range(m) ]
+
+def make_history(k, charities, rng):
+    ''' k donation HistoryEntry tuples (address, name, amount, ref, txout), as lists like wallet storage gives them back. '''
+    h = list()
+    for i in range(k):
+        _, name, address = charities[i % len(charities)]
+        h.append([address, name, rng.randrange(546, 10500), '%016x' % rng.getrandbits(64), '%064x:%d' % (rng.getrandbits(256), i % 3)])
+    return h
+
+
+class NullTimer:
+    ''' A timer that never fires, for a DataModel that coalesces writes until flush(), as it does in the GUI. '''
+    def start(self, ms = 0): self.active = True
+    def stop(self): self.active = False
+    def isActive(self): return getattr(self, 'active', False)
+
+
+class FakeConfig:
+    ''' SimpleConfig: get() & set_key(). '''
+
+    def __init__(self, **kw):
+        self.d = dict(kw)
+
+    def get(self, key, default = None):
+        return self.d.get(key, default)
+
+    def set_key(self, key, value, save = True):
+        self.d[key] = value
+
+
+class FakeStorage:
+    ''' WalletStorage, in memory. Like the real one, get() returns a deep copy and put() stores one. Counts writes. '''
+
+    def __init__(self, path = None):
+        self.path = path # a real path makes DataModel keep its sidecar journals there; None = no journals
+        self.d = dict()
+        self.puts = 0
+        self.writes = 0
+
+    def get(self, key, default = None):
+        v = self.d.get(key)
+        return default if v is None else copy.deepcopy(v)
+
+    def put(self, key, value):
+        self.d[key] = copy.deepcopy(value)
+        self.puts += 1
+
+    def write(self):
+        self.writes += 1
+
+    def is_encrypted(self):
+        return False
+
+
+class FakeNetwork:
+    ''' Network: always connected and up-to-date. Broadcasts succeed instantly. '''
+
+    def __init__(self, height):
+        self.height = height
+        self.broadcasts = 0
+
+    def is_connected(self): return True
+    def is_up_to_date(self): return True
+    def get_local_height(self): return self.height
+    def register_callback(self, callback, events): pass
+    def unregister_callback(self, callback): pass
+
+    def broadcast_transaction(self, tx, callback = None):
+        self.broadcasts += 1
+        return True, tx.txid()
+
+    broadcast = broadcast_transaction
+
+
+class FakeTx:
+    ''' What FakeWallet.make_unsigned_transaction() returns. Its size comes from the plugin's own size model, so
+    Engine.make_transaction() is timed without Electron Cash's tx serialization. '''
+
+    def __init__(self, inputs, outputs, schnorr = False):
+        self.inputs, self.outputs, self.schnorr = inputs, outputs, schnorr
+
+    def estimated_size(self):
+        return txsize.estimate_tx_size(len(self.inputs), [txsize.output_script_size(o[1]) for o in self.outputs], schnorr = self.schnorr)
+
+    def txid(self):
+        key = (tuple((i['prevout_hash'], i['prevout_n']) for i in self.inputs), tuple(o[2] for o in self.outputs))
+        return '%064x' % (hash(key) & (2**256 - 1))
+
+    def serialize(self):
+        return '00' * 10 + self.txid() # not a real tx, but what the donation journal keeps of one
+
+    def is_complete(self):
+        return True
+
+
+class FakeWallet:
+    ''' Abstract_Wallet: a standard, password-less wallet holding n synthetic utxos at height `tip`. '''
+
+    def __init__(self, n = 1000, tip = 600000, seed = 1, addresses = 200, frozen_addresses = 2, frozen_coins = 10, path = None):
+        self.rng = random.Random(seed)
+        self.utxos = make_utxos(n, tip, self.rng, addresses)
+        self.network = FakeNetwork(tip)
+        self.storage = FakeStorage(path)
+        addrs = list({ u['address'] for u in self.utxos })
+        self.frozen_addresses = set(self.rng.sample(addrs, min(frozen_addresses, len(addrs))))
+        self.frozen_coins = { '{}:{}'.format(u['prevout_hash'], u['prevout_n']) for u in self.rng.sample(self.utxos, min(frozen_coins, n)) }
+        self.labels = dict()
+
+    # --- simulation
+
+    def receive(self, n = 1):
+        ''' n new (unconfirmed) coins arrive. Returns them. '''
+        new = make_utxos(n, self.network.height, self.rng, addresses = 1)
+        for u in new:
+            u['height'] = 0
+        self.utxos.extend(new)
+        return new
+
+    def new_block(self):
+        ''' The chain grows by 1 block, which confirms all unconfirmed coins. '''
+        self.network.height += 1
+        for u in self.utxos:
+            if not u['height']:
+                u['height'] = self.network.height
+
+    # --- the Wallet API the plugin uses
+
+    def get_local_height(self):
+        return self.network.height
+
+    def get_utxos(self, domain = None, exclude_frozen = False, mature = False, confirmed_only = False):
+        return [ dict(u) for u in self.utxos if not confirmed_only or u['height'] > 0 ]
+
+    def is_frozen(self, addr):
+        return addr in self.frozen_addresses
+
+    def is_up_to_date(self): return True
+    def has_password(self): return False
+    def get_keystores(self): return []
+    def is_schnorr_enabled(self): return False
+
+    def set_label(self, name, text):
+        self.labels[name] = text
+
+    def make_unsigned_transaction(self, inputs, outputs, config, fixed_fee = None, change_addr = None, sign_schnorr = None):
+        return FakeTx(inputs, outputs, bool(sign_schnorr))
+
+    def sign_transaction(self, tx, password):
+        pass
+
+
+class FakeHost:
+    ''' The Instance an Engine runs in (see core.Engine), minus any UI. Calls meant for the host's thread run at once. '''
+
+    def __init__(self, wallet, config, data, coin_index):
+        self.wallet, self.config, self.data, self.coin_index = wallet, config, data, coin_index
+        self.disabled = self.incompatible = False
+        self.is_schnorr_enabled = wallet.is_schnorr_enabled
+        self.metrics = Metrics()
+
+    def diagnostic_name(self): return "bench"
+    def short_name(self): return "Donate Change"
+    def call_soon(self, fn, *args): fn(*args)
+    def make_timer(self, callback): return NullTimer()
+    def request_scan(self, watch = ()): return 0
+    def set_wake_height(self, h): pass
+    def notify(self, msg): pass
+    def show_error(self, msg): print("Engine error:", msg)
+    def format_amount_and_units(self, sats): return "%d sats" % sats
+    def history_changed(self): pass
+    def autodonate_turned_off(self): pass
+    def make_progress(self, value, maximum): return None
+    def show_transaction(self, tx, desc): pass
+
+
+class FakeWindow:
+    ''' The bits of ElectrumWindow the coins list formats amounts with. '''
+
+    def format_amount(self, sats):
+        return "%.8f" % (sats / 1e8)
+
+    def base_unit(self):
+        return "BCH"
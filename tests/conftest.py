@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+# Unit tests for the plugin's Qt-free parts. They drive the real plugin code against the synthetic wallet, network &
+# host in benchmarks/fakes.py. Electron Cash itself must be importable; point ELECTRON_CASH at a source checkout:
+#
+#   ELECTRON_CASH=~/Electron-Cash python3 -m pytest tests
+#
+# Without it, the tests are skipped.
+#
+import os, sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.environ.get('ELECTRON_CASH'):
+    sys.path.insert(0, os.path.abspath(os.path.expanduser(os.environ['ELECTRON_CASH'])))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks')) # for fakes
+sys.path.insert(0, REPO_ROOT)
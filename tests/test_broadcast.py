@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import queue, threading, time
+
+import pytest
+
+pytest.importorskip('electroncash')
+
+from DonateSpareChange.broadcast import BroadcastQueue
+
+
+class StubTx:
+    def __init__(self, txid):
+        self._txid = txid
+
+    def txid(self):
+        return self._txid
+
+
+class StubNetwork:
+    ''' Answers each broadcast of a tx with the next of the (status, msg) replies scripted for its txid. Once those run
+    out, broadcasts succeed. Optionally holds every broadcast until `gate` is set. '''
+
+    def __init__(self, replies = None, gate = None):
+        self.replies = { txid : list(r) for txid, r in (replies or {}).items() }
+        self.gate = gate
+        self.calls = list() # (txid, time.monotonic())
+        self.lock = threading.Lock()
+
+    def broadcast_transaction(self, tx):
+        if self.gate:
+            self.gate.wait(5)
+        txid = tx.txid()
+        with self.lock:
+            self.calls.append((txid, time.monotonic()))
+            r = self.replies.get(txid)
+            return r.pop(0) if r else (True, txid)
+
+    def attempts(self, txid):
+        return [ t for i, t in self.calls if i == txid ]
+
+
+class Results:
+    ''' The on_result callback, collecting (txid, ok, msg, context) tuples. '''
+
+    def __init__(self):
+        self.q = queue.Queue()
+
+    def __call__(self, txid, ok, msg, context):
+        self.q.put((txid, ok, msg, context))
+
+    def get(self, timeout = 5):
+        return self.q.get(timeout = timeout)
+
+    def empty_after(self, secs):
+        time.sleep(secs)
+        return self.q.empty()
+
+
+def make_queue(network, **kw):
+    results = Results()
+    kw.setdefault('base_delay', 0.01)
+    return BroadcastQueue(network, results, **kw), results
+
+
+def test_broadcast_ok():
+    net = StubNetwork()
+    bq, results = make_queue(net)
+    assert bq.submit(StubTx('a'), context = 'ctx')
+    assert results.get() == ('a', True, 'a', 'ctx')
+    assert bq.pending() == 0
+    assert bq.metrics.summary()['counters'] == {'broadcast_ok' : 1}
+
+def test_transient_failure_is_retried():
+    net = StubNetwork({'a' : [(False, 'timed out'), (False, 'server busy')]})
+    bq, results = make_queue(net)
+    bq.submit(StubTx('a'))
+    txid, ok, msg, context = results.get()
+    assert (txid, ok) == ('a', True)
+    assert len(net.attempts('a')) == 3
+    assert bq.metrics.summary()['counters'] == {'broadcast_retries' : 2, 'broadcast_ok' : 1}
+    assert results.empty_after(0.05) # exactly 1 result per submission
+
+def test_backoff_doubles_up_to_max_delay():
+    net = StubNetwork({'a' : [(False, 'timed out')] * 3})
+    bq, results = make_queue(net, base_delay = 0.05, max_delay = 60)
+    bq.submit(StubTx('a'))
+    assert results.get()[1]
+    t = net.attempts('a')
+    gaps = [ b - a for a, b in zip(t, t[1:]) ]
+    assert gaps[0] >= 0.05 and gaps[1] >= 0.1 and gaps[2] >= 0.2
+
+    net = StubNetwork({'b' : [(False, 'timed out')] * 3})
+    bq, results = make_queue(net, base_delay = 0.05, max_delay = 0.05)
+    bq.submit(StubTx('b'))
+    assert results.get()[1]
+    t = net.attempts('b')
+    assert all(b - a >= 0.05 for a, b in zip(t, t[1:]))
+    assert t[-1] - t[0] < 0.3 # uncapped, the 3 retries would take 0.35s
+
+def test_gives_up_after_max_attempts():
+    net = StubNetwork({'a' : [(False, 'timed out')] * 10})
+    bq, results = make_queue(net, max_attempts = 3)
+    bq.submit(StubTx('a'))
+    txid, ok, msg, context = results.get()
+    assert not ok and msg == 'timed out'
+    assert len(net.attempts('a')) == 3
+    assert bq.metrics.summary()['counters'] == {'broadcast_retries' : 2, 'broadcast_failed' : 1}
+
+def test_permanent_error_is_not_retried():
+    net = StubNetwork({'a' : [(False, 'the transaction was rejected by network rules.\n\nbad-txns-inputs-spent')]})
+    bq, results = make_queue(net)
+    bq.submit(StubTx('a'))
+    assert not results.get()[1]
+    assert len(net.attempts('a')) == 1
+
+def test_already_known_counts_as_accepted():
+    net = StubNetwork({'a' : [(False, 'txn-already-known')]})
+    bq, results = make_queue(net)
+    bq.submit(StubTx('a'))
+    assert results.get() == ('a', True, 'a', None)
+    assert len(net.attempts('a')) == 1
+
+def test_dedupe():
+    gate = threading.Event()
+    net = StubNetwork({'b' : [(False, 'missing inputs')]}, gate = gate)
+    bq, results = make_queue(net, max_in_flight = 1)
+    assert bq.submit(StubTx('a'))
+    assert not bq.submit(StubTx('a')) # queued or in flight
+    assert bq.submit(StubTx('b'))
+    gate.set()
+    assert sorted(results.get()[:2] for _ in range(2)) == [('a', True), ('b', False)]
+    assert not bq.submit(StubTx('a')) # recently accepted
+    assert bq.submit(StubTx('b')) # failed, so it may be tried again
+    assert results.get()[:2] == ('b', True)
+    assert [ txid for txid, t in net.calls ] == ['a', 'b', 'b']
+
+def test_accepted_txids_are_capped():
+    net = StubNetwork()
+    bq, results = make_queue(net, max_accepted = 2)
+    for txid in 'abc':
+        bq.submit(StubTx(txid))
+        results.get()
+    assert list(bq.accepted) == ['b', 'c']
+    assert bq.submit(StubTx('a')) # forgotten: no longer deduped
+    results.get()
+
+def test_max_in_flight_and_workers_exit():
+    gate = threading.Event()
+    net = StubNetwork(gate = gate)
+    bq, results = make_queue(net, max_in_flight = 2)
+    for txid in 'abcde':
+        bq.submit(StubTx(txid))
+    assert len(bq.threads) == 2
+    gate.set()
+    assert sorted(results.get()[0] for _ in range(5)) == list('abcde')
+    for _ in range(100):
+        if not bq.threads:
+            break
+        time.sleep(0.01)
+    assert bq.threads == []
+
+def test_close_drops_queued_txs():
+    gate = threading.Event()
+    net = StubNetwork(gate = gate)
+    bq, results = make_queue(net, max_in_flight = 1)
+    bq.submit(StubTx('a'))
+    bq.submit(StubTx('b'))
+    bq.close()
+    gate.set()
+    assert results.empty_after(0.1)
+    assert not bq.submit(StubTx('c'))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import os, queue, random, threading
+
+import pytest
+
+pytest.importorskip('electroncash')
+
+from fakes import FakeWallet, FakeConfig, FakeHost, make_charities
+
+from DonateSpareChange.coin_index import CoinIndex
+from DonateSpareChange.core import DataModel, Engine
+
+
+class Host(FakeHost):
+    ''' A host whose thread is the test's: call_soon() & the scans it's asked for are queued, and run by run(). '''
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.q = queue.Queue()
+        self.engine = None
+        self.seq = 0
+        self.notes = list()
+
+    def call_soon(self, fn, *args):
+        self.q.put((fn, args))
+
+    def request_scan(self, watch = ()):
+        self.seq += 1
+        self.q.put((lambda seq: self.engine.on_snapshot(self.coin_index.snapshot(seq, full = False, watch = watch)), (self.seq,)))
+        return self.seq
+
+    def notify(self, msg):
+        self.notes.append(msg)
+
+    def run(self, idle = 0.5):
+        ''' Runs queued calls on this thread until none arrive for `idle` seconds. '''
+        assert threading.current_thread() is threading.main_thread()
+        while True:
+            try:
+                fn, args = self.q.get(timeout = idle)
+            except queue.Empty:
+                return
+            fn(*args)
+
+
+class Scheduler:
+    ''' CheckScheduler, minus the staggering: a scheduled check just gets queued on the host's thread. '''
+
+    def __init__(self, host):
+        self.host = host
+
+    def schedule(self, engine, delay = 0):
+        self.host.call_soon(engine.do_check)
+
+    def cancel(self, engine):
+        pass
+
+
+def make_engine(tmp_path, autodonate):
+    wallet = FakeWallet(n = 300, path = os.path.join(str(tmp_path), 'wallet'))
+    config = FakeConfig()
+    data = DataModel("DonateSpareChange", wallet.storage, config)
+    data.set_charities(make_charities(3, random.Random(1)))
+    data.set_autodonate(autodonate)
+    coin_index = CoinIndex(wallet, data.get_changedef)
+    host = Host(wallet, config, data, coin_index)
+    host.engine = Engine(host, Scheduler(host))
+    return host
+
+def test_autodonate_round(tmp_path):
+    host = make_engine(tmp_path, autodonate = True)
+    wallet, data, engine = host.wallet, host.data, host.engine
+    host.coin_index.refresh()
+    eligible = host.coin_index.snapshot(0, full = False).eligible
+    assert eligible
+
+    engine.start()
+    try:
+        host.run()
+
+        # Every eligible coin went to a charity, was broadcast, and made it into the history
+        assert wallet.network.broadcasts == len(eligible)
+        donations = [ data.history_get_count_for_address(c[2]) for c in data.get_charities() ]
+        assert sum(donations) == len(eligible)
+        assert all(donations) # taking turns, with more coins than charities
+        assert len(wallet.labels) == len(eligible)
+        # ... and the write-ahead journal saw them all through
+        assert engine.journal.replay() == []
+
+        # The stub wallet never sees the donated coins spent, so they still look eligible. Another check must leave
+        # them alone all the same, as they are in flight.
+        built = list()
+        make_tx = wallet.make_unsigned_transaction
+        wallet.make_unsigned_transaction = lambda *args, **kwargs: built.append(args) or make_tx(*args, **kwargs)
+        engine.schedule_check()
+        host.run()
+        assert built == []
+        assert wallet.network.broadcasts == len(eligible)
+    finally:
+        engine.stop()
+
+def test_manual_mode_only_notifies(tmp_path):
+    host = make_engine(tmp_path, autodonate = False)
+    host.engine.start()
+    try:
+        host.run()
+    finally:
+        host.engine.stop()
+    assert host.wallet.network.broadcasts == 0
+    assert not any(host.data.history_get_count_for_address(c[2]) for c in host.data.get_charities())
+    assert host.notes
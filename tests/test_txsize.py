@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# DonateSpareChange; an auto-donation plugin for Electron Cash version 3.3+
+# Author: Calin Culianu <calin.culianu@gmail.com>
+# Copyright (C) 2019 Calin Culianu
+# LICENSE: MIT
+#
+import pytest
+
+pytest.importorskip('electroncash')
+
+from electroncash.address import Address
+
+from DonateSpareChange import txsize
+
+# The secp256k1 generator point, as a compressed & an uncompressed pubkey. Any valid point will do for sizing.
+COMPRESSED_PUBKEY = '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+UNCOMPRESSED_PUBKEY = ('0479be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+                       '483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8')
+
+
+def test_varint_size():
+    assert [ txsize.varint_size(n) for n in (0, 0xfc, 0xfd, 0xffff, 0x10000, 0xffffffff, 0x100000000) ] == [1, 1, 3, 3, 5, 5, 9]
+
+def test_input_sizes():
+    assert txsize.p2pkh_input_size() == 148
+    assert txsize.p2pkh_input_size(schnorr = True) == 141
+    assert txsize.p2pkh_input_size(compressed = False) == 180
+
+def test_output_sizes():
+    p2pkh, p2sh = Address.from_P2PKH_hash(bytes(20)), Address.from_P2SH_hash(bytes(20))
+    assert txsize.output_size(txsize.output_script_size(p2pkh)) == 34
+    assert txsize.output_size(txsize.output_script_size(p2sh)) == 32
+
+def test_estimate_tx_size():
+    assert txsize.estimate_tx_size(1, [txsize.P2PKH_SCRIPT_SIZE]) == 8 + 1 + 148 + 1 + 34
+    assert txsize.estimate_tx_size(2, [txsize.P2PKH_SCRIPT_SIZE, txsize.P2SH_SCRIPT_SIZE], schnorr = True) == 8 + 1 + 2*141 + 1 + 34 + 32
+    # varint counts grow past 252 inputs
+    assert txsize.estimate_tx_size(253, [txsize.P2PKH_SCRIPT_SIZE]) - txsize.estimate_tx_size(252, [txsize.P2PKH_SCRIPT_SIZE]) == 148 + 2
+
+
+def real_transaction_class():
+    ''' Electron Cash's Transaction, or a skip if what's importable can't serialize txs (i.e. isn't the real thing). '''
+    transaction = pytest.importorskip('electroncash.transaction')
+    if not hasattr(transaction.Transaction, 'estimated_size'):
+        pytest.skip("electroncash.transaction.Transaction can't estimate tx sizes")
+    return transaction.Transaction
+
+@pytest.mark.parametrize('num_inputs, num_p2pkh, num_p2sh, schnorr, compressed', [
+    (1, 1, 0, False, True),
+    (1, 0, 1, False, True),
+    (3, 2, 1, False, True),
+    (5, 1, 3, True, True),
+    (2, 1, 1, False, False),
+    (260, 1, 0, False, True), # 3-byte input count
+])
+def test_estimate_matches_electron_cash(num_inputs, num_p2pkh, num_p2sh, schnorr, compressed):
+    Transaction = real_transaction_class()
+    from electroncash.bitcoin import TYPE_ADDRESS
+    pubkey = COMPRESSED_PUBKEY if compressed else UNCOMPRESSED_PUBKEY
+    address = Address.from_pubkey(bytes.fromhex(pubkey))
+    inputs = [ {
+        'type' : 'p2pkh', 'address' : address, 'prevout_hash' : '%064x' % (i + 1), 'prevout_n' : i % 4, 'value' : 10000,
+        'x_pubkeys' : [pubkey], 'pubkeys' : [pubkey], 'signatures' : [None], 'num_sig' : 1, 'sequence' : 0xfffffffe,
+    } for i in range(num_inputs) ]
+    outputs = ([ (TYPE_ADDRESS, Address.from_P2PKH_hash(bytes([i]) * 20), 5000) for i in range(num_p2pkh) ]
+               + [ (TYPE_ADDRESS, Address.from_P2SH_hash(bytes([i]) * 20), 5000) for i in range(num_p2sh) ])
+    tx = Transaction.from_io(inputs, outputs, locktime = 0, **(dict(sign_schnorr = True) if schnorr else {}))
+
+    script_sizes = [ txsize.output_script_size(o[1]) for o in outputs ]
+    assert txsize.estimate_tx_size(num_inputs, script_sizes, schnorr = schnorr, compressed = compressed) == tx.estimated_size()